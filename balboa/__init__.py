@@ -8,6 +8,7 @@ Also new matching syntax is used to match events.
 """
 
 from .core import *
+from .template import *
 
 # from .core import get, post, put, patch, delete, head, options, run, framework
 
@@ -0,0 +1,86 @@
+"""
+ASGI types and message helpers shared by the Balboa modules.
+"""
+
+from typing import Any, Awaitable, Callable, Dict, Iterable, Optional, Sequence, Tuple
+
+Scope = Dict[str, Any]
+Message = Dict[str, Any]
+Receive = Callable[[], Awaitable[Message]]
+Send = Callable[[Message], Awaitable[None]]
+Headers = Iterable[Tuple[bytes, bytes]]
+ASGIApp = Callable[[Scope, Receive, Send], Awaitable[None]]
+# Takes the next app of the chain and returns the app to call instead
+Middleware = Callable[[ASGIApp], ASGIApp]
+
+
+def compose(app: ASGIApp, middleware: Sequence[Middleware]) -> ASGIApp:
+    """
+    Wrap ``app`` in ``middleware``, the first one being the outermost.
+    """
+    if not middleware:
+        return app
+    app = copy_messages(app)
+    for wrap in reversed(middleware):
+        app = wrap(app)
+    return app
+
+
+def copy_messages(app: ASGIApp) -> ASGIApp:
+    """
+    Send copies of the messages of ``app``, and of their header lists, up
+    the middleware chain. Routes, caches and broadcasts send prebuilt
+    messages shared by every request, which middleware may change in place.
+    """
+
+    async def copying(scope: Scope, receive: Receive, send: Send) -> None:
+        async def send_copy(message: Message) -> None:
+            message = dict(message)
+            headers = message.get("headers")
+            if headers is not None:
+                message["headers"] = list(headers)
+            await send(message)
+
+        await app(scope, receive, send_copy)
+
+    return copying
+
+
+def get_header(scope: Scope, name: bytes) -> Optional[bytes]:
+    for key, value in scope.get("headers", ()):
+        if key == name:
+            return value
+    return None
+
+
+async def send_plain(
+    send: Send, status: int, body: bytes, headers: Headers = ()
+) -> None:
+    await send(
+        {
+            "type": "http.response.start",
+            "status": status,
+            "headers": [
+                (b"content-type", b"text/plain"),
+                (b"content-length", str(len(body)).encode()),
+                *headers,
+            ],
+        }
+    )
+    await send({"type": "http.response.body", "body": body})
+
+
+def etag_matches(if_none_match: Optional[bytes], etag: str) -> bool:
+    """
+    Weak comparison of an If-None-Match header value with ``etag``.
+    """
+    if if_none_match is None:
+        return False
+    etag = etag.removeprefix("W/")
+    tags = [tag.strip() for tag in if_none_match.decode("latin-1").split(",")]
+    return "*" in tags or any(tag.removeprefix("W/") == etag for tag in tags)
+
+
+async def send_not_modified(send: Send, headers: Headers) -> None:
+    await send({"type": "http.response.start", "status": 304, "headers": headers})
+    await send({"type": "http.response.body", "body": b""})
@@ -0,0 +1,166 @@
+"""
+Per-route response cache, see route.cache().
+
+Entries hold the final ASGI messages of a response (compressed variants are
+separate entries), keyed on the method, the path (so the path parameters)
+and the query parameters. They expire after ``ttl`` seconds and the least
+recently used ones are evicted beyond ``max_entries`` or ``max_bytes``.
+Concurrent misses for one key run the handler once: the first request
+computes the response and the others wait for it.
+"""
+
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional, Sequence, Tuple
+from urllib.parse import parse_qs
+
+from .asgi import (
+    Message,
+    Scope,
+    Send,
+    etag_matches,
+    get_header,
+    send_not_modified,
+)
+
+Key = Tuple[Any, ...]
+
+
+class CachedResponse:
+    __slots__ = ("start", "body", "etag", "expires", "nbytes")
+
+    def __init__(self, start: Message, body: bytes, expires: float):
+        headers = start.get("headers", [])
+        if not any(key == b"content-length" for key, _ in headers):
+            headers = [*headers, (b"content-length", str(len(body)).encode())]
+        self.start = {**start, "headers": headers}
+        self.body = {"type": "http.response.body", "body": body}
+        self.etag = next((value for key, value in headers if key == b"etag"), None)
+        self.expires = expires
+        self.nbytes = len(body) + sum(len(key) + len(value) for key, value in headers)
+
+
+class ResponseCache:
+    """
+    ``query`` names the query parameters that are part of the key; None
+    keys on the whole query string. Only 200 responses are stored.
+    ``hits`` counts requests answered from the cache, including those that
+    waited for a concurrent miss, ``misses`` those that ran the handler.
+    """
+
+    def __init__(
+        self,
+        ttl: float = 60.0,
+        query: Optional[Sequence[str]] = None,
+        max_entries: int = 1024,
+        max_bytes: int = 8 * 1024 * 1024,
+    ):
+        self.ttl = ttl
+        self.query = tuple(query) if query is not None else None
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.entries: "OrderedDict[Key, CachedResponse]" = OrderedDict()
+        self.pending: Dict[Key, "asyncio.Future[Optional[CachedResponse]]"] = {}
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def key(self, scope: Scope, encoding: Optional[str]) -> Key:
+        if self.query is None:
+            query = scope["query_string"]
+        elif self.query:
+            values = parse_qs(scope["query_string"].decode())
+            query = tuple(tuple(values.get(name, ())) for name in self.query)
+        else:
+            query = None
+        return (scope["method"], scope["path"], query, encoding)
+
+    def get(self, key: Key) -> Optional[CachedResponse]:
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        if entry.expires <= time.monotonic():
+            self.discard(key)
+            return None
+        self.entries.move_to_end(key)
+        return entry
+
+    def put(self, key: Key, entry: CachedResponse) -> None:
+        if entry.nbytes > self.max_bytes:
+            return
+        self.discard(key)
+        self.entries[key] = entry
+        self.size += entry.nbytes
+        while self.size > self.max_bytes or len(self.entries) > self.max_entries:
+            _, evicted = self.entries.popitem(last=False)
+            self.size -= evicted.nbytes
+            self.evictions += 1
+
+    def discard(self, key: Key) -> None:
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.size -= entry.nbytes
+
+    def clear(self) -> None:
+        self.entries.clear()
+        self.size = 0
+
+    async def serve(
+        self,
+        scope: Scope,
+        send: Send,
+        encoding: Optional[str],
+        respond: Callable[[Send], Awaitable[None]],
+    ) -> None:
+        """
+        Answer from the cache, or call ``respond`` with a send that records
+        the response for the next requests.
+        """
+        key = self.key(scope, encoding)
+        entry = self.get(key)
+        if entry is None:
+            pending = self.pending.get(key)
+            if pending is not None:
+                # shielded so a waiter going away does not cancel the others
+                entry = await asyncio.shield(pending)
+        if entry is not None:
+            self.hits += 1
+            if entry.etag is not None and etag_matches(
+                get_header(scope, b"if-none-match"), entry.etag.decode("latin-1")
+            ):
+                await send_not_modified(send, [(b"etag", entry.etag)])
+                return
+            await send(entry.start)
+            await send(entry.body)
+            return
+        self.misses += 1
+        if key in self.pending:
+            # we waited already and got nothing storable, do not wait twice
+            await respond(send)
+            return
+        future = asyncio.get_running_loop().create_future()
+        self.pending[key] = future
+        messages = []
+
+        async def record(message: Message) -> None:
+            messages.append(message)
+            await send(message)
+
+        try:
+            await respond(record)
+            entry = self.store(key, messages)
+        finally:
+            del self.pending[key]
+            future.set_result(entry)
+
+    def store(self, key: Key, messages: Sequence[Message]) -> Optional[CachedResponse]:
+        if not messages or messages[0].get("status") != 200:
+            return None
+        if messages[-1].get("more_body", False):
+            return None
+        body = b"".join(message.get("body", b"") for message in messages[1:])
+        entry = CachedResponse(messages[0], body, time.monotonic() + self.ttl)
+        self.put(key, entry)
+        return entry
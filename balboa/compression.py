@@ -0,0 +1,146 @@
+"""
+Content-Encoding negotiation and compression for Balboa responses.
+
+gzip is always available; brotli is used when the ``brotli`` package is
+installed. Complete bodies are compressed in one go, streamed bodies (SSE and
+chunked responses) through a StreamCompressor that flushes every chunk so
+compression never forces buffering.
+"""
+
+import gzip
+import zlib
+from typing import Dict, Optional, Tuple
+
+from .asgi import Message, Scope, Send, get_header
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - optional dependency
+    brotli = None
+
+# Encodings in order of preference when the client accepts several equally.
+ENCODINGS: Tuple[str, ...] = ("br", "gzip") if brotli else ("gzip",)
+
+COMPRESSIBLE_TYPES: Tuple[str, ...] = (
+    "text/",
+    "application/javascript",
+    "application/json",
+    "application/xml",
+    "image/svg+xml",
+)
+
+
+def is_compressible(content_type: str) -> bool:
+    return content_type.startswith(COMPRESSIBLE_TYPES)
+
+
+def parse_accept_encoding(header: bytes) -> Dict[str, float]:
+    accepted = {}
+    for item in header.decode("latin-1").split(","):
+        coding, _, params = item.partition(";")
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        accepted[coding.strip().lower()] = quality
+    return accepted
+
+
+def choose_encoding(
+    header: Optional[bytes], available: Tuple[str, ...] = ENCODINGS
+) -> Optional[str]:
+    """
+    Pick the best of ``available`` for an Accept-Encoding header value, or
+    None to send the identity encoding.
+    """
+    if not header:
+        return None
+    accepted = parse_accept_encoding(header)
+    best, best_quality = None, 0.0
+    for encoding in available:
+        quality = accepted.get(encoding, accepted.get("*", 0.0))
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+
+def compress(data: bytes, encoding: str, level: int = 6) -> bytes:
+    if encoding == "br":
+        return brotli.compress(data, quality=min(level, 11))
+    return gzip.compress(data, compresslevel=level, mtime=0)
+
+
+class Compression:
+    """
+    Settings for compressing dynamic responses, see Balboa(compression=...).
+    Bodies shorter than ``minimum_size`` and content types not starting with
+    one of ``content_types`` are sent as they are. ``streams`` enables
+    compression of SSE and streamed bodies, which costs one compressor per
+    open connection.
+    """
+
+    def __init__(
+        self,
+        minimum_size: int = 500,
+        level: int = 6,
+        content_types: Tuple[str, ...] = COMPRESSIBLE_TYPES,
+        encodings: Tuple[str, ...] = ENCODINGS,
+        streams: bool = True,
+    ):
+        self.minimum_size = minimum_size
+        self.level = level
+        self.content_types = content_types
+        self.encodings = encodings
+        self.streams = streams
+
+    def accepts(self, content_type: str) -> bool:
+        return content_type.startswith(self.content_types)
+
+    def negotiate(self, scope: Scope) -> Optional[str]:
+        return choose_encoding(get_header(scope, b"accept-encoding"), self.encodings)
+
+
+class StreamCompressor:
+    def __init__(self, encoding: str, level: int = 6):
+        if encoding == "br":
+            self.compressor = brotli.Compressor(quality=min(level, 11))
+            self.flush = self.compressor.flush
+            self.finish = self.compressor.finish
+            self.compress_chunk = self.compressor.process
+        else:
+            self.compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+            self.flush = lambda: self.compressor.flush(zlib.Z_SYNC_FLUSH)
+            self.finish = self.compressor.flush
+            self.compress_chunk = self.compressor.compress
+
+    def compress(self, data: bytes, last: bool = False) -> bytes:
+        compressed = self.compress_chunk(data) if data else b""
+        return compressed + (self.finish() if last else self.flush())
+
+
+def compress_send(send: Send, encoding: str, level: int = 6) -> Send:
+    """
+    Wrap an ASGI send so the response body is compressed chunk by chunk.
+    """
+    compressor = StreamCompressor(encoding, level)
+
+    async def wrapped(message: Message) -> None:
+        if message["type"] == "http.response.start":
+            headers = [
+                (key, value)
+                for key, value in message.get("headers", ())
+                if key != b"content-length"
+            ]
+            headers.append((b"content-encoding", encoding.encode()))
+            headers.append((b"vary", b"accept-encoding"))
+            message = {**message, "headers": headers}
+        elif message["type"] == "http.response.body":
+            last = not message.get("more_body", False)
+            body = compressor.compress(message.get("body", b""), last)
+            message = {**message, "body": body}
+        await send(message)
+
+    return wrapped
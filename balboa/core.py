@@ -1,76 +1,784 @@
 import asyncio
+import hashlib
+import inspect
 import json
 import re
 import os
+import socket
+import time
 from typing import (
     Any,
     AsyncGenerator,
+    AsyncIterator,
     Awaitable,
     Callable,
     Dict,
     Generator,
+    Iterator,
     List,
     Optional,
+    Sequence,
     Set,
     Tuple,
     Union,
 )
+from asyncio import FIRST_COMPLETED
+from concurrent.futures import Executor, ThreadPoolExecutor
+from collections.abc import Mapping
+from string import Formatter
 from urllib.parse import parse_qs
 
-Scope = Dict[str, Any]
-Receive = Callable[[], Awaitable[Dict[str, Any]]]
-Send = Callable[[Dict[str, Any]], Awaitable[None]]
-Handler = Union[Callable[..., str], str]
+from .asgi import (
+    ASGIApp,
+    Headers,
+    Message,
+    Middleware,
+    Receive,
+    Scope,
+    Send,
+    compose,
+    etag_matches,
+    get_header,
+    send_not_modified,
+    send_plain,
+)
+from .cache import ResponseCache
+from .compression import Compression, compress, compress_send
+from .metrics import LATENCY_BUCKETS, METRICS_CONTENT_TYPE, Metrics
+from .multipart import MultipartError, MultipartParser, UploadFile, boundary_of
+from .server import Server
+from .serialization import Serializer, json_dumps
+from .sse import SSEChannel, SSEHub, encode_event
+from .static import StaticCache, StaticFiles
+from .template import Templates
+from .workers import EVENT, ROOM, ROUTE, Bus, Supervisor
+
+Handler = Union[Callable[..., Union[str, Awaitable[str]]], str]
+
+VARY_HEADER = (b"vary", b"accept-encoding")
+
+# Servers Balboa.run can use: uvicorn, or the asyncio one of balboa.server
+ENGINES = ("uvicorn", "native")
+
+
+class HTTPError(Exception):
+    """
+    Raised while handling a request to answer it with a plain-text error
+    response instead of the handler output.
+    """
+
+    def __init__(self, status: int, detail: str = ""):
+        super().__init__(status, detail)
+        self.status = status
+        self.detail = detail
+
+
+Converter = Callable[[str], Any]
+
+# Placeholder converters usable as {name:type} in route patterns and by name
+# in RouteContext.query. Each entry is the segment regex and the callable
+# that turns the matched text into the handler value.
+CONVERTERS: Dict[str, Tuple[str, Converter]] = {
+    "str": (r"[^/]+", str),
+    "int": (r"-?[0-9]+", int),
+    "float": (r"-?[0-9]+(?:\.[0-9]+)?", float),
+    "path": (r".+", str),
+}
+
+REQUIRED = object()
+
+QuerySpec = List[Tuple[str, Converter, Any]]
+
+
+def compile_query(spec: Dict[str, Any]) -> QuerySpec:
+    """
+    Turn ``{"radius": float, "age": (int, 10)}`` into a list of
+    (name, converter, default) entries. Parameters without a default are
+    required.
+    """
+    compiled = []
+    for name, value in spec.items():
+        convert, default = value if isinstance(value, tuple) else (value, REQUIRED)
+        if isinstance(convert, str):
+            if convert not in CONVERTERS:
+                raise ValueError(f"Unknown converter {convert!r} for {name!r}")
+            convert = CONVERTERS[convert][1]
+        compiled.append((name, convert, default))
+    return compiled
+
+
+def apply_query(query: Dict[str, List[Any]], spec: QuerySpec) -> None:
+    for name, convert, default in spec:
+        values = query.get(name)
+        if values is None:
+            if default is REQUIRED:
+                raise HTTPError(400, f"Missing query parameter {name!r}")
+            query[name] = [default]
+            continue
+        try:
+            query[name] = [convert(value) for value in values]
+        except (TypeError, ValueError):
+            raise HTTPError(400, f"Invalid value for query parameter {name!r}")
+
+
+class ClientDisconnect(Exception):
+    pass
+
+
+def param_views(params: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Expose each parameter as ``k`` (first value) and ``k[]`` (all values).
+    """
+    return {k: (v[0] if isinstance(v, list) else v) for k, v in params.items()} | {
+        f"{k}[]": v for k, v in params.items()
+    }
+
+
+class Params(Mapping):
+    """
+    Read-only view over the path parameters and the parsed query string.
+    ``k`` gives the first value and ``k[]`` all values; query parameters
+    shadow path parameters of the same name. Nothing is copied.
+    """
+
+    __slots__ = ("path_params", "query")
+
+    def __init__(self, path_params: Dict[str, Any], query: Dict[str, List[Any]]):
+        self.path_params = path_params
+        self.query = query
+
+    def __getitem__(self, key: str) -> Any:
+        if key.endswith("[]"):
+            name = key[:-2]
+            if name in self.query:
+                return self.query[name]
+            return self.path_params[name]
+        if key in self.query:
+            return self.query[key][0]
+        return self.path_params[key]
+
+    def __contains__(self, key: object) -> bool:
+        if isinstance(key, str) and key.endswith("[]"):
+            key = key[:-2]
+        return key in self.query or key in self.path_params
+
+    def __iter__(self) -> Iterator[str]:
+        for name in dict.fromkeys([*self.path_params, *self.query]):
+            yield name
+            yield f"{name}[]"
+
+    def __len__(self) -> int:
+        return 2 * len(dict.fromkeys([*self.path_params, *self.query]))
 
 
 class Request:
-    def __init__(self, params):
-        self.params: Dict[str, Any] = {
-            k: (v if isinstance(v, str) else v[0]) for k, v in params.items()
-        } | {f"{k}[]": v for k, v in params.items()}
+    """
+    The request passed to handlers. It only keeps references to the ASGI
+    scope; the query string, params, headers and cookies are parsed on
+    first access.
+    """
+
+    __slots__ = (
+        "scope",
+        "receive",
+        "max_body_size",
+        "cached_body",
+        "consumed",
+        "files",
+        "_query",
+        "_params",
+        "_headers",
+        "_cookies",
+    )
+
+    def __init__(
+        self,
+        scope: Scope,
+        receive: Optional[Receive] = None,
+        max_body_size: Optional[int] = None,
+        query: Optional[Dict[str, List[Any]]] = None,
+    ):
+        self.scope = scope
+        self.receive = receive
+        self.max_body_size = max_body_size
+        self.cached_body: Optional[bytes] = None
+        self.consumed = False
+        self.files: List[UploadFile] = []
+        self._query = query
+        self._params: Optional[Params] = None
+        self._headers: Optional[Dict[str, str]] = None
+        self._cookies: Optional[Dict[str, str]] = None
+
+    @property
+    def method(self) -> str:
+        return self.scope["method"]
+
+    @property
+    def path(self) -> str:
+        return self.scope["path"]
+
+    @property
+    def path_params(self) -> Dict[str, Any]:
+        return self.scope.get("path_params", {})
+
+    @property
+    def query(self) -> Dict[str, List[Any]]:
+        if self._query is None:
+            self._query = parse_qs(self.scope.get("query_string", b"").decode())
+        return self._query
+
+    @property
+    def params(self) -> Params:
+        if self._params is None:
+            self._params = Params(self.path_params, self.query)
+        return self._params
+
+    @property
+    def headers(self) -> Dict[str, str]:
+        """
+        Lower-cased header names; repeated headers are joined with ", ".
+        """
+        if self._headers is None:
+            headers: Dict[str, str] = {}
+            for key, value in self.scope.get("headers", ()):
+                name = key.decode("latin-1").lower()
+                value = value.decode("latin-1")
+                if name in headers:
+                    value = f"{headers[name]}, {value}"
+                headers[name] = value
+            self._headers = headers
+        return self._headers
+
+    @property
+    def cookies(self) -> Dict[str, str]:
+        if self._cookies is None:
+            cookies = {}
+            for key, value in self.scope.get("headers", ()):
+                if key != b"cookie":
+                    continue
+                for pair in value.decode("latin-1").split(";"):
+                    name, equals, morsel = pair.partition("=")
+                    if equals:
+                        cookies[name.strip()] = morsel.strip().strip('"')
+            self._cookies = cookies
+        return self._cookies
+
+    async def stream(self, max_size: Optional[int] = None) -> AsyncIterator[bytes]:
+        """
+        Iterate over the body chunks as they arrive. More than ``max_size``
+        bytes (the app max_body_size by default) answers 413, checked against
+        Content-Length before reading anything.
+        """
+        if self.cached_body is not None:
+            yield self.cached_body
+            return
+        if self.consumed or self.receive is None:
+            raise RuntimeError("Request body already consumed")
+        self.consumed = True
+        limit = max_size if max_size is not None else self.max_body_size
+        length = get_header(self.scope, b"content-length")
+        if limit is not None and length is not None and length.isdigit():
+            if int(length) > limit:
+                raise HTTPError(413, "Request body too large")
+        received = 0
+        while True:
+            message = await self.receive()
+            if message["type"] == "http.disconnect":
+                raise ClientDisconnect()
+            chunk = message.get("body", b"")
+            received += len(chunk)
+            if limit is not None and received > limit:
+                raise HTTPError(413, "Request body too large")
+            if chunk:
+                yield chunk
+            if not message.get("more_body", False):
+                return
+
+    async def body(self, max_size: Optional[int] = None) -> bytes:
+        if self.cached_body is None:
+            chunks = [chunk async for chunk in self.stream(max_size)]
+            self.cached_body = b"".join(chunks)
+        return self.cached_body
+
+    async def json(self, max_size: Optional[int] = None) -> Any:
+        try:
+            return json.loads(await self.body(max_size))
+        except ValueError:
+            raise HTTPError(400, "Invalid JSON body")
+
+    async def form(
+        self, max_size: Optional[int] = None, spool_size: int = 1024 * 1024
+    ) -> Dict[str, Any]:
+        """
+        Parse an urlencoded or multipart/form-data body into the same
+        ``k``/``k[]`` views as params. Uploaded files become UploadFile
+        objects, spooled to disk past ``spool_size`` bytes and closed once
+        the response is sent.
+        """
+        content_type = (get_header(self.scope, b"content-type") or b"").decode()
+        if content_type.startswith("multipart/form-data"):
+            boundary = boundary_of(content_type)
+            if boundary is None:
+                raise HTTPError(400, "Missing multipart boundary")
+            parser = MultipartParser(boundary, spool_size)
+            self.files = parser.files
+            try:
+                async for chunk in self.stream(max_size):
+                    await parser.feed(chunk)
+                parser.close()
+            except MultipartError as error:
+                raise HTTPError(400, str(error))
+            fields: Dict[str, List[Any]] = {}
+            for name, value in parser.fields:
+                fields.setdefault(name, []).append(value)
+            return param_views(fields)
+        body = await self.body(max_size)
+        return param_views(parse_qs(body.decode("utf-8", "replace")))
+
+    def close(self) -> None:
+        for upload in self.files:
+            upload.close()
 
 
 class Response:
-    def __init__(self, handler: Handler, content_type: str = "text/html"):
-        self.handler = (
-            handler if callable(handler) else lambda _: handler.format(**_.params)
-        )
+    """
+    HTTP handler of a route. Header bytes are encoded once here, and when the
+    handler is a string without {placeholders} the whole response is known
+    up front, so both ASGI messages (and their compressed variants) are built
+    once and reused.
+
+    On application/json routes handlers may return any value the serializer
+    accepts (dicts, lists, dataclasses...), which is encoded straight to
+    bytes, and generators are streamed as a JSON array. Constant values are
+    serialized once. ``bytes`` are sent as they are on every route, and
+    generators of str or bytes chunks are streamed on other routes.
+    """
+
+    # buffer_size of JSON arrays, whose items are usually small
+    json_buffer_size = 16384
+
+    def __init__(
+        self,
+        handler: Handler,
+        content_type: str = "text/html",
+        query: Optional[QuerySpec] = None,
+        compress: bool = True,
+        threaded: Optional[bool] = None,
+        dumps: Optional[Serializer] = None,
+        buffer_size: Optional[int] = None,
+        etag: Union[bool, Callable[["Request"], Any]] = False,
+    ):
+        self.is_json = content_type == "application/json"
+        self.dumps = dumps
+        if buffer_size is None:
+            buffer_size = self.json_buffer_size if self.is_json else 0
+        self.buffer_size = buffer_size
+        # a constant value to serialize once the app serializer is known
+        self.value: Any = None
+        if callable(handler):
+            self.handler = handler
+        elif isinstance(handler, str):
+            self.handler = lambda _: handler.format(**_.params)
+        elif isinstance(handler, bytes) or self.is_json:
+            self.handler = lambda _: handler
+            self.value = handler
+        else:
+            raise TypeError(f"Cannot send {type(handler).__name__}, use route.json")
+        self.is_async = inspect.iscoroutinefunction(handler)
+        # None follows the app setting, False keeps a sync handler inline
+        self.threaded = threaded if callable(handler) else False
+        self.executor: Optional[Executor] = None
+        self.max_body_size: Optional[int] = None
         self.content_type = content_type
+        self.query = query or []
+        self.cache: Optional[ResponseCache] = None
+        self.middleware: List[Middleware] = []
+        self.compress = compress
+        self.compression: Optional[Compression] = None
+        self.content_type_header = (b"content-type", content_type.encode())
+        self.start_message: Optional[Dict[str, Any]] = None
+        self.body_message: Optional[Dict[str, Any]] = None
+        self.variants: Dict[str, Tuple[Dict[str, Any], Dict[str, Any]]] = {}
+        # header block and body of each variant by content-encoding, written
+        # as they are by the native server
+        self.raw: Dict[Optional[str], Tuple[bytes, bytes]] = {}
+        # True hashes each body, a function returns a version key up front
+        self.hash_etag = etag is True or (bool(etag) and not callable(handler))
+        self.version = etag if callable(etag) and callable(handler) else None
+        # ETags of the constant body by content-encoding (None for identity)
+        self.etags: Dict[Optional[str], str] = {}
+        if isinstance(handler, str) and not has_placeholders(handler):
+            self.set_body(handler.format().encode())
+        elif isinstance(handler, bytes):
+            self.set_body(handler)
+
+    def bind(self, framework: "Framework") -> None:
+        """
+        Called when the route is registered to pick up the app settings.
+        """
+        if self.is_async:
+            self.threaded = False
+        elif self.threaded is None:
+            self.threaded = framework.executor is not None
+        if self.threaded:
+            self.executor = framework.executor
+        self.max_body_size = framework.max_body_size
+        if self.is_json and self.dumps is None:
+            self.dumps = framework.json_dumps
+        if self.value is not None and not isinstance(self.value, bytes):
+            self.set_body(self.dumps(self.value))
+        compression = framework.compression if self.compress else None
+        if compression is not None and not compression.accepts(self.content_type):
+            compression = None
+        self.compression = compression
+        if self.body_message is not None:
+            self.build_variants()
+
+    def build_variants(self) -> None:
+        """
+        Prebuild the messages of a constant body, with its ETags.
+        """
+        body = self.body_message["body"]
+        compression = self.compression
+        if compression is not None and len(body) < compression.minimum_size:
+            compression = None
+        headers = [VARY_HEADER] if compression is not None else []
+        etag = None
+        if self.hash_etag:
+            etag = self.etags[None] = body_etag(body)
+            headers.append((b"etag", etag.encode()))
+        self.start_message = self.start(body, headers)
+        self.raw = {}
+        self.add_raw(None, self.start_message, body)
+        if compression is None:
+            return
+        for encoding in compression.encodings:
+            data = compress(body, encoding, compression.level)
+            headers = [VARY_HEADER, (b"content-encoding", encoding.encode())]
+            if etag is not None:
+                tag = self.etags[encoding] = encoding_etag(etag, encoding)
+                headers.append((b"etag", tag.encode()))
+            self.variants[encoding] = (
+                self.start(data, headers),
+                {"type": "http.response.body", "body": data},
+            )
+            self.add_raw(encoding, self.variants[encoding][0], data)
+
+    def add_raw(
+        self, encoding: Optional[str], start_message: Dict[str, Any], body: bytes
+    ) -> None:
+        headers = start_message["headers"]
+        block = b"".join(name + b": " + value + b"\r\n" for name, value in headers)
+        # a content type with a CR or LF is left to the server to refuse
+        if block.count(b"\n") == block.count(b"\r") == len(headers):
+            self.raw[encoding] = (block, body)
+
+    def prebuilt(self, scope: Scope) -> Optional[Tuple[bytes, bytes]]:
+        """
+        The header block and body of a constant response, None when the
+        request must go through the ASGI messages: a query to validate, a
+        conditional request or a variant without raw bytes.
+        """
+        if self.query or (self.etags and get_header(scope, b"if-none-match")):
+            return None
+        if not self.variants:
+            return self.raw.get(None)
+        return self.raw.get(self.compression.negotiate(scope))
+
+    def set_body(self, body: bytes) -> None:
+        self.start_message = self.start(body)
+        self.body_message = {"type": "http.response.body", "body": body}
+
+    def start(
+        self, body: bytes, headers: Headers = (), status: int = 200
+    ) -> Dict[str, Any]:
+        return {
+            "type": "http.response.start",
+            "status": status,
+            "headers": [
+                self.content_type_header,
+                *headers,
+                (b"content-length", str(len(body)).encode()),
+            ],
+        }
 
     async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
-        params = {
-            **scope["path_params"],
-            **dict(parse_qs(scope["query_string"].decode())),
+        if self.body_message is not None and not self.query:
+            start_message, body_message = self.start_message, self.body_message
+            encoding = None
+            if self.variants:
+                encoding = self.compression.negotiate(scope)
+                if encoding is not None:
+                    start_message, body_message = self.variants[encoding]
+            if self.etags:
+                etag = self.etags[encoding]
+                if etag_matches(get_header(scope, b"if-none-match"), etag):
+                    await send_not_modified(send, self.validators(etag))
+                    return
+            await send(start_message)
+            await send(body_message)
+            return
+        if self.cache is not None:
+            encoding = None
+            if self.compression is not None:
+                encoding = self.compression.negotiate(scope)
+            await self.cache.serve(
+                scope, send, encoding, lambda send: self.respond(scope, receive, send)
+            )
+            return
+        await self.respond(scope, receive, send)
+
+    async def respond(self, scope: Scope, receive: Receive, send: Send) -> None:
+        request = None
+        try:
+            query = None
+            if self.query:
+                query = parse_qs(scope["query_string"].decode())
+                apply_query(query, self.query)
+            request = Request(scope, receive, self.max_body_size, query)
+            etag = None
+            if self.version is not None:
+                etag = version_etag(scope, self.version(request))
+                if etag_matches(get_header(scope, b"if-none-match"), etag):
+                    await send_not_modified(send, self.validators(etag))
+                    return
+            if self.is_async:
+                result = await self.handler(request)
+            elif self.threaded:
+                loop = asyncio.get_running_loop()
+                result = await loop.run_in_executor(
+                    self.executor, self.handler, request
+                )
+            else:
+                result = self.handler(request)
+            await self.send_result(scope, send, result, etag)
+        except HTTPError as error:
+            await send_plain(send, error.status, error.detail.encode())
+        except ClientDisconnect:
+            pass
+        finally:
+            if request is not None:
+                request.close()
+
+    async def send_result(
+        self, scope: Scope, send: Send, result: Any, etag: Optional[str] = None
+    ) -> None:
+        if isinstance(result, str):
+            await self.send_body(scope, send, result.encode(), etag)
+        elif inspect.isgenerator(result) or inspect.isasyncgen(result):
+            chunks = self.iterate(result)
+            if self.dumps is not None:
+                chunks = json_array(chunks, self.dumps)
+            await self.send_stream(scope, send, chunks, etag)
+        elif isinstance(result, bytes) or self.dumps is None:
+            await self.send_body(scope, send, result, etag)
+        else:
+            await self.send_body(scope, send, self.dumps(result), etag)
+
+    async def iterate(
+        self, items: Union[Generator[Any, None, None], AsyncGenerator[Any, None]]
+    ) -> AsyncIterator[Any]:
+        """
+        The items of a generator. Sync generators of threaded routes are
+        advanced on the thread pool so their blocking work stays off the loop.
+        """
+        if inspect.isasyncgen(items):
+            try:
+                async for item in items:
+                    yield item
+            finally:
+                await items.aclose()
+            return
+        try:
+            if self.threaded:
+                loop = asyncio.get_running_loop()
+                done = object()
+                while True:
+                    item = await loop.run_in_executor(self.executor, next, items, done)
+                    if item is done:
+                        return
+                    yield item
+            else:
+                for item in items:
+                    yield item
+        finally:
+            items.close()
+
+    async def send_stream(
+        self,
+        scope: Scope,
+        send: Send,
+        chunks: AsyncIterator[Union[str, bytes]],
+        etag: Optional[str] = None,
+    ) -> None:
+        """
+        Send each chunk as soon as it is produced, waiting on send so a slow
+        client slows the generator down. With buffer_size, chunks are
+        gathered until that many bytes are ready. The response starts with
+        the first chunk, so an HTTPError raised before it is still answered;
+        one raised later becomes an error ending the response early.
+        """
+        compression = self.compression
+        if compression is not None and compression.streams:
+            encoding = compression.negotiate(scope)
+            if encoding is not None:
+                send = compress_send(send, encoding, compression.level)
+        start = {
+            "type": "http.response.start",
+            "status": 200,
+            "headers": [self.content_type_header],
         }
-        body = self.handler(Request(params)).encode()
-        await send(
-            {
-                "type": "http.response.start",
-                "status": 200,
-                "headers": [(b"content-type", self.content_type.encode())],
-            }
-        )
+        if etag is not None:
+            start["headers"].append((b"etag", etag.encode()))
+        started = False
+        buffer = bytearray()
+        try:
+            async for chunk in chunks:
+                if isinstance(chunk, str):
+                    chunk = chunk.encode()
+                if not started:
+                    await send(start)
+                    started = True
+                if self.buffer_size:
+                    buffer += chunk
+                    if len(buffer) < self.buffer_size:
+                        continue
+                    chunk = bytes(buffer)
+                    buffer.clear()
+                if chunk:
+                    await send(
+                        {"type": "http.response.body", "body": chunk, "more_body": True}
+                    )
+        except HTTPError as error:
+            if not started:
+                raise
+            # too late for its status: the server aborts the truncated response
+            raise RuntimeError(
+                f"HTTPError {error.status} raised after the response started"
+            ) from error
+        if not started:
+            await send(start)
+        await send({"type": "http.response.body", "body": bytes(buffer)})
+
+    async def send_body(
+        self, scope: Scope, send: Send, body: bytes, etag: Optional[str] = None
+    ) -> None:
+        headers = []
+        compression = self.compression
+        encoding = None
+        if compression is not None and len(body) >= compression.minimum_size:
+            headers.append(VARY_HEADER)
+            encoding = compression.negotiate(scope)
+        if etag is None and self.hash_etag:
+            etag = body_etag(body)
+            if encoding is not None:
+                etag = encoding_etag(etag, encoding)
+        if etag is not None:
+            if etag_matches(get_header(scope, b"if-none-match"), etag):
+                await send_not_modified(send, self.validators(etag))
+                return
+            headers.append((b"etag", etag.encode()))
+        if encoding is not None:
+            body = compress(body, encoding, compression.level)
+            headers.append((b"content-encoding", encoding.encode()))
+        await send(self.start(body, headers))
         await send({"type": "http.response.body", "body": body})
 
+    def validators(self, etag: str) -> Headers:
+        if self.compression is None:
+            return [(b"etag", etag.encode())]
+        return [(b"etag", etag.encode()), VARY_HEADER]
+
+
+async def json_array(
+    items: AsyncIterator[Any], dumps: Serializer
+) -> AsyncIterator[bytes]:
+    separator = b"["
+    async for item in items:
+        yield separator + dumps(item)
+        separator = b","
+    yield b"[]" if separator == b"[" else b"]"
+
+
+def body_etag(body: bytes) -> str:
+    return f'"{hashlib.blake2b(body, digest_size=16).hexdigest()}"'
+
+
+def encoding_etag(etag: str, encoding: str) -> str:
+    return f'{etag[:-1]}-{encoding}"'
+
+
+def version_etag(scope: Scope, version: Any) -> str:
+    """
+    Weak ETag for a handler version key, scoped to the path and query.
+    """
+    key = f"{version}\0{scope['path']}?".encode() + scope["query_string"]
+    return f'W/"{hashlib.blake2b(key, digest_size=16).hexdigest()}"'
+
+
+def has_placeholders(template: str) -> bool:
+    try:
+        return any(field is not None for _, field, _, _ in Formatter().parse(template))
+    except ValueError:
+        return True
+
 
 class SSEWrapper:
-    def __init__(self, handler: Union[Callable[..., Awaitable[None]], str]):
-        if callable(handler):
+    """
+    An SSE route. Function handlers run once per client; a string is sent to
+    every client once a second by a single task shared by all of them, and a
+    ``channel`` route streams that channel of the app's SSEHub.
+
+    The stream runs in a task cancelled as soon as the client disconnects or
+    after ``max_lifetime`` seconds, and a comment is sent when nothing was
+    sent for ``heartbeat`` seconds. ``connections`` counts the open streams.
+    """
+
+    heartbeat_message: Message = {
+        "type": "http.response.body",
+        "body": b":\n\n",
+        "more_body": True,
+    }
+
+    def __init__(
+        self,
+        handler: Union[Callable[..., Awaitable[None]], str, None],
+        compress: bool = True,
+        channel: Optional[str] = None,
+        heartbeat: Optional[float] = 15.0,
+        max_lifetime: Optional[float] = None,
+    ):
+        self.compress = compress
+        self.compression: Optional[Compression] = None
+        self.channel_name = channel
+        self.heartbeat = heartbeat
+        self.max_lifetime = max_lifetime
+        self.connections = 0
+        self.hub: Optional[SSEHub] = None
+        self.ticker: Optional[asyncio.Task[None]] = None
+        if callable(handler) or handler is None:
             self.handler = handler
         else:
+            self.handler = None
+            self.frame = encode_event(handler)
+            self.frame_message = {
+                "type": "http.response.body",
+                "body": self.frame,
+                "more_body": True,
+            }
+            self.channel = SSEChannel(history=0)
 
-            async def new_handler(sse: SSEvent) -> None:
-                while True:
-                    await sse.send(handler)
-                    await asyncio.sleep(1)
-
-            self.handler = new_handler
+    def bind(self, framework: "Framework") -> None:
+        compression = framework.compression if self.compress else None
+        if compression is not None and compression.streams:
+            self.compression = compression
+        self.hub = framework.events
 
     async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
-        params = {
-            **scope["path_params"],
-            **dict(parse_qs(scope["query_string"].decode())),
-        }
+        if self.compression is not None:
+            encoding = self.compression.negotiate(scope)
+            if encoding is not None:
+                send = compress_send(send, encoding, self.compression.level)
         await send(
             {
                 "type": "http.response.start",
@@ -82,10 +790,72 @@ class SSEWrapper:
                 ],
             }
         )
+        last_event_id = get_header(scope, b"last-event-id")
+        sse = SSEvent(send, last_event_id.decode("latin-1") if last_event_id else None)
+        self.connections += 1
+        stream = asyncio.create_task(self.stream(sse, scope))
+        watcher = asyncio.create_task(wait_disconnect(receive))
+        deadline = None
+        if self.max_lifetime is not None:
+            deadline = time.monotonic() + self.max_lifetime
         try:
-            await self.handler(SSEvent(sender=send), **params)
-        except asyncio.CancelledError:
-            pass
+            while True:
+                timeout = self.heartbeat
+                if deadline is not None:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    timeout = remaining if timeout is None else min(timeout, remaining)
+                done, _ = await asyncio.wait(
+                    {stream, watcher}, timeout=timeout, return_when=FIRST_COMPLETED
+                )
+                if watcher in done:
+                    return
+                if stream in done:
+                    if not stream.cancelled():
+                        stream.result()
+                    break
+                if self.heartbeat is not None:
+                    if time.monotonic() - sse.sent_at >= self.heartbeat:
+                        await send(self.heartbeat_message)
+                        sse.sent_at = time.monotonic()
+        finally:
+            self.connections -= 1
+            stream.cancel()
+            watcher.cancel()
+        await send({"type": "http.response.body", "body": b"", "more_body": False})
+
+    async def stream(self, sse: "SSEvent", scope: Scope) -> None:
+        if self.handler is not None:
+            params = {
+                **scope["path_params"],
+                **dict(parse_qs(scope["query_string"].decode())),
+            }
+            await self.handler(sse, **params)
+        elif self.channel_name is not None:
+            await sse.follow(self.hub.channel(self.channel_name))
+        else:
+            await sse.write(self.frame_message)
+            if self.ticker is None:
+                self.ticker = asyncio.create_task(self.tick())
+            await sse.follow(self.channel)
+
+    async def tick(self) -> None:
+        try:
+            while True:
+                await asyncio.sleep(1)
+                if not self.channel.subscribers:
+                    return
+                self.channel.fan_out(self.frame)
+        finally:
+            self.ticker = None
+
+
+async def wait_disconnect(receive: Receive) -> None:
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            return
 
 
 class SSEvent:
@@ -94,23 +864,125 @@ class SSEvent:
     receive automatic updates from a server via HTTP connection.
     """
 
-    def __init__(self, sender: Send):
+    def __init__(self, sender: Send, last_event_id: Optional[str] = None):
         self.sender = sender
+        self.last_event_id = last_event_id
+        self.sent_at = time.monotonic()
 
-    async def send(self, message: str) -> None:
-        data = f"data: {message}\n\n".encode("utf-8")
-        await self.sender(
+    async def write(self, message: Message) -> None:
+        self.sent_at = time.monotonic()
+        await self.sender(message)
+
+    async def send(
+        self, message: str, event: Optional[str] = None, id: Optional[int] = None
+    ) -> None:
+        data = encode_event(message, event, id)
+        await self.write(
             {"type": "http.response.body", "body": data, "more_body": True}
         )
 
+    async def follow(self, channel: SSEChannel) -> None:
+        """
+        Stream ``channel`` to this client, starting with the events it missed
+        according to its Last-Event-ID, until it is dropped for falling
+        behind. Events queued meanwhile are sent together.
+        """
+        frames, queue = channel.subscribe(self.last_event_id)
+        try:
+            while True:
+                if frames:
+                    queue.writing = True
+                    await self.write(
+                        {
+                            "type": "http.response.body",
+                            "body": b"".join(frames),
+                            "more_body": True,
+                        }
+                    )
+                    queue.writing = False
+                frames = [await queue.get()]
+                while not queue.empty():
+                    frames.append(queue.get_nowait())
+                if frames[0] is None:
+                    # dropped: the channel emptied the queue before the None
+                    return
+        finally:
+            channel.unsubscribe(queue)
+
+
+# What broadcast does when a client's outbound queue is full
+SLOW_CONSUMER_POLICIES = ("drop_oldest", "drop_client", "block")
+
+
+class WebSocketRegistry:
+    """
+    Rooms (topics) that WebSocket connections of an app can join, whatever
+    their route. Joining and leaving are O(1) and a connection leaves all its
+    rooms when its handler ends. ``bus`` is set in the workers of a
+    multi-process app to relay broadcasts to the other workers.
+    """
+
+    def __init__(self):
+        self.rooms: Dict[str, Set["WebSocket"]] = {}
+        self.bus: Optional[Bus] = None
+
+    def join(self, ws: "WebSocket", room: str) -> None:
+        if room not in self.rooms:
+            self.rooms[room] = set()
+        self.rooms[room].add(ws)
+        ws.rooms.add(room)
+
+    def leave(self, ws: "WebSocket", room: str) -> None:
+        members = self.rooms.get(room)
+        if members is not None:
+            members.discard(ws)
+            if not members:
+                del self.rooms[room]
+        ws.rooms.discard(room)
+
+    def remove(self, ws: "WebSocket") -> None:
+        for room in list(ws.rooms):
+            self.leave(ws, room)
+
+    def members(self, room: str) -> Set["WebSocket"]:
+        return self.rooms.get(room, set())
+
+    async def receive(self, room: bytes, payload: bytes, binary: bytes) -> None:
+        """
+        Deliver a room message published by another worker.
+        """
+        members = self.rooms.get(room.decode())
+        if members:
+            await fan_out(members, bus_message(payload, binary))
+
 
 class WebSocketWrapper:
-    clients: Set["WebSocket"] = set()
+    """
+    A WebSocket route. ``clients`` holds the open connections of this route
+    only; they are removed when their handler returns or raises. ``path`` is
+    set when the route is added to an app.
+    """
 
     def __init__(
         self,
         handler: Union[Callable[["WebSocket", Set["WebSocket"]], Awaitable[None]], str],
+        queue_size: int = 256,
+        policy: str = "drop_client",
+        idle_timeout: Optional[float] = None,
+        rate_limit: Optional[Tuple[float, int]] = None,
+        trace: Optional[Callable[["WebSocket", Message], None]] = None,
     ):
+        if policy not in SLOW_CONSUMER_POLICIES:
+            raise ValueError(f"Unknown slow consumer policy {policy!r}")
+        self.queue_size = queue_size
+        self.policy = policy
+        self.idle_timeout = idle_timeout
+        self.rate_limit = rate_limit
+        self.trace = trace
+        self.path = ""
+        self.clients: Set[WebSocket] = set()
+        self.registry = WebSocketRegistry()
+        self.sweeper: Optional[asyncio.Task[None]] = None
         if callable(handler):
             self.handler = handler
         else:
@@ -121,11 +993,43 @@ class WebSocketWrapper:
 
             self.handler = new_handler
 
+    def bind(self, framework: "Framework") -> None:
+        self.registry = framework.websockets
+
     async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
-        ws = WebSocket(scope, receive, send)
+        ws = WebSocket(scope, receive, send, self)
         await ws.accept()
         self.clients.add(ws)
-        await self.handler(ws, self.clients)
+        if self.idle_timeout is not None and self.sweeper is None:
+            self.sweeper = asyncio.create_task(self.sweep_idle())
+        try:
+            await self.handler(ws, self.clients)
+        except BaseException:
+            ws.forget()
+            if ws.connected:
+                ws.drop(1011)
+            raise
+        if ws.connected:
+            await ws.close()
+        ws.forget()
+
+    async def sweep_idle(self) -> None:
+        """
+        Close connections that received nothing for idle_timeout seconds.
+        """
+        try:
+            while self.clients:
+                await asyncio.sleep(self.idle_timeout / 2)
+                deadline = time.monotonic() - self.idle_timeout
+                for ws in list(self.clients):
+                    if ws.last_seen < deadline:
+                        ws.forget()
+                        ws.drop(1001)
+        finally:
+            self.sweeper = None
+
+    def queued_bytes(self) -> int:
+        return sum(ws.queued_bytes for ws in self.clients)
 
 
 class WebSocket:
@@ -133,39 +1037,160 @@ class WebSocket:
     WebSocket is a communication protocol that provides full-duplex
     communication channels. It is a persistent connection between a client
     and server that both parties can use to start sending data at any time.
+
+    Messages sent by broadcast go through a bounded per-client queue drained
+    by a writer task, so a slow client never delays the others; the route
+    policy decides what happens when its queue is full. sender writes
+    directly. ``queued_bytes`` accounts for the payload waiting in the queue.
     """
 
-    def __init__(self, scope: Scope, receive: Receive, send: Send):
+    close_timeout = 5.0
+
+    def __init__(
+        self,
+        scope: Scope,
+        receive: Receive,
+        send: Send,
+        route: Optional[WebSocketWrapper] = None,
+    ):
         self.scope = scope
         self.receive = receive
         self.send = send
         self.connected = True
+        self.route = route if route is not None else WebSocketWrapper("")
+        self.queue: asyncio.Queue[Optional[Tuple[Message, int]]] = asyncio.Queue(
+            self.route.queue_size
+        )
+        self.policy = self.route.policy
+        self.queued_bytes = 0
+        self.rooms: Set[str] = set()
+        self.last_seen = time.monotonic()
+        self.trace = self.route.trace
+        if self.route.rate_limit is not None:
+            self.tokens = float(self.route.rate_limit[1])
+            self.refilled_at = self.last_seen
+        self.writer: Optional[asyncio.Task[None]] = None
+        self.closing: Optional[asyncio.Task[None]] = None
 
     async def accept(self) -> None:
         await self.send({"type": "websocket.accept"})
+        self.writer = asyncio.create_task(self.write_queue())
 
-    async def sender(self, message: str):
-        await self.send({"type": "websocket.send", "text": message})
+    async def write_queue(self) -> None:
+        try:
+            while True:
+                item = await self.queue.get()
+                if item is None:
+                    return
+                message, size = item
+                self.queued_bytes -= size
+                await self.send(message)
+        except Exception:
+            self.connected = False
+            self.forget()
+
+    def enqueue(self, message: Message, size: int = 0) -> Optional[Awaitable[None]]:
+        """
+        Queue a prebuilt ``websocket.send`` message without waiting for the
+        network. Returns an awaitable only for the "block" policy when the
+        queue is full.
+        """
+        try:
+            self.queue.put_nowait((message, size))
+        except asyncio.QueueFull:
+            match self.policy:
+                case "drop_oldest":
+                    _, dropped = self.queue.get_nowait()
+                    self.queued_bytes -= dropped
+                    self.queue.put_nowait((message, size))
+                case "drop_client":
+                    self.forget()
+                    self.drop()
+                    return None
+                case "block":
+                    self.queued_bytes += size
+                    return self.queue.put((message, size))
+        self.queued_bytes += size
+        return None
+
+    def forget(self) -> None:
+        """
+        Remove the connection from its route clients and from all rooms.
+        """
+        self.route.clients.discard(self)
+        self.route.registry.remove(self)
+
+    def drop(self, code: int = 1008) -> None:
+        """
+        Disconnect a client that cannot keep up, discarding its queue.
+        """
+        self.connected = False
+        if self.writer is not None:
+            self.writer.cancel()
+        self.queued_bytes = 0
+        self.closing = asyncio.create_task(self.send_close(code))
+
+    async def send_close(self, code: int) -> None:
+        try:
+            await self.send({"type": "websocket.close", "code": code})
+        except Exception:
+            pass
+
+    def join(self, room: str) -> None:
+        self.route.registry.join(self, room)
+
+    def leave(self, room: str) -> None:
+        self.route.registry.leave(self, room)
+
+    async def publish(self, room: str, message: Union[str, bytes]) -> None:
+        """
+        Broadcast to every connection in ``room``, across routes (and
+        workers).
+        """
+        bus = self.route.registry.bus
+        if bus is not None:
+            bus.send(ROOM, room.encode(), *bus_fields(message))
+        await fan_out(self.route.registry.members(room), message)
+
+    async def sender(self, message: Union[str, bytes]):
+        await self.send(websocket_message(message))
         return self
 
-    async def receiver(self) -> Optional[str]:
+    async def receiver(self) -> Optional[Union[str, bytes]]:
+        """
+        Receive one frame: its text, or its bytes for binary frames. Returns
+        None on disconnect.
+        """
         event = await self.receive()
-        print(f"Event: {event}")
-        print(f"Client: {self}")
-        print(f"Clients: {WebSocketWrapper.clients}")
+        self.last_seen = time.monotonic()
+        if self.trace is not None:
+            self.trace(self, event)
         match event.get("type"):
             case "websocket.receive":
-                return event.get("text", "")
+                text = event.get("text")
+                return text if text is not None else event.get("bytes", b"")
             case "websocket.disconnect":
                 self.connected = False
-                WebSocketWrapper.clients.remove(self)
+                self.forget()
+                if self.writer is not None:
+                    self.writer.cancel()
                 return None
             case _:
                 pass
 
-    async def close(self) -> None:
-        await self.send({"type": "websocket.close"})
-        WebSocketWrapper.clients.remove(self)
+    async def close(self, code: int = 1000) -> None:
+        self.forget()
+        if self.writer is not None and not self.writer.done():
+            # let the writer flush what is queued, but not forever
+            try:
+                self.queue.put_nowait(None)
+            except asyncio.QueueFull:
+                self.writer.cancel()
+            await asyncio.wait({self.writer}, timeout=self.close_timeout)
+            self.writer.cancel()
+        if self.connected:
+            self.connected = False
+            await self.send_close(code)
 
     def __aenter__(self):
         return self
@@ -176,38 +1201,520 @@ class WebSocket:
     async def __aexit__(self, *_) -> None:
         await self.close()
 
-    async def iter(self) -> AsyncGenerator[str, None]:
+    async def throttle(self, count: int = 1) -> None:
+        """
+        Token bucket for the route rate_limit: wait only when the connection
+        sends more than ``rate`` messages per second beyond its burst.
+        """
+        rate, burst = self.route.rate_limit
+        now = time.monotonic()
+        self.tokens = min(burst, self.tokens + (now - self.refilled_at) * rate)
+        self.refilled_at = now
+        self.tokens -= count
+        if self.tokens < 0:
+            await asyncio.sleep(-self.tokens / rate)
+
+    async def iter(self) -> AsyncGenerator[Union[str, bytes], None]:
         while self.connected:
             message = await self.receiver()
-            await asyncio.sleep(0.1)
-            if message:
+            if message is not None:
+                if self.route.rate_limit is not None:
+                    await self.throttle()
                 yield message
 
-    async def broadcast(self, clients: Set["WebSocket"], message: str) -> None:
-        for client in clients:
-            await client.sender(message)
+    async def batches(
+        self, max_batch: int = 64
+    ) -> AsyncGenerator[List[Union[str, bytes]], None]:
+        """
+        Like iter, but yields every frame already received (up to
+        ``max_batch``) at once, so bursts can be handled together.
+        """
+        pending: asyncio.Queue[Optional[Union[str, bytes]]] = asyncio.Queue(max_batch)
+
+        async def read() -> None:
+            while self.connected:
+                message = await self.receiver()
+                if message is not None:
+                    await pending.put(message)
+            await pending.put(None)
+
+        reader = asyncio.create_task(read())
+        try:
+            while True:
+                message = await pending.get()
+                if message is None:
+                    return
+                batch = [message]
+                closed = False
+                while len(batch) < max_batch and not pending.empty():
+                    message = pending.get_nowait()
+                    if message is None:
+                        closed = True
+                        break
+                    batch.append(message)
+                if self.route.rate_limit is not None:
+                    await self.throttle(len(batch))
+                yield batch
+                if closed:
+                    return
+        finally:
+            reader.cancel()
+
+    async def broadcast(
+        self, clients: Set["WebSocket"], message: Union[str, bytes]
+    ) -> None:
+        """
+        Queue ``message`` for every connected client. With several workers a
+        broadcast to the route clients reaches those of every worker; other
+        sets of clients are local to this worker.
+        """
+        bus = self.route.registry.bus
+        if bus is not None and clients is self.route.clients:
+            bus.send(ROUTE, self.route.path.encode(), *bus_fields(message))
+        await fan_out(clients, message)
+
+
+async def fan_out(clients: Set[WebSocket], message: Union[str, bytes]) -> None:
+    """
+    Queue ``message`` for every connected client of this worker. The ASGI
+    message is built once and shared; only clients using the "block" policy
+    with a full queue are waited for. The writers then get a turn, so a
+    burst of broadcasts only fills the queues of clients that fell behind.
+    """
+    encoded = websocket_message(message)
+    size = payload_size(message)
+    blocked = []
+    for client in list(clients):
+        if client.connected:
+            waiting = client.enqueue(encoded, size)
+            if waiting is not None:
+                blocked.append(waiting)
+    if blocked:
+        await asyncio.gather(*blocked)
+    else:
+        await asyncio.sleep(0)
+
+
+def payload_size(message: Union[str, bytes]) -> int:
+    """
+    The bytes ``message`` takes on the wire: text is sent as UTF-8.
+    """
+    if isinstance(message, bytes) or message.isascii():
+        return len(message)
+    return len(message.encode())
+
+
+def websocket_message(message: Union[str, bytes]) -> Message:
+    if isinstance(message, bytes):
+        return {"type": "websocket.send", "bytes": message}
+    return {"type": "websocket.send", "text": message}
+
+
+def bus_fields(message: Union[str, bytes]) -> Tuple[bytes, bytes]:
+    if isinstance(message, bytes):
+        return message, b"1"
+    return message.encode(), b""
 
 
-class Framework:
-    routes: List[Tuple[str, re.Pattern[str], Response]]
-    ws_routes: List[Tuple[re.Pattern[str], WebSocketWrapper]]
-    sse_routes: List[Tuple[re.Pattern[str], SSEWrapper]]
-    static_files: Tuple[str, str]
+def bus_message(payload: bytes, binary: bytes) -> Union[str, bytes]:
+    return payload if binary else payload.decode()
+
+
+Matcher = Callable[[str], Optional[Dict[str, Any]]]
+
+
+class RouteNode:
+    """
+    One path segment of a RouteTree. Static children are looked up by exact
+    segment text, dynamic children ({name} placeholders) are tried in the
+    order they were registered and a {name:path} wildcard, which swallows
+    the rest of the path, is tried last.
+    """
+
+    __slots__ = ("static", "dynamic", "wildcard", "handler")
+
+    def __init__(self):
+        self.static: Dict[str, RouteNode] = {}
+        self.dynamic: List[Tuple[str, Matcher, RouteNode]] = []
+        self.wildcard: Optional[Tuple[str, RouteNode]] = None
+        self.handler: Any = None
+
+
+class RouteTree:
+    """
+    Prefix tree of route patterns split on "/". Lookup walks one node per
+    path segment, so its cost depends on the path depth and not on the
+    number of registered routes. Static segments are preferred over
+    placeholders and the first handler registered for a pattern wins.
+    """
+
+    param_regex = re.compile(r"{(\w+)(?::(\w+))?}")
+
+    def __init__(self):
+        self.root = RouteNode()
+
+    def insert(self, path: str, handler: Any) -> None:
+        node = self.root
+        segments = path.split("/")
+        for index, segment in enumerate(segments):
+            whole = self.param_regex.fullmatch(segment)
+            if whole and whole.group(2) == "path":
+                if index != len(segments) - 1:
+                    raise ValueError(f"{segment} must be the last segment of {path}")
+                if node.wildcard is None:
+                    node.wildcard = (whole.group(1), RouteNode())
+                node = node.wildcard[1]
+                break
+            node = self._child(node, segment)
+        if node.handler is None:
+            node.handler = handler
+
+    def _child(self, node: RouteNode, segment: str) -> RouteNode:
+        if not self.param_regex.search(segment):
+            return node.static.setdefault(segment, RouteNode())
+        for key, _, child in node.dynamic:
+            if key == segment:
+                return child
+        child = RouteNode()
+        node.dynamic.append((segment, self._compile_segment(segment), child))
+        return child
+
+    def _converter(self, name: Optional[str]) -> Tuple[str, Converter]:
+        if name is None:
+            return CONVERTERS["str"]
+        if name not in CONVERTERS or name == "path":
+            raise ValueError(f"Unknown converter {name!r} in route pattern")
+        return CONVERTERS[name]
+
+    def _compile_segment(self, segment: str) -> Matcher:
+        whole = self.param_regex.fullmatch(segment)
+        if whole:
+            name = whole.group(1)
+            regex, convert = self._converter(whole.group(2))
+            if convert is str:
+                return lambda part: {name: part} if part else None
+            fullmatch = re.compile(regex).fullmatch
+            return lambda part: {name: convert(part)} if fullmatch(part) else None
+        pattern = ""
+        last = 0
+        converters: Dict[str, Converter] = {}
+        for param in self.param_regex.finditer(segment):
+            regex, converters[param.group(1)] = self._converter(param.group(2))
+            pattern += re.escape(segment[last : param.start()])
+            pattern += f"(?P<{param.group(1)}>{regex})"
+            last = param.end()
+        pattern += re.escape(segment[last:])
+        fullmatch = re.compile(pattern).fullmatch
+
+        def match(part: str) -> Optional[Dict[str, Any]]:
+            found = fullmatch(part)
+            if not found:
+                return None
+            return {k: converters[k](v) for k, v in found.groupdict().items()}
+
+        return match
+
+    def match(self, path: str) -> Optional[Tuple[Any, Dict[str, Any]]]:
+        params: Dict[str, Any] = {}
+        handler = self._match(self.root, path.split("/"), 0, params)
+        if handler is None:
+            return None
+        return handler, params
+
+    def _match(
+        self, node: RouteNode, parts: List[str], index: int, params: Dict[str, Any]
+    ) -> Any:
+        if index == len(parts):
+            return node.handler
+        part = parts[index]
+        child = node.static.get(part)
+        if child is not None:
+            handler = self._match(child, parts, index + 1, params)
+            if handler is not None:
+                return handler
+        for _, matcher, child in node.dynamic:
+            values = matcher(part)
+            if values is None:
+                continue
+            handler = self._match(child, parts, index + 1, params)
+            if handler is not None:
+                params.update(values)
+                return handler
+        if node.wildcard is not None and part:
+            name, child = node.wildcard
+            if child.handler is not None:
+                params[name] = "/".join(parts[index:])
+                return child.handler
+        return None
+
+
+class Router:
+    """
+    HTTP, WebSocket and SSE routes collected apart from an app and served
+    under a prefix as a unit with ``app.mount(prefix, router)``. A router
+    keeps its own route trees: the app strips the prefix once and matches
+    the rest of the path against that router only. The app is itself the
+    root router and routers can be mounted in routers.
+    """
+
+    def __init__(self):
+        self.routes: List[Tuple[str, str, Response]] = []
+        self.ws_routes: List[Tuple[str, WebSocketWrapper]] = []
+        self.sse_routes: List[Tuple[str, SSEWrapper]] = []
+        self.routers: Dict[str, Router] = {}
+        self.route_trees: Dict[str, RouteTree] = {}
+        self.ws_tree = RouteTree()
+        self.sse_tree = RouteTree()
+        # set when mounted, routes are bound to the app settings from then on
+        self.app: Optional[Framework] = None
+        self.parent: Optional[Router] = None
+        self.prefix = ""
 
     def add_route(self, method: str, path: str, response: Response) -> None:
-        path_regex = re.sub(r"{(\w+)}", r"(?P<\1>[^/]+)", path)
-        self.routes.append((method, re.compile(f"^{path_regex}$"), response))
+        self.routes.append((method, path, response))
+        if self.app is not None:
+            response.bind(self.app)
+            self._insert_route(method, path, response)
 
     def add_websocket_route(self, path: str, handler: WebSocketWrapper) -> None:
-        path_regex = re.sub(r"{(\w+)}", r"(?P<\1>[^/]+)", path)
-        self.ws_routes.append((re.compile(f"^{path_regex}$"), handler))
+        self.ws_routes.append((path, handler))
+        if self.app is not None:
+            handler.path = self.full_path(path)
+            handler.bind(self.app)
+            self.ws_tree.insert(path, self.app.compose(handler))
 
     def add_sse_route(self, path: str, handler: SSEWrapper) -> None:
-        path_regex = re.sub(r"{(\w+)}", r"(?P<\1>[^/]+)", path)
-        self.sse_routes.append((re.compile(f"^{path_regex}$"), handler))
+        self.sse_routes.append((path, handler))
+        if self.app is not None:
+            handler.bind(self.app)
+            self.sse_tree.insert(path, self.app.compose(handler))
+
+    def mount(self, prefix: str, router: "Router") -> None:
+        """
+        Serve the routes of ``router`` under ``prefix``, a static path like
+        "/api": "/api" and "/api/" match the router's "/" route. Mounting
+        adds one entry here and binds the router's own routes, whatever the
+        number of routes already registered.
+        """
+        prefix = prefix.rstrip("/")
+        if not prefix.startswith("/") or "{" in prefix:
+            raise ValueError(f"Mount prefix must be a static path, not {prefix!r}")
+        if prefix in self.routers:
+            raise ValueError(f"A router is already mounted at {prefix}")
+        if isinstance(router, Framework):
+            raise TypeError("An app cannot be mounted, put its routes in a Router")
+        if router is self or router.parent is not None or router.app is not None:
+            raise ValueError("The router is already mounted")
+        router.parent = self
+        self.routers[prefix] = router
+        if self.app is not None:
+            router.attach(self.app, self.prefix + prefix)
+
+    def attach(self, app: "Framework", prefix: str) -> None:
+        self.app = app
+        self.prefix = prefix
+        for _, _, response in self.routes:
+            response.bind(app)
+        for path, handler in self.ws_routes:
+            handler.path = self.full_path(path)
+            handler.bind(app)
+        for _, handler in self.sse_routes:
+            handler.bind(app)
+        for child_prefix, router in self.routers.items():
+            router.attach(app, prefix + child_prefix)
+        self._build_route_trees()
+
+    def resolve(self, scope: Scope, path: str) -> Tuple["Router", str]:
+        """
+        The router serving ``path``, this one when it is under no mount
+        prefix, and the rest of the path. Longer prefixes win and matched
+        prefixes are appended to the scope's root_path.
+        """
+        router, path, root_path = self.locate(path)
+        if root_path:
+            scope["root_path"] = scope.get("root_path", "") + root_path
+        return router, path
+
+    def locate(self, path: str) -> Tuple["Router", str, str]:
+        """
+        Like resolve, returning the matched prefixes instead of recording
+        them in a scope.
+        """
+        router = self
+        root_path = ""
+        while router.routers:
+            prefix = path
+            while prefix and prefix not in router.routers:
+                prefix = prefix[: prefix.rfind("/")]
+            if not prefix:
+                break
+            router = router.routers[prefix]
+            root_path += prefix
+            path = path[len(prefix) :] or "/"
+        return router, path, root_path
+
+    def full_path(self, path: str) -> str:
+        if not self.prefix:
+            return path
+        return self.prefix if path == "/" else self.prefix + path
+
+    def walk(self) -> Iterator["Router"]:
+        yield self
+        for router in self.routers.values():
+            yield from router.walk()
+
+    def all_ws_routes(self) -> List[Tuple[str, WebSocketWrapper]]:
+        return [
+            (router.full_path(path), handler)
+            for router in self.walk()
+            for path, handler in router.ws_routes
+        ]
+
+    def all_sse_routes(self) -> List[Tuple[str, SSEWrapper]]:
+        return [
+            (router.full_path(path), handler)
+            for router in self.walk()
+            for path, handler in router.sse_routes
+        ]
+
+    def get(self, path: str) -> "RouteContext":
+        return RouteContext("GET", path, self)
+
+    def post(self, path: str) -> "RouteContext":
+        return RouteContext("POST", path, self)
+
+    def put(self, path: str) -> "RouteContext":
+        return RouteContext("PUT", path, self)
+
+    def patch(self, path: str) -> "RouteContext":
+        return RouteContext("PATCH", path, self)
+
+    def delete(self, path: str) -> "RouteContext":
+        return RouteContext("DELETE", path, self)
+
+    def ws(self, path: str) -> "WebSocketContext":
+        return WebSocketContext(path, self)
+
+    def sse(self, path: str) -> "SSEContext":
+        return SSEContext(path, self)
+
+    def head(self, path: str) -> "RouteContext":
+        return RouteContext("HEAD", path, self)
+
+    def options(self, path: str) -> "RouteContext":
+        return RouteContext("OPTIONS", path, self)
+
+    def _insert_route(self, method: str, path: str, response: Response) -> None:
+        if method not in self.route_trees:
+            self.route_trees[method] = RouteTree()
+        self.route_trees[method].insert(
+            path, self.app.route_app(method, self.full_path(path), response)
+        )
 
-    def _set_static_files(self, url_prefix: str, directory: str) -> None:
-        self.static_files = (url_prefix, directory)
+    def _build_route_trees(self) -> None:
+        self.route_trees = {}
+        self.ws_tree = RouteTree()
+        self.sse_tree = RouteTree()
+        for method, path, response in self.routes:
+            self._insert_route(method, path, response)
+        for path, handler in self.ws_routes:
+            self.ws_tree.insert(path, self.app.compose(handler))
+        for path, handler in self.sse_routes:
+            self.sse_tree.insert(path, self.app.compose(handler))
+        for router in self.routers.values():
+            router._build_route_trees()
+
+
+class Framework(Router):
+    static_files: StaticFiles
+    templates: Templates
+    compression: Optional[Compression]
+    executor: Optional[Executor]
+    max_body_size: Optional[int]
+    websockets: WebSocketRegistry
+    middleware: List[Middleware]
+    static_app: ASGIApp
+    metrics: Optional[Metrics]
+
+    def use_middleware(self, *middleware: Middleware) -> None:
+        """
+        Add app-level middleware, wrapping every route and the static files
+        outside their own middleware. The chains are composed here, once.
+        """
+        self.middleware.extend(middleware)
+        self.static_app = self.compose(self.static_files)
+        self._build_route_trees()
+
+    def route_app(self, method: str, path: str, response: Response) -> ASGIApp:
+        app = self.compose(response, response.middleware)
+        if self.metrics is not None:
+            app = self.metrics.instrument(method, path, app)
+        return app
+
+    def enable_metrics(
+        self, path: str = "/metrics", buckets: Sequence[float] = LATENCY_BUCKETS
+    ) -> Metrics:
+        """
+        Record per-route metrics (outside the middleware) and serve them in
+        the Prometheus text format at ``path``. Apps not calling this do not
+        record anything.
+        """
+        self.metrics = Metrics(buckets)
+        self._build_route_trees()
+        self.add_route(
+            "GET",
+            path,
+            Response(
+                lambda _: self.metrics.render(
+                    self.all_ws_routes(), self.all_sse_routes()
+                ),
+                METRICS_CONTENT_TYPE,
+                threaded=False,
+            ),
+        )
+        return self.metrics
+
+    def compose(self, app: ASGIApp, middleware: Sequence[Middleware] = ()) -> ASGIApp:
+        """
+        The callable stored in the route trees: ``app`` itself when there is
+        no middleware, so those routes are dispatched without extra calls.
+        """
+        if not self.middleware and not middleware:
+            return app
+        return compose(app, [*self.middleware, *middleware])
+
+    def sse_connections(self) -> int:
+        return sum(handler.connections for _, handler in self.all_sse_routes())
+
+    def attach_bus(self, bus: Bus) -> None:
+        """
+        Relay WebSocket broadcasts and SSE publishes through ``bus`` and
+        deliver those of the other workers, see Balboa.run(workers=...).
+        """
+        self.websockets.bus = bus
+        self.events.bus = bus
+        bus.subscribe(ROUTE, self.receive_broadcast)
+        bus.subscribe(ROOM, self.websockets.receive)
+        bus.subscribe(EVENT, self.events.receive)
+
+    async def receive_broadcast(
+        self, path: bytes, payload: bytes, binary: bytes
+    ) -> None:
+        """
+        Deliver a broadcast made to the clients of a route in another worker.
+        """
+        name = path.decode()
+        for route_path, handler in self.all_ws_routes():
+            if route_path == name and handler.clients:
+                await fan_out(handler.clients, bus_message(payload, binary))
+
+    def _set_static_files(
+        self, url_prefix: str, directory: str, cache: Optional[StaticCache] = None
+    ) -> None:
+        self.static_files = StaticFiles(
+            url_prefix, directory, self._get_mime_type, cache=cache
+        )
+        self.static_app = self.compose(self.static_files)
 
     def _get_mime_type(self, file_path: str) -> str:
         # Simplistic MIME type determination
@@ -228,10 +1735,13 @@ class Framework:
 
 
 class RouteContext:
-    def __init__(self, method: str, path: str, framework: Framework):
+    def __init__(self, method: str, path: str, framework: Router):
         self.method = method
         self.path = path
         self.response: Optional[Response] = None
+        self.query_spec: QuerySpec = []
+        self.response_cache: Optional[ResponseCache] = None
+        self.middleware: List[Middleware] = []
         self.framework = framework
 
     def __enter__(self):
@@ -239,24 +1749,112 @@ class RouteContext:
 
     def __exit__(self, *_) -> None:
         if self.response:
+            self.response.query = self.query_spec
+            self.response.cache = self.response_cache
+            self.response.middleware = self.middleware
             self.framework.add_route(self.method, self.path, self.response)
         del self.method
         # del self.path
         # del self.response
 
-    def send(self, handler: Handler, type="text/html") -> None:
-        self.response = Response(handler, type)
+    def send(
+        self,
+        handler: Handler,
+        type="text/html",
+        compress: bool = True,
+        threaded: Optional[bool] = None,
+        buffer_size: Optional[int] = None,
+        etag: Union[bool, Callable[["Request"], Any]] = False,
+    ) -> None:
+        """
+        Set the route handler: a format string, a function or an ``async def``
+        coroutine function taking the Request. With ``Balboa(threads=n)`` sync
+        functions run on the app thread pool unless ``threaded=False``;
+        ``threaded=True`` offloads them even without an app pool.
+
+        Handlers written as generators (sync or async) stream their str or
+        bytes chunks; ``buffer_size`` gathers small chunks into writes of at
+        least that many bytes.
+
+        ``etag=True`` hashes each body into an ETag and answers a matching
+        If-None-Match with 304. ``etag`` can also be a function of the
+        Request returning a version key (e.g. a row's updated_at): when it
+        matches, the handler does not run at all.
+        """
+        self.response = Response(
+            handler,
+            type,
+            compress=compress,
+            threaded=threaded,
+            buffer_size=buffer_size,
+            etag=etag,
+        )
+
+    def json(
+        self,
+        handler: Union[Handler, Any],
+        compress: bool = True,
+        threaded: Optional[bool] = None,
+        dumps: Optional[Serializer] = None,
+        buffer_size: Optional[int] = None,
+        etag: Union[bool, Callable[["Request"], Any]] = False,
+    ) -> None:
+        """
+        Set a JSON handler. It may return a str or bytes holding JSON, any
+        value ``dumps`` (default: the app json_dumps) serializes, or a
+        generator streamed as an array in writes of ``buffer_size`` bytes
+        (16 KiB by default). A constant value is serialized once. ``etag``
+        works as for send.
+        """
+        self.response = Response(
+            handler,
+            "application/json",
+            compress=compress,
+            threaded=threaded,
+            dumps=dumps,
+            buffer_size=buffer_size,
+            etag=etag,
+        )
 
-    def json(self, handler: Handler) -> None:
-        self.response = Response(handler, "application/json")
+    def query(self, **spec: Any) -> None:
+        """
+        Declare the query parameters of the route, e.g.
+        ``route.query(radius=float, age=(int, 10))``. Values are converted
+        before the handler runs; missing or invalid ones answer 400.
+        """
+        self.query_spec = compile_query(spec)
+
+    def use_middleware(self, *middleware: Middleware) -> None:
+        """
+        Wrap this route only, inside the app-level middleware.
+        """
+        self.middleware.extend(middleware)
+
+    def cache(
+        self,
+        ttl: float = 60.0,
+        query: Optional[Sequence[str]] = None,
+        max_entries: int = 1024,
+        max_bytes: int = 8 * 1024 * 1024,
+    ) -> ResponseCache:
+        """
+        Cache the responses of the route for ``ttl`` seconds, keyed on the
+        path and the ``query`` parameters (all of them by default). Returns
+        the ResponseCache, whose hits and misses attributes count requests.
+        """
+        self.response_cache = ResponseCache(ttl, query, max_entries, max_bytes)
+        return self.response_cache
     
-    def render(self, template: str, kwargs) -> str:
-        with open(template) as file:
-            return file.read().format(**kwargs)
+    def render(
+        self, template: str, kwargs: Optional[Dict[str, Any]] = None, **context: Any
+    ) -> str:
+        return self.framework.app.templates.render(
+            template, {**(kwargs or {}), **context}
+        )
 
 
 class WebSocketContext:
-    def __init__(self, path: str, framework: Framework):
+    def __init__(self, path: str, framework: Router):
         self.path = path
         self.handler: Optional[WebSocketWrapper] = None
         self.framework = framework
@@ -273,12 +1871,27 @@ class WebSocketContext:
     def send(
         self,
         handler: Union[Callable[["WebSocket", Set["WebSocket"]], Awaitable[None]], str],
+        queue_size: int = 256,
+        policy: str = "drop_client",
+        idle_timeout: Optional[float] = None,
+        rate_limit: Optional[Tuple[float, int]] = None,
+        trace: Optional[Callable[["WebSocket", Message], None]] = None,
     ) -> None:
-        self.handler = WebSocketWrapper(handler)
+        """
+        Set the WebSocket handler. ``queue_size`` bounds the messages queued
+        per client by broadcast and ``policy`` ("drop_oldest", "drop_client"
+        or "block") applies when that queue is full. Connections receiving
+        nothing for ``idle_timeout`` seconds are closed. ``rate_limit`` is a
+        (messages per second, burst) pair throttling each connection's
+        iter(), and ``trace`` is called with every received ASGI event.
+        """
+        self.handler = WebSocketWrapper(
+            handler, queue_size, policy, idle_timeout, rate_limit, trace
+        )
 
 
 class SSEContext:
-    def __init__(self, path: str, framework: Framework):
+    def __init__(self, path: str, framework: Router):
         self.path = path
         self.handler: Optional[SSEWrapper] = None
         self.framework = framework
@@ -297,8 +1910,33 @@ class SSEContext:
         del self.path
         del self.handler
 
-    def send(self, handler: Union[Callable[..., Awaitable[None]], str]) -> None:
-        self.handler = SSEWrapper(handler)
+    def send(
+        self,
+        handler: Union[Callable[..., Awaitable[None]], str],
+        compress: bool = True,
+        heartbeat: Optional[float] = 15.0,
+        max_lifetime: Optional[float] = None,
+    ) -> None:
+        """
+        Set the SSE handler. A comment is sent after ``heartbeat`` seconds
+        without events so proxies keep the connection open, and connections
+        are ended after ``max_lifetime`` seconds (clients reconnect).
+        """
+        self.handler = SSEWrapper(
+            handler, compress, heartbeat=heartbeat, max_lifetime=max_lifetime
+        )
+
+    def channel(
+        self,
+        name: str,
+        compress: bool = True,
+        heartbeat: Optional[float] = 15.0,
+        max_lifetime: Optional[float] = None,
+    ) -> None:
+        """
+        Stream the app.events channel ``name`` to every client of this route.
+        """
+        self.handler = SSEWrapper(None, compress, name, heartbeat, max_lifetime)
 
 
 class Balboa(Framework):
@@ -307,13 +1945,31 @@ class Balboa(Framework):
     WebSocket and Server-Sent Events (SSE) protocols.
     """
 
-    def __init__(self, name: str = __name__):
-        super()
+    def __init__(
+        self,
+        name: str = __name__,
+        compression: Optional[Compression] = None,
+        threads: int = 0,
+        max_body_size: Optional[int] = 1024 * 1024,
+        json_dumps: Serializer = json_dumps,
+    ):
+        super().__init__()
+        self.app = self
         self.name = name
-        self.routes = []
-        self.ws_routes = []
-        self.sse_routes = []
-        self.static_files = ("/static", "static")
+        self.max_body_size = max_body_size
+        self.json_dumps = json_dumps
+        self.websockets = WebSocketRegistry()
+        self.events = SSEHub()
+        self.compression = compression if compression is not None else Compression()
+        # Sync handlers run on this pool when threads > 0, see RouteContext.send
+        self.executor = None
+        if threads:
+            self.executor = ThreadPoolExecutor(threads, thread_name_prefix="balboa")
+        self.middleware = []
+        self.metrics = None
+        self._set_static_files("/static", "static")
+        self.templates = Templates()
+        self._build_route_trees()
 
     async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
         if scope["type"] == "http":
@@ -321,115 +1977,123 @@ class Balboa(Framework):
             method = scope["method"]
 
             # Serve static files
-            static_prefix, static_dir = self.static_files
-            if path.startswith(static_prefix):
-                file_path = os.path.join(
-                    static_dir, path[len(static_prefix) :].lstrip("/")
-                )
-                if os.path.isfile(file_path):
-                    with open(file_path, "rb") as file:
-                        content = file.read()
-                    await send(
-                        {
-                            "type": "http.response.start",
-                            "status": 200,
-                            "headers": [
-                                (
-                                    b"content-type",
-                                    self._get_mime_type(file_path).encode(),
-                                ),
-                                (b"content-length", str(len(content)).encode()),
-                            ],
-                        }
-                    )
-                    await send({"type": "http.response.body", "body": content})
-                    return
-                else:
-                    await send(
-                        {
-                            "type": "http.response.start",
-                            "status": 404,
-                            "headers": [(b"content-type", b"text/plain")],
-                        }
-                    )
-                    await send(
-                        {"type": "http.response.body", "body": b"File Not Found"}
-                    )
-                    return
-
-            for route_method, route_regex, response in self.routes:
-                if route_method == method:
-                    match = route_regex.match(path)
-                    if match:
-                        scope["path_params"] = match.groupdict()
-                        await response(scope, receive, send)
-                        return
-            for route_regex, handler in self.sse_routes:
-                match = route_regex.match(path)
-                if match:
-                    scope["path_params"] = match.groupdict()
-                    await handler(scope, receive, send)
-                    return
-            await send(
-                {
-                    "type": "http.response.start",
-                    "status": 404,
-                    "headers": [(b"content-type", b"text/plain")],
-                }
-            )
-            await send({"type": "http.response.body", "body": b"Not Found"})
+            if path.startswith(self.static_files.prefix):
+                await self.static_app(scope, receive, send)
+                return
+
+            router: Router = self
+            if self.routers:
+                router, path = self.resolve(scope, path)
+            tree = router.route_trees.get(method)
+            match = tree.match(path) if tree else None
+            if match is None:
+                match = router.sse_tree.match(path)
+            if match:
+                handler, scope["path_params"] = match
+                await handler(scope, receive, send)
+                return
+            await send_plain(send, 404, b"Not Found")
 
         elif scope["type"] == "websocket":
-            path = scope["path"]
-            for route_regex, handler in self.ws_routes:
-                match = route_regex.match(path)
-                if match:
-                    scope["path_params"] = match.groupdict()
-                    await handler(scope, receive, send)
-                    return
+            router, path = self.resolve(scope, scope["path"])
+            match = router.ws_tree.match(path)
+            if match:
+                handler, scope["path_params"] = match
+                await handler(scope, receive, send)
+                return
             await send({"type": "websocket.close"})
 
-    def get(self, path: str) -> RouteContext:
-        return RouteContext("GET", path, self)
-
-    def post(self, path: str) -> RouteContext:
-        return RouteContext("POST", path, self)
-
-    def put(self, path: str) -> RouteContext:
-        return RouteContext("PUT", path, self)
-
-    def patch(self, path: str) -> RouteContext:
-        return RouteContext("PATCH", path, self)
-
-    def delete(self, path: str) -> RouteContext:
-        return RouteContext("DELETE", path, self)
-
-    def ws(self, path: str) -> WebSocketContext:
-        return WebSocketContext(path, self)
-
-    def sse(self, path: str) -> SSEContext:
-        return SSEContext(path, self)
+    def prebuilt(self, scope: Scope) -> Optional[Tuple[bytes, bytes]]:
+        """
+        Direct dispatch for the native server: the header block and body of
+        the constant response of an HTTP route with no middleware or metrics
+        around it, which the server writes without calling the app. None
+        means the request goes through __call__.
+        """
+        path = scope["path"]
+        if path.startswith(self.static_files.prefix):
+            return None
+        router: Router = self
+        if self.routers:
+            router, path, _ = self.locate(path)
+        tree = router.route_trees.get(scope["method"])
+        match = tree.match(path) if tree else None
+        if match is None or not isinstance(match[0], Response):
+            return None
+        return match[0].prebuilt(scope)
+
+    def mount(
+        self,
+        parent_path: str,
+        router: Optional[Router] = None,
+        dir: Optional[str] = None,
+        cache: Optional[StaticCache] = None,
+    ) -> None:
+        """
+        Serve the files of ``dir`` under ``parent_path``, or the routes of
+        ``router``, see Router.mount.
+        """
+        if dir is not None and router is not None:
+            raise ValueError("Mount either a router or a directory, not both")
+        if dir is not None:
+            self._set_static_files(parent_path, dir, cache)
+        elif router is None:
+            raise ValueError("mount needs a router or a dir")
+        elif not isinstance(router, Router):
+            raise TypeError(
+                f"Expected a Router to mount, got {type(router).__name__}; put "
+                "the routes in a Router() and mount it"
+            )
+        else:
+            super().mount(parent_path, router)
 
-    def head(self, path: str) -> RouteContext:
-        return RouteContext("HEAD", path, self)
+    def run(
+        self,
+        host: str = "127.0.0.1",
+        port: int = 9000,
+        workers: int = 1,
+        engine: str = "uvicorn",
+    ) -> None:
+        """
+        Serve the app with uvicorn, or with the built-in asyncio server when
+        ``engine`` is "native". ``workers`` > 1 forks that many processes
+        sharing the listening socket, connected by a local bus so broadcasts
+        and SSE publishes reach the clients of every worker; crashed or hung
+        workers are restarted.
+        """
+        if engine not in ENGINES:
+            raise ValueError(f"Unknown engine {engine!r}, use one of {ENGINES}")
+        if workers <= 1:
+            if engine == "native":
+                Server(self, host, port).run()
+                return
+            import uvicorn
+
+            uvicorn.run(self, host=host, port=port)
+            return
+
+        def serve(listener: socket.socket, bus_path: str) -> None:
+            asyncio.run(self.serve_worker(listener, bus_path, engine))
+
+        Supervisor(serve, workers).run(host, port)
+
+    async def serve_worker(
+        self, listener: socket.socket, bus_path: str, engine: str = "uvicorn"
+    ) -> None:
+        bus = Bus()
+        await bus.connect(bus_path)
+        self.attach_bus(bus)
+        if engine == "native":
+            server = Server(self)
+        else:
+            import uvicorn
 
-    def options(self, path: str) -> RouteContext:
-        return RouteContext("OPTIONS", path, self)
-    
-    def mount(self, parent_path: str, router=None, dir=None) -> None:
-        if dir:
-            self._set_static_files(parent_path, dir)
-        elif isinstance(router, RouteContext):
-            for route in self.routes:
-                if router.response in route:
-                    method = route[0]
-                    child_path = '' if router.path == '/' else router.path
-                    path = f'{parent_path}{child_path}'
-                    self.routes.remove(route)
-                    self.add_route(method, path, router.response)
-
-
-    def run(self, host: str = "127.0.0.1", port: int = 9000) -> None:
-        import uvicorn
-
-        uvicorn.run(self, host=host, port=port)
+            server = uvicorn.Server(uvicorn.Config(self, lifespan="off"))
+        serving = asyncio.create_task(server.serve(sockets=[listener]))
+        try:
+            # a worker whose supervisor went away shuts down
+            await asyncio.wait({serving, bus.reader}, return_when=FIRST_COMPLETED)
+            server.should_exit = True
+            await serving
+        finally:
+            bus.close()
@@ -0,0 +1,238 @@
+"""
+Per-route metrics in the Prometheus text format, see app.enable_metrics().
+
+Every HTTP route is wrapped, when it is registered, in a recorder holding
+its counters: requests by status, fixed-bucket histograms of the time to the
+response headers and to the end of the handler, response bytes and requests
+in flight. Recording only updates these preallocated counters; the text is
+built when /metrics is scraped, together with the WebSocket and SSE
+connection gauges.
+"""
+
+from bisect import bisect_left
+from time import perf_counter
+from typing import Any, Awaitable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from .asgi import ASGIApp, Message, Receive, Scope, Send
+
+# Upper bounds in seconds, the last bucket (+Inf) is implicit
+LATENCY_BUCKETS: Tuple[float, ...] = (
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)
+
+METRICS_CONTENT_TYPE = "text/plain; version=0.0.4"
+
+
+class Histogram:
+    __slots__ = ("buckets", "counts", "sum")
+
+    def __init__(self, buckets: Sequence[float]):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+
+    @property
+    def count(self) -> int:
+        return sum(self.counts)
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+    def render(self, name: str, labels: str, lines: List[str]) -> None:
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+        cumulative += self.counts[-1]
+        lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {cumulative}')
+        lines.append(f"{name}_sum{{{labels}}} {self.sum}")
+        lines.append(f"{name}_count{{{labels}}} {cumulative}")
+
+
+class RouteMetrics:
+    """
+    The counters of one route, keyed by method and route pattern.
+    """
+
+    __slots__ = (
+        "labels",
+        "statuses",
+        "headers_time",
+        "total_time",
+        "bytes",
+        "in_flight",
+    )
+
+    def __init__(self, method: str, path: str, buckets: Sequence[float]):
+        self.labels = f'method="{escape(method)}",route="{escape(path)}"'
+        self.statuses: Dict[int, int] = {}
+        self.headers_time = Histogram(buckets)
+        self.total_time = Histogram(buckets)
+        self.bytes = 0
+        self.in_flight = 0
+
+    def instrument(self, app: ASGIApp) -> ASGIApp:
+        # histograms are updated inline, a method call per observation
+        # would be a good part of the cost of recording
+        buckets = self.headers_time.buckets
+        headers_time, headers_counts = self.headers_time, self.headers_time.counts
+        total_time, total_counts = self.total_time, self.total_time.counts
+        statuses = self.statuses
+        # recorders of finished requests, reused so requests do not allocate
+        # one each; the coroutine frame of instrumented is all they allocate
+        idle: List[Recorder] = []
+
+        async def instrumented(scope: Scope, receive: Receive, send: Send) -> None:
+            recorder = idle.pop() if idle else Recorder()
+            recorder.send = send
+            self.in_flight += 1
+            started = perf_counter()
+            try:
+                await app(scope, receive, recorder.record)
+            finally:
+                finished = perf_counter()
+                self.in_flight -= 1
+                elapsed = finished - started
+                total_counts[bisect_left(buckets, elapsed)] += 1
+                total_time.sum += elapsed
+                status = recorder.status
+                if status:
+                    elapsed = recorder.headers_sent - started
+                    headers_counts[bisect_left(buckets, elapsed)] += 1
+                    headers_time.sum += elapsed
+                else:
+                    # a handler failing before its headers is a 500 for the server
+                    status = 500
+                statuses[status] = statuses.get(status, 0) + 1
+                self.bytes += recorder.body_bytes
+                # ASGI apps do not send once they returned
+                recorder.send = None
+                recorder.status = recorder.body_bytes = 0
+                idle.append(recorder)
+
+        return instrumented
+
+
+class Recorder:
+    """
+    Wraps the send callable of one request of an instrumented route: it
+    notes the status, when the headers went out and the body bytes, which
+    the route adds to its counters when the request is done.
+    """
+
+    __slots__ = ("send", "status", "headers_sent", "body_bytes", "record")
+
+    def __init__(self):
+        self.send: Optional[Send] = None
+        self.status = 0
+        self.headers_sent = 0.0
+        self.body_bytes = 0
+        # kept bound: calling it is much cheaper than calling the instance,
+        # and it is not a coroutine function, so sending costs no coroutine
+        self.record = self.observe
+
+    def observe(self, message: Message) -> Awaitable[None]:
+        if message["type"] == "http.response.start":
+            self.headers_sent = perf_counter()
+            self.status = message["status"]
+        else:
+            self.body_bytes += len(message.get("body", b""))
+        return self.send(message)
+
+
+class Metrics:
+    def __init__(self, buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.routes: Dict[Tuple[str, str], RouteMetrics] = {}
+
+    def instrument(self, method: str, path: str, app: ASGIApp) -> ASGIApp:
+        """
+        Wrap a route; routes registered again keep their counters.
+        """
+        key = (method, path)
+        if key not in self.routes:
+            self.routes[key] = RouteMetrics(method, path, self.buckets)
+        return self.routes[key].instrument(app)
+
+    def render(
+        self,
+        ws_routes: Iterable[Tuple[str, Any]],
+        sse_routes: Iterable[Tuple[str, Any]],
+    ) -> str:
+        """
+        The metrics text. Routes appear once they got a request; the route
+        lists of the app give the WebSocket clients and SSE connections.
+        """
+        routes = [
+            route
+            for route in self.routes.values()
+            if route.total_time.count or route.in_flight
+        ]
+        lines = [
+            "# HELP balboa_requests_total HTTP requests by route and status.",
+            "# TYPE balboa_requests_total counter",
+        ]
+        for route in routes:
+            for status, count in sorted(route.statuses.items()):
+                lines.append(
+                    f'balboa_requests_total{{{route.labels},status="{status}"}} {count}'
+                )
+        lines.append(
+            "# HELP balboa_response_headers_seconds Time until the response headers."
+        )
+        lines.append("# TYPE balboa_response_headers_seconds histogram")
+        for route in routes:
+            route.headers_time.render(
+                "balboa_response_headers_seconds", route.labels, lines
+            )
+        lines.append(
+            "# HELP balboa_request_duration_seconds Time until the last response byte."
+        )
+        lines.append("# TYPE balboa_request_duration_seconds histogram")
+        for route in routes:
+            route.total_time.render(
+                "balboa_request_duration_seconds", route.labels, lines
+            )
+        lines.append("# HELP balboa_response_bytes_total Response body bytes sent.")
+        lines.append("# TYPE balboa_response_bytes_total counter")
+        for route in routes:
+            lines.append(f"balboa_response_bytes_total{{{route.labels}}} {route.bytes}")
+        lines.append("# HELP balboa_requests_in_flight Requests being handled.")
+        lines.append("# TYPE balboa_requests_in_flight gauge")
+        for route in routes:
+            lines.append(
+                f"balboa_requests_in_flight{{{route.labels}}} {route.in_flight}"
+            )
+        lines.append("# HELP balboa_websocket_connections Open WebSocket connections.")
+        lines.append("# TYPE balboa_websocket_connections gauge")
+        for path, handler in ws_routes:
+            lines.append(
+                f'balboa_websocket_connections{{route="{escape(path)}"}} '
+                f"{len(handler.clients)}"
+            )
+        lines.append("# HELP balboa_sse_connections Open Server-Sent Events streams.")
+        lines.append("# TYPE balboa_sse_connections gauge")
+        for path, handler in sse_routes:
+            lines.append(
+                f'balboa_sse_connections{{route="{escape(path)}"}} '
+                f"{handler.connections}"
+            )
+        return "\n".join(lines) + "\n"
+
+
+def escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
@@ -0,0 +1,169 @@
+"""
+Incremental multipart/form-data parser for Request.form().
+
+The parser is fed the request body chunk by chunk. Field values are kept in
+memory, uploaded files are written to a SpooledTemporaryFile that moves to
+disk once it grows past ``spool_size`` bytes, so memory per request stays
+bounded whatever the upload size.
+"""
+
+import asyncio
+import re
+from tempfile import SpooledTemporaryFile
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+option_regex = re.compile(r';\s*([\w*-]+)=(?:"((?:[^"\\]|\\.)*)"|([^;]*))')
+
+
+class MultipartError(ValueError):
+    pass
+
+
+def parse_options(value: str) -> Tuple[str, Dict[str, str]]:
+    """
+    Split a header value like ``form-data; name="a"`` into its main value
+    and its options.
+    """
+    main, _, _ = value.partition(";")
+    options = {}
+    for match in option_regex.finditer(value):
+        quoted, plain = match.group(2), match.group(3)
+        options[match.group(1).lower()] = (
+            re.sub(r"\\(.)", r"\1", quoted) if quoted is not None else plain.strip()
+        )
+    return main.strip().lower(), options
+
+
+class UploadFile:
+    """
+    A file part of a multipart body. ``file`` is a SpooledTemporaryFile
+    positioned at the start once parsing is done.
+    """
+
+    def __init__(self, filename: str, content_type: str, spool_size: int):
+        self.filename = filename
+        self.content_type = content_type
+        self.spool_size = spool_size
+        self.file = SpooledTemporaryFile(max_size=spool_size)
+        self.size = 0
+
+    async def write(self, data: bytes) -> None:
+        self.size += len(data)
+        if self.size > self.spool_size:
+            await asyncio.to_thread(self.file.write, data)
+        else:
+            self.file.write(data)
+
+    async def read(self, size: int = -1) -> bytes:
+        if self.size > self.spool_size:
+            return await asyncio.to_thread(self.file.read, size)
+        return self.file.read(size)
+
+    def close(self) -> None:
+        self.file.close()
+
+    def __repr__(self) -> str:
+        return f"UploadFile({self.filename!r}, {self.content_type!r}, {self.size})"
+
+
+class MultipartParser:
+    def __init__(
+        self, boundary: bytes, spool_size: int = 1024 * 1024, max_header_size=16384
+    ):
+        self.delimiter = b"--" + boundary
+        self.spool_size = spool_size
+        self.max_header_size = max_header_size
+        self.buffer = b""
+        self.state = "preamble"
+        self.name = ""
+        self.value: Union[bytearray, UploadFile, None] = None
+        self.fields: List[Tuple[str, Any]] = []
+        self.files: List[UploadFile] = []
+
+    async def feed(self, data: bytes) -> None:
+        self.buffer += data
+        while True:
+            match self.state:
+                case "preamble":
+                    index = self.buffer.find(self.delimiter)
+                    if index < 0:
+                        self.buffer = self.buffer[-len(self.delimiter) :]
+                        return
+                    self.buffer = self.buffer[index + len(self.delimiter) :]
+                    self.state = "after_delimiter"
+                case "after_delimiter":
+                    if len(self.buffer) < 2:
+                        return
+                    if self.buffer.startswith(b"--"):
+                        self.state = "done"
+                        self.buffer = b""
+                        return
+                    if not self.buffer.startswith(b"\r\n"):
+                        raise MultipartError("Malformed multipart boundary")
+                    self.buffer = self.buffer[2:]
+                    self.state = "headers"
+                case "headers":
+                    index = self.buffer.find(b"\r\n\r\n")
+                    if index < 0:
+                        if len(self.buffer) > self.max_header_size:
+                            raise MultipartError("Multipart headers too large")
+                        return
+                    self.start_part(self.buffer[:index].decode("utf-8", "replace"))
+                    self.buffer = self.buffer[index + 4 :]
+                    self.state = "body"
+                case "body":
+                    index = self.buffer.find(b"\r\n" + self.delimiter)
+                    if index < 0:
+                        # keep a tail that could be the start of the delimiter
+                        keep = len(self.delimiter) + 1
+                        if len(self.buffer) > keep:
+                            await self.write(self.buffer[:-keep])
+                            self.buffer = self.buffer[-keep:]
+                        return
+                    await self.write(self.buffer[:index])
+                    self.buffer = self.buffer[index + 2 + len(self.delimiter) :]
+                    self.end_part()
+                    self.state = "after_delimiter"
+                case "done":
+                    self.buffer = b""
+                    return
+
+    def start_part(self, raw_headers: str) -> None:
+        headers = {}
+        for line in raw_headers.split("\r\n"):
+            key, _, value = line.partition(":")
+            headers[key.strip().lower()] = value.strip()
+        _, options = parse_options(headers.get("content-disposition", ""))
+        if "name" not in options:
+            raise MultipartError("Multipart part without a name")
+        self.name = options["name"]
+        if "filename" in options:
+            content_type = headers.get("content-type", "application/octet-stream")
+            self.value = UploadFile(options["filename"], content_type, self.spool_size)
+            self.files.append(self.value)
+        else:
+            self.value = bytearray()
+
+    async def write(self, data: bytes) -> None:
+        if isinstance(self.value, UploadFile):
+            await self.value.write(data)
+        else:
+            self.value += data
+
+    def end_part(self) -> None:
+        if isinstance(self.value, UploadFile):
+            self.value.file.seek(0)
+            self.fields.append((self.name, self.value))
+        else:
+            self.fields.append((self.name, self.value.decode("utf-8", "replace")))
+        self.value = None
+
+    def close(self) -> None:
+        if self.state != "done":
+            raise MultipartError("Incomplete multipart body")
+
+
+def boundary_of(content_type: str) -> Optional[bytes]:
+    _, options = parse_options(content_type)
+    boundary = options.get("boundary")
+    return boundary.encode("latin-1") if boundary else None
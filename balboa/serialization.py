@@ -0,0 +1,39 @@
+"""
+JSON serialization for Balboa json routes.
+
+Serializers take the value a handler returned and give the response body as
+bytes directly. ``orjson`` is used when it is installed, the standard library
+otherwise; both handle dataclasses. Pass another function to
+Balboa(json_dumps=...) or route.json(dumps=...) to change it.
+"""
+
+import dataclasses
+import json
+from typing import Any, Callable
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - optional dependency
+    orjson = None
+
+Serializer = Callable[[Any], bytes]
+
+
+def default(value: Any) -> Any:
+    if dataclasses.is_dataclass(value) and not isinstance(value, type):
+        return dataclasses.asdict(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+encoder = json.JSONEncoder(separators=(",", ":"), ensure_ascii=False, default=default)
+
+
+def stdlib_dumps(value: Any) -> bytes:
+    return encoder.encode(value).encode("utf-8")
+
+
+def orjson_dumps(value: Any) -> bytes:
+    return orjson.dumps(value, default=default)
+
+
+json_dumps: Serializer = orjson_dumps if orjson else stdlib_dumps
@@ -0,0 +1,1056 @@
+"""
+A native HTTP/1.1 server for Balboa.run(engine="native").
+
+Connections are asyncio.Protocol objects calling the app directly, without a
+separate ASGI server in between. Requests are parsed incrementally from the
+received bytes: the head is only scanned where new data arrived, header
+sizes and counts are bounded, and bodies are framed by Content-Length or
+chunked encoding. Each connection serves its keep-alive and pipelined
+requests in order from one task, and a response whose body is complete is
+written with a single transport write.
+
+Routes with a constant body are dispatched directly: the server looks the
+request up in the Balboa route table (Balboa.prebuilt) and writes the
+prebuilt header block and body without calling the app. Every other
+request, including WebSocket upgrades and SSE streams, goes through the
+ASGI messages as with any server, so every Balboa route works unchanged.
+"""
+
+import asyncio
+import base64
+import hashlib
+import logging
+import re
+import signal
+import socket
+import struct
+import time
+from collections import deque
+from email.utils import formatdate
+from http import HTTPStatus
+from typing import Any, Deque, List, Optional, Sequence, Set, Union
+from urllib.parse import unquote
+
+from .asgi import ASGIApp, Headers, Message, Scope
+
+logger = logging.getLogger("balboa.server")
+
+STATUS_LINES = {
+    status.value: f"HTTP/1.1 {status.value} {status.phrase}\r\n".encode()
+    for status in HTTPStatus
+}
+
+WEBSOCKET_GUID = b"258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+
+# Parser states
+HEAD, BODY, CHUNK_SIZE, CHUNK_DATA, CHUNK_END, TRAILERS = range(6)
+
+# Longest chunk-size or trailer line accepted in chunked bodies
+MAX_LINE_SIZE = 4096
+
+# Request headers deciding how the body is framed and the connection reused
+FRAMING_HEADERS = frozenset(
+    (b"content-length", b"transfer-encoding", b"connection", b"expect")
+)
+
+# A chunk-size line: hex digits and optional extensions, which are ignored
+CHUNK_SIZE_LINE = re.compile(rb"([0-9A-Fa-f]{1,16})(?:;.*)?")
+
+CONTINUE = b"HTTP/1.1 100 Continue\r\n\r\n"
+
+# Response headers the server reads before writing them
+RESPONSE_FRAMING_HEADERS = frozenset((b"content-length", b"connection"))
+
+ASGI_VERSION = {"version": "3.0", "spec_version": "2.3"}
+
+
+def status_line(status: int) -> bytes:
+    line = STATUS_LINES.get(status)
+    return line if line is not None else f"HTTP/1.1 {status} \r\n".encode()
+
+
+class ProtocolError(Exception):
+    """
+    A request that cannot be parsed; it is answered with ``status`` and the
+    connection is closed.
+    """
+
+    def __init__(self, status: int, detail: str):
+        super().__init__(status, detail)
+        self.status = status
+        self.detail = detail
+
+
+class HTTPCycle:
+    """
+    One request and its response. Body chunks are queued by the parser and
+    handed out by receive; the response head is held back until the first
+    body message, to be written together with it.
+    """
+
+    __slots__ = (
+        "protocol",
+        "scope",
+        "keep_alive",
+        "head_only",
+        "chunks",
+        "buffered",
+        "body_done",
+        "body_sent",
+        "waiter",
+        "disconnected",
+        "status",
+        "headers",
+        "started",
+        "head_written",
+        "chunked",
+        "finished",
+        "expect_continue",
+        "error",
+    )
+
+    def __init__(
+        self, protocol: "HTTPProtocol", scope: Scope, keep_alive: bool, head_only: bool
+    ):
+        self.protocol = protocol
+        self.scope = scope
+        self.keep_alive = keep_alive
+        self.head_only = head_only
+        self.chunks: List[bytes] = []
+        self.buffered = 0
+        self.body_done = False
+        self.body_sent = False
+        self.waiter: Optional[asyncio.Future[None]] = None
+        self.disconnected = False
+        self.status = 200
+        self.headers: Headers = ()
+        self.started = False
+        self.head_written = False
+        self.chunked = False
+        self.finished = False
+        self.expect_continue = False
+        self.error: Optional[ProtocolError] = None
+
+    def wake(self) -> None:
+        if self.waiter is not None and not self.waiter.done():
+            self.waiter.set_result(None)
+
+    def feed(self, chunk: bytes) -> None:
+        if self.finished:
+            # the response is sent, the rest of the body is not wanted
+            return
+        # the client did not wait for 100 Continue
+        self.expect_continue = False
+        self.chunks.append(chunk)
+        self.buffered += len(chunk)
+        if self.buffered > self.protocol.server.max_buffered_body:
+            self.protocol.pause_reading()
+        self.wake()
+
+    def end_body(self) -> None:
+        self.body_done = True
+        self.wake()
+
+    def disconnect(self) -> None:
+        self.disconnected = True
+        self.wake()
+
+    def reject(self, error: ProtocolError) -> None:
+        """
+        The body is malformed: the app sees a disconnect and the request is
+        answered with ``error`` instead, unless its response was begun.
+        """
+        self.error = error
+        self.disconnect()
+
+    async def run(self) -> None:
+        prebuilt = self.protocol.server.prebuilt
+        try:
+            raw = prebuilt(self.scope) if prebuilt is not None else None
+            if raw is not None:
+                await self.write_raw(*raw)
+            else:
+                await self.protocol.app(self.scope, self.receive, self.send)
+        except Exception:
+            logger.exception("Exception in ASGI application")
+        if self.error is not None:
+            self.keep_alive = False
+            if not self.head_written:
+                self.protocol.write_error(self.error.status, self.error.detail, True)
+            self.finished = True
+        elif not self.finished:
+            # a truncated response can only be ended by closing
+            self.keep_alive = False
+            if not self.started:
+                self.protocol.write_error(500, "Internal Server Error", True)
+            self.finished = True
+        self.chunks.clear()
+        self.protocol.resume_reading()
+
+    async def receive(self) -> Message:
+        while True:
+            if self.chunks:
+                body = (
+                    self.chunks[0] if len(self.chunks) == 1 else b"".join(self.chunks)
+                )
+                self.chunks.clear()
+                self.buffered = 0
+                self.protocol.resume_reading()
+                self.body_sent = self.body_done
+                return {
+                    "type": "http.request",
+                    "body": body,
+                    "more_body": not self.body_done,
+                }
+            if self.body_done and not self.body_sent:
+                self.body_sent = True
+                return {"type": "http.request", "body": b"", "more_body": False}
+            if self.disconnected or self.finished:
+                return {"type": "http.disconnect"}
+            if self.expect_continue:
+                # the app wants the body the client holds back until told to
+                self.expect_continue = False
+                self.protocol.transport.write(CONTINUE)
+            self.waiter = self.protocol.loop.create_future()
+            await self.waiter
+
+    async def send(self, message: Message) -> None:
+        kind = message["type"]
+        if kind == "http.response.start":
+            if self.started:
+                raise RuntimeError("The response was already started")
+            self.started = True
+            self.status = message["status"]
+            self.headers = message.get("headers", ())
+            return
+        if kind != "http.response.body":
+            raise RuntimeError(f"Unexpected ASGI message {kind!r}")
+        if not self.started:
+            raise RuntimeError("The response body was sent before its start")
+        if self.finished or self.disconnected:
+            return
+        protocol = self.protocol
+        body = message.get("body", b"")
+        more_body = message.get("more_body", False)
+        if self.head_only or self.status < 200 or self.status in (204, 304):
+            body = b""
+        if not self.head_written:
+            self.head_written = True
+            head = self.head(body, more_body)
+            if self.chunked:
+                body = chunk(body) if body else b""
+                if not more_body:
+                    body += b"0\r\n\r\n"
+            if len(body) < 65536:
+                protocol.transport.write(head + body)
+            else:
+                protocol.transport.write(head)
+                protocol.transport.write(body)
+        elif self.chunked:
+            if body:
+                body = chunk(body)
+            protocol.transport.write(body + b"0\r\n\r\n" if not more_body else body)
+        elif body:
+            protocol.transport.write(body)
+        if not more_body:
+            self.finished = True
+            self.wake()
+        if protocol.writing_paused:
+            await protocol.drain()
+
+    def head(self, body: bytes, more_body: bool) -> bytes:
+        status = self.status
+        fields = []
+        has_length = False
+        for name, value in self.headers:
+            lowered = name.lower()
+            if lowered in RESPONSE_FRAMING_HEADERS:
+                if lowered == b"content-length":
+                    has_length = True
+                elif value.lower() == b"close":
+                    self.keep_alive = False
+            fields += (name, b": ", value, b"\r\n")
+        block = b"".join(fields)
+        # a CR or LF inside a header would let it inject others
+        lines = len(self.headers)
+        if block.count(b"\n") != lines or block.count(b"\r") != lines:
+            raise RuntimeError("Invalid characters in the response headers")
+        parts = [status_line(status), self.protocol.server.date_header(), block]
+        bodiless = self.head_only or status < 200 or status in (204, 304)
+        if not has_length and not bodiless:
+            if not more_body:
+                parts += (b"content-length: ", str(len(body)).encode(), b"\r\n")
+            elif self.scope["http_version"] == "1.1":
+                self.chunked = True
+                parts.append(b"transfer-encoding: chunked\r\n")
+            else:
+                # HTTP/1.0 clients read a body of unknown length until close
+                self.keep_alive = False
+        parts.append(self.end_head())
+        return b"".join(parts)
+
+    def end_head(self) -> bytes:
+        if self.protocol.server.should_exit:
+            self.keep_alive = False
+        if not self.keep_alive:
+            return b"connection: close\r\n\r\n"
+        if self.scope["http_version"] == "1.0":
+            return b"connection: keep-alive\r\n\r\n"
+        return b"\r\n"
+
+    async def write_raw(self, block: bytes, body: bytes) -> None:
+        """
+        Write a 200 response from the prebuilt header block and body of a
+        constant route, without the ASGI messages.
+        """
+        self.started = self.head_written = self.finished = True
+        protocol = self.protocol
+        head = b"".join(
+            (STATUS_LINES[200], protocol.server.date_header(), block, self.end_head())
+        )
+        if self.head_only:
+            protocol.transport.write(head)
+        elif len(body) < 65536:
+            protocol.transport.write(head + body)
+        else:
+            protocol.transport.write(head)
+            protocol.transport.write(body)
+        if protocol.writing_paused:
+            await protocol.drain()
+
+
+def chunk(body: bytes) -> bytes:
+    return b"%x\r\n%b\r\n" % (len(body), body)
+
+
+class WebSocketCycle:
+    """
+    A WebSocket connection (RFC 6455) behind the ASGI websocket messages.
+    Frames from the client are unmasked and reassembled here; pings are
+    answered without involving the app. Extensions are not negotiated.
+    """
+
+    close_timeout = 1.0
+
+    def __init__(self, protocol: "HTTPProtocol", scope: Scope, key: bytes):
+        self.protocol = protocol
+        self.scope = scope
+        self.key = key
+        self.buffer = bytearray()
+        self.events: Deque[Message] = deque([{"type": "websocket.connect"}])
+        self.waiter: Optional[asyncio.Future[None]] = None
+        self.closing: asyncio.Future[None] = protocol.loop.create_future()
+        self.accepted = False
+        self.closed = False
+        self.disconnected = False
+        self.fragments: List[bytes] = []
+        self.fragment_opcode = 0
+
+    def wake(self) -> None:
+        if self.waiter is not None and not self.waiter.done():
+            self.waiter.set_result(None)
+
+    async def run(self) -> None:
+        try:
+            await self.protocol.app(self.scope, self.receive, self.send)
+        except Exception:
+            logger.exception("Exception in ASGI application")
+            if not self.accepted:
+                self.protocol.write_error(500, "Internal Server Error", True)
+                self.closed = True
+            else:
+                self.close(1011)
+        if not self.accepted and not self.closed:
+            self.protocol.write_error(403, "Forbidden", True)
+        elif not self.closed:
+            self.close(1000)
+        if not self.disconnected:
+            # give the client a moment to answer the close frame
+            try:
+                await asyncio.wait_for(
+                    asyncio.shield(self.closing), timeout=self.close_timeout
+                )
+            except asyncio.TimeoutError:
+                pass
+        self.protocol.transport.close()
+
+    async def receive(self) -> Message:
+        while not self.events:
+            if self.disconnected:
+                return {"type": "websocket.disconnect", "code": 1006}
+            self.waiter = self.protocol.loop.create_future()
+            await self.waiter
+        event = self.events.popleft()
+        if len(self.events) < self.protocol.server.max_queued_messages // 2:
+            self.protocol.resume_reading()
+        return event
+
+    async def send(self, message: Message) -> None:
+        kind = message["type"]
+        if self.disconnected or self.closed:
+            raise ConnectionResetError("The WebSocket connection is closed")
+        protocol = self.protocol
+        if kind == "websocket.accept" and not self.accepted:
+            self.accepted = True
+            accept = base64.b64encode(hashlib.sha1(self.key + WEBSOCKET_GUID).digest())
+            parts = [
+                b"HTTP/1.1 101 Switching Protocols\r\n",
+                b"upgrade: websocket\r\nconnection: Upgrade\r\n",
+                b"sec-websocket-accept: ",
+                accept,
+                b"\r\n",
+            ]
+            subprotocol = message.get("subprotocol")
+            if subprotocol:
+                parts += (b"sec-websocket-protocol: ", subprotocol.encode(), b"\r\n")
+            for name, value in message.get("headers", ()):
+                parts += (name, b": ", value, b"\r\n")
+            parts.append(b"\r\n")
+            protocol.transport.write(b"".join(parts))
+        elif kind == "websocket.close":
+            if not self.accepted:
+                protocol.write_error(403, "Forbidden", True)
+                self.closed = True
+                self.closing.set_result(None)
+                return
+            self.close(message.get("code", 1000), message.get("reason") or "")
+        elif kind == "websocket.send" and self.accepted:
+            text = message.get("text")
+            if text is not None:
+                protocol.transport.write(frame(0x1, text.encode()))
+            else:
+                protocol.transport.write(frame(0x2, message.get("bytes") or b""))
+        else:
+            raise RuntimeError(f"Unexpected ASGI message {kind!r}")
+        if protocol.writing_paused:
+            await protocol.drain()
+
+    def close(self, code: int, reason: str = "") -> None:
+        if self.closed:
+            return
+        self.closed = True
+        self.protocol.transport.write(
+            frame(0x8, struct.pack("!H", code) + reason.encode())
+        )
+
+    def fail(self, code: int) -> None:
+        """
+        Close the connection on a protocol error from the client.
+        """
+        self.close(code)
+        self.receive_close(code)
+        self.protocol.transport.close()
+
+    def receive_close(self, code: int) -> None:
+        self.events.append({"type": "websocket.disconnect", "code": code})
+        if not self.closing.done():
+            self.closing.set_result(None)
+        self.wake()
+
+    def disconnect(self) -> None:
+        if not self.disconnected:
+            self.disconnected = True
+            if not self.closing.done():
+                self.receive_close(1006)
+
+    def feed(self, data: Union[bytes, bytearray]) -> None:
+        buffer = self.buffer
+        buffer += data
+        view = memoryview(buffer)
+        position = 0
+        max_size = self.protocol.server.max_message_size
+        try:
+            while len(buffer) - position >= 2 and not self.closing.done():
+                first, second = buffer[position], buffer[position + 1]
+                opcode = first & 0x0F
+                length = second & 0x7F
+                offset = position + 2
+                if first & 0x70 or not second & 0x80:
+                    # reserved bits without an extension, or an unmasked frame
+                    self.fail(1002)
+                    return
+                if length == 126:
+                    if len(buffer) < offset + 2:
+                        break
+                    (length,) = struct.unpack_from("!H", buffer, offset)
+                    offset += 2
+                elif length == 127:
+                    if len(buffer) < offset + 8:
+                        break
+                    (length,) = struct.unpack_from("!Q", buffer, offset)
+                    offset += 8
+                if opcode >= 0x8 and (length > 125 or not first & 0x80):
+                    self.fail(1002)
+                    return
+                if length > max_size:
+                    self.fail(1009)
+                    return
+                if len(buffer) < offset + 4 + length:
+                    break
+                mask = bytes(view[offset : offset + 4])
+                offset += 4
+                payload = unmask(view[offset : offset + length], mask)
+                position = offset + length
+                self.frame_received(bool(first & 0x80), opcode, payload)
+        finally:
+            view.release()
+            del buffer[:position]
+
+    def frame_received(self, fin: bool, opcode: int, payload: bytes) -> None:
+        if opcode == 0x8:
+            code = struct.unpack("!H", payload[:2])[0] if len(payload) >= 2 else 1005
+            self.close(1000 if code in (1005, 1006) else code)
+            self.receive_close(code)
+            self.protocol.transport.close()
+        elif opcode == 0x9:
+            if not self.closed:
+                self.protocol.transport.write(frame(0xA, payload))
+        elif opcode == 0xA:
+            pass
+        elif opcode in (0x1, 0x2):
+            if self.fragments:
+                self.fail(1002)
+            elif fin:
+                self.message_received(opcode, payload)
+            else:
+                self.fragments.append(payload)
+                self.fragment_opcode = opcode
+        elif opcode == 0x0 and self.fragments:
+            self.fragments.append(payload)
+            if sum(map(len, self.fragments)) > self.protocol.server.max_message_size:
+                self.fail(1009)
+            elif fin:
+                payload = b"".join(self.fragments)
+                self.fragments.clear()
+                self.message_received(self.fragment_opcode, payload)
+        else:
+            self.fail(1002)
+
+    def message_received(self, opcode: int, payload: bytes) -> None:
+        if opcode == 0x1:
+            try:
+                text = payload.decode("utf-8")
+            except UnicodeDecodeError:
+                self.fail(1007)
+                return
+            self.events.append({"type": "websocket.receive", "text": text})
+        else:
+            self.events.append({"type": "websocket.receive", "bytes": payload})
+        if len(self.events) >= self.protocol.server.max_queued_messages:
+            self.protocol.pause_reading()
+        self.wake()
+
+
+def frame(opcode: int, payload: bytes) -> bytes:
+    length = len(payload)
+    if length < 126:
+        return bytes((0x80 | opcode, length)) + payload
+    if length < 65536:
+        return struct.pack("!BBH", 0x80 | opcode, 126, length) + payload
+    return struct.pack("!BBQ", 0x80 | opcode, 127, length) + payload
+
+
+def unmask(data: memoryview, mask: bytes) -> bytes:
+    # one XOR over the payload as a big integer instead of a loop per byte
+    length = len(data)
+    if not length:
+        return b""
+    key = (mask * (length // 4 + 1))[:length]
+    value = int.from_bytes(data, "big") ^ int.from_bytes(key, "big")
+    return value.to_bytes(length, "big")
+
+
+class HTTPProtocol(asyncio.Protocol):
+    """
+    One client connection. The parser queues requests in ``pending`` and a
+    single task runs them one after the other, so pipelined responses are
+    written in order; reading is paused while too much is queued.
+    """
+
+    linger_timeout = 2.0
+
+    def __init__(self, server: "Server"):
+        self.server = server
+        self.app = server.app
+        self.loop = server.loop
+        self.transport: Optional[asyncio.Transport] = None
+        self.buffer = bytearray()
+        self.scanned = 0
+        self.state = HEAD
+        self.remaining = 0
+        self.cycle: Optional[HTTPCycle] = None
+        self.current: Optional[Union[HTTPCycle, WebSocketCycle]] = None
+        self.pending: Deque[Union[HTTPCycle, WebSocketCycle, ProtocolError]] = deque()
+        self.websocket: Optional[WebSocketCycle] = None
+        self.ready: Optional[asyncio.Future[None]] = None
+        self.runner: Optional[asyncio.Task[None]] = None
+        self.timer: Optional[asyncio.TimerHandle] = None
+        self.reading_paused = False
+        self.writing_paused = False
+        self.drained: Optional[asyncio.Future[None]] = None
+        self.rejected = False
+        self.closed = False
+        self.address: Any = None
+        self.client: Any = None
+
+    def connection_made(self, transport: asyncio.BaseTransport) -> None:
+        self.transport = transport
+        self.server.connections.add(self)
+        self.address = transport.get_extra_info("sockname")
+        self.client = transport.get_extra_info("peername")
+        if not isinstance(self.address, tuple):
+            self.address = self.client = None
+        self.runner = self.loop.create_task(self.serve())
+        self.arm_timer()
+
+    def connection_lost(self, exc: Optional[Exception]) -> None:
+        self.closed = True
+        self.server.connections.discard(self)
+        self.cancel_timer()
+        if self.current is not None:
+            self.current.disconnect()
+        if self.websocket is not None:
+            self.websocket.disconnect()
+        self.pending.clear()
+        self.wake()
+        if self.drained is not None and not self.drained.done():
+            self.drained.set_result(None)
+
+    def data_received(self, data: bytes) -> None:
+        if self.websocket is not None:
+            self.websocket.feed(data)
+            return
+        if self.rejected:
+            return
+        self.buffer += data
+        try:
+            self.parse()
+        except ProtocolError as error:
+            self.rejected = True
+            if self.state != HEAD and self.cycle is not None:
+                self.cycle.reject(error)
+            else:
+                self.pending.append(error)
+                self.wake()
+
+    def parse(self) -> None:
+        buffer = self.buffer
+        server = self.server
+        position = 0
+        try:
+            while position < len(buffer):
+                state = self.state
+                if state == HEAD:
+                    end = buffer.find(b"\r\n\r\n", max(self.scanned, position))
+                    if end < 0:
+                        if len(buffer) - position > server.max_header_size:
+                            raise ProtocolError(431, "Request header too large")
+                        self.scanned = max(len(buffer) - 3, position)
+                        return
+                    if end - position > server.max_header_size:
+                        raise ProtocolError(431, "Request header too large")
+                    head = bytes(buffer[position:end])
+                    position = end + 4
+                    self.scanned = position
+                    self.request(head)
+                    if self.websocket is not None:
+                        self.websocket.feed(buffer[position:])
+                        position = len(buffer)
+                        return
+                elif state == BODY or state == CHUNK_DATA:
+                    size = min(self.remaining, len(buffer) - position)
+                    self.cycle.feed(bytes(buffer[position : position + size]))
+                    position += size
+                    self.remaining -= size
+                    if not self.remaining:
+                        if state == BODY:
+                            self.cycle.end_body()
+                            self.state = HEAD
+                        else:
+                            self.state = CHUNK_END
+                elif state == CHUNK_SIZE or state == TRAILERS:
+                    end = buffer.find(b"\r\n", position)
+                    if end < 0:
+                        if len(buffer) - position > MAX_LINE_SIZE:
+                            raise ProtocolError(400, "Invalid chunked body")
+                        return
+                    line = bytes(buffer[position:end])
+                    position = end + 2
+                    if state == TRAILERS:
+                        if not line:
+                            self.cycle.end_body()
+                            self.state = HEAD
+                        continue
+                    found = CHUNK_SIZE_LINE.fullmatch(line)
+                    if found is None:
+                        raise ProtocolError(400, "Invalid chunk size")
+                    size = int(found.group(1), 16)
+                    if size:
+                        self.remaining = size
+                        self.state = CHUNK_DATA
+                    else:
+                        self.state = TRAILERS
+                else:
+                    if len(buffer) - position < 2:
+                        return
+                    if buffer[position : position + 2] != b"\r\n":
+                        raise ProtocolError(400, "Invalid chunked body")
+                    position += 2
+                    self.state = CHUNK_SIZE
+        finally:
+            del buffer[:position]
+            self.scanned = max(self.scanned - position, 0)
+
+    def request(self, head: bytes) -> None:
+        server = self.server
+        lines = head.split(b"\r\n")
+        try:
+            method, target, version = lines[0].split(b" ")
+        except ValueError:
+            raise ProtocolError(400, "Invalid request line")
+        if version == b"HTTP/1.1":
+            http_version = "1.1"
+        elif version == b"HTTP/1.0":
+            http_version = "1.0"
+        else:
+            raise ProtocolError(505, "HTTP version not supported")
+        if len(lines) > server.max_headers + 1:
+            raise ProtocolError(431, "Too many request headers")
+        headers = []
+        framing = []
+        for line in lines[1:]:
+            name, colon, value = line.partition(b":")
+            if not colon or not name or name[-1] in b" \t" or line[0] in b" \t":
+                raise ProtocolError(400, "Invalid request header")
+            name = name.lower()
+            header = (name, value.strip(b" \t"))
+            headers.append(header)
+            if name in FRAMING_HEADERS:
+                framing.append(header)
+        length = None
+        chunked = False
+        keep_alive = http_version == "1.1"
+        upgrade = False
+        expect_continue = False
+        for name, value in framing:
+            if name == b"content-length":
+                if not value.isdigit() or (length is not None and int(value) != length):
+                    raise ProtocolError(400, "Invalid Content-Length")
+                length = int(value)
+            elif name == b"transfer-encoding":
+                if value.lower() != b"chunked":
+                    raise ProtocolError(501, "Unsupported Transfer-Encoding")
+                chunked = True
+            elif name == b"connection":
+                tokens = value.lower()
+                if b"close" in tokens:
+                    keep_alive = False
+                elif b"keep-alive" in tokens:
+                    keep_alive = True
+                upgrade = upgrade or b"upgrade" in tokens
+            elif name == b"expect":
+                if value.lower() != b"100-continue":
+                    raise ProtocolError(417, "Unsupported expectation")
+                expect_continue = http_version == "1.1"
+        if chunked and length is not None:
+            raise ProtocolError(400, "Both Content-Length and Transfer-Encoding")
+        raw_path, _, query_string = target.partition(b"?")
+        if not raw_path.startswith(b"/"):
+            raise ProtocolError(400, "Invalid request target")
+        try:
+            path = raw_path.decode("ascii")
+        except UnicodeDecodeError:
+            raise ProtocolError(400, "Invalid request target")
+        if "%" in path:
+            path = unquote(path)
+        scope = {
+            "type": "http",
+            "asgi": ASGI_VERSION,
+            "http_version": http_version,
+            "server": self.address,
+            "client": self.client,
+            "scheme": "http",
+            "method": method.decode("ascii"),
+            "root_path": "",
+            "path": path,
+            "raw_path": raw_path,
+            "query_string": query_string,
+            "headers": headers,
+        }
+        if upgrade and self.websocket_upgrade(scope, headers):
+            return
+        cycle = HTTPCycle(self, scope, keep_alive, method == b"HEAD")
+        self.cycle = cycle
+        if chunked:
+            self.state = CHUNK_SIZE
+        elif length:
+            self.remaining = length
+            self.state = BODY
+        else:
+            cycle.end_body()
+        cycle.expect_continue = expect_continue and not cycle.body_done
+        self.pending.append(cycle)
+        if len(self.pending) > server.max_pipelined:
+            self.pause_reading()
+        self.wake()
+
+    def websocket_upgrade(self, scope: Scope, headers: Headers) -> bool:
+        values = dict(headers)
+        if values.get(b"upgrade", b"").lower() != b"websocket":
+            return False
+        key = values.get(b"sec-websocket-key")
+        if scope["method"] != "GET" or not key:
+            raise ProtocolError(400, "Invalid WebSocket handshake")
+        if values.get(b"sec-websocket-version") != b"13":
+            raise ProtocolError(426, "Unsupported WebSocket version")
+        protocols = values.get(b"sec-websocket-protocol", b"").decode("latin-1")
+        scope.update(
+            type="websocket",
+            scheme="ws",
+            subprotocols=[name.strip() for name in protocols.split(",") if name],
+        )
+        del scope["method"]
+        self.websocket = WebSocketCycle(self, scope, key)
+        self.pending.append(self.websocket)
+        self.wake()
+        return True
+
+    async def serve(self) -> None:
+        while not self.closed:
+            if not self.pending:
+                self.ready = self.loop.create_future()
+                await self.ready
+                continue
+            current = self.pending.popleft()
+            if isinstance(current, ProtocolError):
+                self.write_error(current.status, current.detail, True)
+                self.linger()
+                return
+            self.cancel_timer()
+            if len(self.pending) <= self.server.max_pipelined:
+                self.resume_reading()
+            self.current = current
+            try:
+                await current.run()
+            finally:
+                self.current = None
+            if isinstance(current, WebSocketCycle):
+                return
+            if not current.keep_alive:
+                if self.rejected:
+                    self.linger()
+                else:
+                    self.transport.close()
+                return
+            if not self.pending:
+                self.arm_timer()
+
+    def wake(self) -> None:
+        if self.ready is not None and not self.ready.done():
+            self.ready.set_result(None)
+
+    def write_error(self, status: int, detail: str, close: bool) -> None:
+        body = detail.encode()
+        self.transport.write(
+            b"".join(
+                (
+                    status_line(status),
+                    self.server.date_header(),
+                    b"content-type: text/plain; charset=utf-8\r\n",
+                    b"content-length: %d\r\n" % len(body),
+                    b"connection: close\r\n\r\n" if close else b"\r\n",
+                    body,
+                )
+            )
+        )
+
+    def linger(self) -> None:
+        """
+        Close after refusing a request the client may still be sending.
+        Closing with unread data resets the connection, which can discard
+        the error response on the client side, so the writing side is shut
+        and the rest is read and dropped until the client closes, or for
+        ``linger_timeout`` seconds at most.
+        """
+        if self.transport.can_write_eof():
+            self.transport.write_eof()
+        self.resume_reading()
+        self.cancel_timer()
+        self.timer = self.loop.call_later(self.linger_timeout, self.transport.close)
+
+    def arm_timer(self) -> None:
+        self.cancel_timer()
+        self.timer = self.loop.call_later(
+            self.server.keep_alive_timeout, self.idle_timeout
+        )
+
+    def cancel_timer(self) -> None:
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+
+    def idle_timeout(self) -> None:
+        self.timer = None
+        if self.current is None and not self.pending:
+            self.transport.close()
+
+    def shutdown(self) -> None:
+        """
+        Close now when idle; busy connections close after their response.
+        """
+        if self.current is None and not self.pending:
+            self.transport.close()
+        elif isinstance(self.current, WebSocketCycle):
+            self.current.close(1012)
+
+    def pause_reading(self) -> None:
+        if not self.reading_paused and not self.closed:
+            self.reading_paused = True
+            self.transport.pause_reading()
+
+    def resume_reading(self) -> None:
+        if self.reading_paused and not self.closed:
+            self.reading_paused = False
+            self.transport.resume_reading()
+
+    def pause_writing(self) -> None:
+        self.writing_paused = True
+
+    def resume_writing(self) -> None:
+        self.writing_paused = False
+        if self.drained is not None and not self.drained.done():
+            self.drained.set_result(None)
+
+    async def drain(self) -> None:
+        if self.closed:
+            return
+        if self.drained is None or self.drained.done():
+            self.drained = self.loop.create_future()
+        await self.drained
+
+
+class Server:
+    """
+    Serve an ASGI app (a Balboa app) on ``host``:``port`` or on the given
+    sockets. Like uvicorn.Server, setting ``should_exit`` or SIGINT/SIGTERM
+    stops it: idle connections are closed at once and busy ones get
+    ``shutdown_timeout`` seconds to finish.
+
+    Request heads are limited to ``max_header_size`` bytes and
+    ``max_headers`` headers (431), at most ``max_pipelined`` requests are
+    queued per connection and ``max_buffered_body`` bytes of a body not yet
+    received by the app; reading from the client is paused beyond that.
+    WebSocket messages are limited to ``max_message_size`` bytes.
+
+    An app with a ``prebuilt(scope)`` method, like Balboa, may answer a
+    request with the header block and body of a 200 response for the server
+    to write, or None to be called as an ASGI app.
+    """
+
+    def __init__(
+        self,
+        app: ASGIApp,
+        host: str = "127.0.0.1",
+        port: int = 9000,
+        max_header_size: int = 16384,
+        max_headers: int = 100,
+        max_pipelined: int = 32,
+        max_buffered_body: int = 256 * 1024,
+        max_message_size: int = 16 * 1024 * 1024,
+        max_queued_messages: int = 64,
+        keep_alive_timeout: float = 5.0,
+        shutdown_timeout: float = 5.0,
+    ):
+        self.app = app
+        # direct dispatch of the constant routes of a Balboa app
+        self.prebuilt = getattr(app, "prebuilt", None)
+        self.host = host
+        self.port = port
+        self.max_header_size = max_header_size
+        self.max_headers = max_headers
+        self.max_pipelined = max_pipelined
+        self.max_buffered_body = max_buffered_body
+        self.max_message_size = max_message_size
+        self.max_queued_messages = max_queued_messages
+        self.keep_alive_timeout = keep_alive_timeout
+        self.shutdown_timeout = shutdown_timeout
+        self.connections: Set[HTTPProtocol] = set()
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.stopping: Optional[asyncio.Event] = None
+        self.exiting = False
+        self.date_second = 0
+        self.date = b""
+
+    @property
+    def should_exit(self) -> bool:
+        return self.exiting
+
+    @should_exit.setter
+    def should_exit(self, value: bool) -> None:
+        self.exiting = value
+        if value and self.stopping is not None:
+            self.stopping.set()
+
+    def date_header(self) -> bytes:
+        now = int(time.time())
+        if now != self.date_second:
+            self.date_second = now
+            self.date = f"date: {formatdate(now, usegmt=True)}\r\n".encode()
+        return self.date
+
+    def run(self) -> None:
+        asyncio.run(self.serve())
+
+    async def serve(self, sockets: Optional[Sequence[socket.socket]] = None) -> None:
+        self.loop = asyncio.get_running_loop()
+        self.stopping = asyncio.Event()
+        if self.exiting:
+            return
+        if sockets:
+            servers = [
+                await self.loop.create_server(self.protocol, sock=sock, backlog=2048)
+                for sock in sockets
+            ]
+        else:
+            servers = [
+                await self.loop.create_server(
+                    self.protocol, self.host, self.port, backlog=2048
+                )
+            ]
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            try:
+                self.loop.add_signal_handler(signum, self.stop)
+            except (NotImplementedError, RuntimeError, ValueError):
+                pass
+        for server in servers:
+            for sock in server.sockets:
+                logger.info("Serving on %s", sock.getsockname())
+        try:
+            await self.stopping.wait()
+        finally:
+            for server in servers:
+                server.close()
+            await self.shutdown()
+
+    def protocol(self) -> HTTPProtocol:
+        return HTTPProtocol(self)
+
+    def stop(self) -> None:
+        self.should_exit = True
+
+    async def shutdown(self) -> None:
+        for connection in list(self.connections):
+            connection.shutdown()
+        deadline = time.monotonic() + self.shutdown_timeout
+        while self.connections and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+        runners = []
+        for connection in list(self.connections):
+            connection.transport.close()
+            if connection.runner is not None:
+                runners.append(connection.runner)
+        if runners:
+            # handlers saw the disconnect; cancel those that ignore it
+            await asyncio.wait(runners, timeout=0.5)
+            for runner in runners:
+                runner.cancel()
@@ -0,0 +1,177 @@
+"""
+Server-Sent Events channels for Balboa.
+
+A producer publishes to a channel of the app's SSEHub (``app.events``); each
+event is encoded to the ``id:``/``event:``/``data:`` wire format once and the
+same bytes are queued for every subscriber. Each channel keeps a ring buffer
+of its recent events so a client reconnecting with ``Last-Event-ID`` gets
+what it missed.
+
+With several workers (Balboa.run(workers=N)) ``app.events.publish`` goes
+through the workers' bus and every worker publishes the event, in the order
+the bus delivers them, so a channel has the same ids in every worker.
+"""
+
+import asyncio
+import re
+from collections import deque
+from itertools import islice
+from typing import Deque, Dict, List, Optional, Set, Tuple
+
+from .workers import EVENT, Bus
+
+line_break_regex = re.compile(r"\r\n|\r|\n")
+
+
+class Subscription(asyncio.Queue):  # of Optional[bytes]
+    """
+    The events queued for one subscriber, at most ``maxsize``; None tells
+    it it was dropped. ``writing`` is set while its client is sending
+    earlier events.
+    """
+
+    def __init__(self, maxsize: int):
+        super().__init__(maxsize)
+        self.writing = False
+
+
+def encode_event(
+    data: str, event: Optional[str] = None, id: Optional[int] = None
+) -> bytes:
+    """
+    Encode one event, splitting ``data`` into one ``data:`` line per line.
+    """
+    lines = []
+    if id is not None:
+        lines.append(f"id: {id}\n")
+    if event:
+        lines.append(f"event: {event}\n")
+    for line in line_break_regex.split(data):
+        lines.append(f"data: {line}\n")
+    lines.append("\n")
+    return "".join(lines).encode("utf-8")
+
+
+class SSEChannel:
+    """
+    A topic SSE clients subscribe to. Events get increasing integer ids and
+    the last ``history`` of them are kept for replay. A subscriber queues
+    up to ``queue_size`` encoded events while its client is sending; one
+    still falling behind is dropped, its client reconnects and catches up
+    from the ring buffer. A subscriber waiting for events takes all of them
+    on its next turn, so a short burst of publishes does not drop it, but
+    no queue holds more than ``max(queue_size, history)`` events: a longer
+    burst drops every subscriber it outruns.
+    """
+
+    def __init__(self, name: str = "", history: int = 100, queue_size: int = 256):
+        self.name = name
+        self.queue_size = queue_size
+        self.max_queued = max(queue_size, history, 1)
+        self.history: Deque[Tuple[int, bytes]] = deque(maxlen=history)
+        self.subscribers: Set[Subscription] = set()
+        self.last_id = 0
+
+    def publish(self, data: str, event: Optional[str] = None) -> int:
+        """
+        Send an event to every subscriber and return its id.
+        """
+        self.last_id += 1
+        frame = encode_event(data, event, self.last_id)
+        self.history.append((self.last_id, frame))
+        self.fan_out(frame)
+        return self.last_id
+
+    def fan_out(self, frame: bytes) -> None:
+        """
+        Queue already encoded bytes for every subscriber, without history.
+        """
+        for queue in list(self.subscribers):
+            if queue.full() or (queue.writing and queue.qsize() >= self.queue_size):
+                self.drop(queue)
+            else:
+                queue.put_nowait(frame)
+
+    def drop(self, queue: Subscription) -> None:
+        self.subscribers.discard(queue)
+        while not queue.empty():
+            queue.get_nowait()
+        queue.put_nowait(None)
+
+    def replay(self, last_event_id: Optional[str]) -> List[bytes]:
+        """
+        The buffered events published after ``last_event_id``; all of them
+        when it is older than the buffer, none when it is not one of ours.
+        """
+        if not last_event_id:
+            return []
+        try:
+            last = int(last_event_id)
+        except ValueError:
+            return []
+        if not 0 <= last < self.last_id:
+            return []
+        # ids are consecutive, so the position in the buffer is known
+        start = max(len(self.history) - (self.last_id - last), 0)
+        return [frame for _, frame in islice(self.history, start, None)]
+
+    def subscribe(
+        self, last_event_id: Optional[str] = None
+    ) -> Tuple[List[bytes], Subscription]:
+        """
+        Return the events to replay and a queue receiving the next ones.
+        """
+        queue = Subscription(self.max_queued)
+        self.subscribers.add(queue)
+        return self.replay(last_event_id), queue
+
+    def unsubscribe(self, queue: Subscription) -> None:
+        self.subscribers.discard(queue)
+
+
+class SSEHub:
+    """
+    The SSE channels of an app, created on first use. ``bus`` is set in the
+    workers of a multi-process app.
+    """
+
+    def __init__(self, history: int = 100, queue_size: int = 256):
+        self.history = history
+        self.queue_size = queue_size
+        self.channels: Dict[str, SSEChannel] = {}
+        self.bus: Optional[Bus] = None
+
+    def channel(
+        self,
+        name: str,
+        history: Optional[int] = None,
+        queue_size: Optional[int] = None,
+    ) -> SSEChannel:
+        channel = self.channels.get(name)
+        if channel is None:
+            channel = self.channels[name] = SSEChannel(
+                name,
+                self.history if history is None else history,
+                self.queue_size if queue_size is None else queue_size,
+            )
+        return channel
+
+    def publish(
+        self, channel: str, data: str, event: Optional[str] = None
+    ) -> Optional[int]:
+        """
+        Publish an event and return its id, or None when it was sent to the
+        bus: its id is only known once the bus delivers it back.
+        """
+        if self.bus is not None:
+            self.bus.send(
+                EVENT, channel.encode(), data.encode(), (event or "").encode()
+            )
+            return None
+        return self.channel(channel).publish(data, event)
+
+    async def receive(self, channel: bytes, data: bytes, event: bytes) -> None:
+        """
+        Publish an event coming from the bus.
+        """
+        self.channel(channel.decode()).publish(data.decode(), event.decode() or None)
@@ -0,0 +1,421 @@
+"""
+Static file serving for Balboa.mount(prefix, dir=...).
+
+Files are streamed in bounded chunks read off the event loop, or handed to
+the server when it offers the ``http.response.pathsend`` or
+``http.response.zerocopysend`` ASGI extensions. Responses carry ETag and
+Last-Modified validators, conditional GETs are answered with 304 and single
+byte ranges with 206.
+
+An optional StaticCache keeps small hot files in memory together with their
+prebuilt response messages and gzip/brotli variants, so cache hits need no
+disk I/O and no per-request compression.
+"""
+
+import asyncio
+import os
+import stat
+import time
+from collections import OrderedDict
+from email.utils import formatdate, parsedate_to_datetime
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from .asgi import (
+    Message,
+    Receive,
+    Scope,
+    Send,
+    etag_matches,
+    send_not_modified,
+    send_plain,
+)
+from .compression import ENCODINGS, choose_encoding, compress, is_compressible
+
+
+class CachedFile:
+    """
+    A file held by StaticCache: its validators and, per content encoding
+    (None for identity), the ETag and the ready-to-send ASGI messages.
+    """
+
+    __slots__ = (
+        "path",
+        "mtime",
+        "mtime_ns",
+        "size",
+        "last_modified",
+        "body",
+        "content_type",
+        "variants",
+        "encodings",
+        "nbytes",
+        "checked",
+    )
+
+    def __init__(
+        self,
+        path: str,
+        info: os.stat_result,
+        body: bytes,
+        content_type: str,
+        compress_level: int,
+        minimum_size: int,
+    ):
+        self.path = path
+        self.mtime = info.st_mtime
+        self.mtime_ns = info.st_mtime_ns
+        self.size = info.st_size
+        self.last_modified = formatdate(info.st_mtime, usegmt=True)
+        self.body = body
+        self.content_type = content_type
+        self.variants: Dict[Optional[str], Tuple[str, Message, Message]] = {}
+        self.checked = time.monotonic()
+
+        bodies: Dict[Optional[str], bytes] = {None: body}
+        if is_compressible(content_type) and len(body) >= minimum_size:
+            for encoding in ENCODINGS:
+                compressed = compress(body, encoding, compress_level)
+                if len(compressed) < len(body):
+                    bodies[encoding] = compressed
+        self.encodings = tuple(encoding for encoding in bodies if encoding)
+        etag = file_etag(info)
+        for encoding, data in bodies.items():
+            variant_etag = f'{etag[:-1]}-{encoding}"' if encoding else etag
+            headers = validator_headers(variant_etag, self.last_modified)
+            if self.encodings:
+                headers.append((b"vary", b"accept-encoding"))
+            if encoding:
+                headers.append((b"content-encoding", encoding.encode()))
+            headers.append((b"content-type", content_type.encode()))
+            headers.append((b"content-length", str(len(data)).encode()))
+            self.variants[encoding] = (
+                variant_etag,
+                {"type": "http.response.start", "status": 200, "headers": headers},
+                {"type": "http.response.body", "body": data},
+            )
+        self.nbytes = sum(len(data) for data in bodies.values())
+
+
+class StaticCache:
+    """
+    In-memory LRU cache of static files bounded by ``max_bytes`` (all
+    variants included). Files larger than ``max_file_size`` are streamed
+    from disk instead. Entries are revalidated with a stat call at most
+    once every ``revalidate_interval`` seconds.
+    """
+
+    def __init__(
+        self,
+        max_bytes: int = 32 * 1024 * 1024,
+        max_file_size: int = 1024 * 1024,
+        revalidate_interval: float = 1.0,
+        compress_level: int = 6,
+        minimum_size: int = 256,
+    ):
+        self.max_bytes = max_bytes
+        self.max_file_size = max_file_size
+        self.revalidate_interval = revalidate_interval
+        self.compress_level = compress_level
+        self.minimum_size = minimum_size
+        self.entries: "OrderedDict[str, CachedFile]" = OrderedDict()
+        self.size = 0
+
+    def get(self, key: str) -> Optional[CachedFile]:
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        now = time.monotonic()
+        if now - entry.checked >= self.revalidate_interval:
+            try:
+                info = os.stat(entry.path)
+            except OSError:
+                info = None
+            if info is None or (info.st_mtime_ns, info.st_size) != (
+                entry.mtime_ns,
+                entry.size,
+            ):
+                self.discard(key)
+                return None
+            entry.checked = now
+        self.entries.move_to_end(key)
+        return entry
+
+    def load(self, path: str, content_type: str) -> Optional[CachedFile]:
+        """
+        Read and compress a file; blocking, meant to run in a worker thread.
+        """
+        with open(path, "rb") as file:
+            info = os.fstat(file.fileno())
+            if info.st_size > self.max_file_size:
+                return None
+            body = file.read()
+        return CachedFile(
+            path, info, body, content_type, self.compress_level, self.minimum_size
+        )
+
+    def put(self, key: str, entry: CachedFile) -> None:
+        if entry.nbytes > self.max_bytes:
+            return
+        self.discard(key)
+        self.entries[key] = entry
+        self.size += entry.nbytes
+        while self.size > self.max_bytes:
+            _, evicted = self.entries.popitem(last=False)
+            self.size -= evicted.nbytes
+
+    def discard(self, key: str) -> None:
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.size -= entry.nbytes
+
+    def clear(self) -> None:
+        self.entries.clear()
+        self.size = 0
+
+
+def file_etag(info: os.stat_result) -> str:
+    return f'"{info.st_mtime_ns:x}-{info.st_size:x}"'
+
+
+def validator_headers(etag: str, last_modified: str) -> List[Tuple[bytes, bytes]]:
+    return [
+        (b"etag", etag.encode()),
+        (b"last-modified", last_modified.encode()),
+        (b"accept-ranges", b"bytes"),
+    ]
+
+
+class StaticFiles:
+    def __init__(
+        self,
+        prefix: str,
+        directory: str,
+        mime_type: Callable[[str], str],
+        chunk_size: int = 64 * 1024,
+        cache: Optional[StaticCache] = None,
+    ):
+        self.prefix = prefix
+        self.directory = os.path.realpath(directory)
+        self.mime_type = mime_type
+        self.chunk_size = chunk_size
+        self.cache = cache
+
+    def resolve(self, path: str) -> Optional[str]:
+        """
+        Map a request path to a file inside the directory, refusing paths
+        that escape it (``..`` segments or symlinks pointing outside).
+        """
+        relative = path[len(self.prefix) :].lstrip("/")
+        file_path = os.path.realpath(os.path.join(self.directory, relative))
+        if os.path.commonpath((self.directory, file_path)) != self.directory:
+            return None
+        return file_path
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        request_headers = dict(scope.get("headers", ()))
+        if self.cache is not None:
+            entry = self.cache.get(scope["path"])
+            if entry is not None:
+                await self.send_cached(scope, send, entry, request_headers)
+                return
+
+        file_path = self.resolve(scope["path"])
+        try:
+            info = os.stat(file_path) if file_path else None
+        except OSError:
+            info = None
+        if info is None or not stat.S_ISREG(info.st_mode):
+            await send_plain(send, 404, b"File Not Found")
+            return
+
+        if self.cache is not None and info.st_size <= self.cache.max_file_size:
+            content_type = self.mime_type(file_path)
+            entry = await asyncio.to_thread(self.cache.load, file_path, content_type)
+            if entry is not None:
+                self.cache.put(scope["path"], entry)
+                await self.send_cached(scope, send, entry, request_headers)
+                return
+
+        etag = file_etag(info)
+        last_modified = formatdate(info.st_mtime, usegmt=True)
+        headers = validator_headers(etag, last_modified)
+        if self.not_modified(request_headers, etag, info.st_mtime):
+            await send_not_modified(send, headers)
+            return
+
+        size = info.st_size
+        status, start, end = 200, 0, size
+        byte_range = self.requested_range(request_headers, etag, last_modified)
+        if byte_range:
+            selected = self.parse_range(byte_range, size)
+            if selected is None:
+                content_range = (b"content-range", f"bytes */{size}".encode())
+                await send_plain(send, 416, b"Range Not Satisfiable", [content_range])
+                return
+            if selected != (0, size):
+                status, (start, end) = 206, selected
+                headers.append(
+                    (b"content-range", f"bytes {start}-{end - 1}/{size}".encode())
+                )
+
+        headers.append((b"content-type", self.mime_type(file_path).encode()))
+        headers.append((b"content-length", str(end - start).encode()))
+        await send(
+            {"type": "http.response.start", "status": status, "headers": headers}
+        )
+        if scope.get("method") == "HEAD":
+            await send({"type": "http.response.body", "body": b""})
+            return
+        await self.send_file(scope, send, file_path, start, end, status == 200)
+
+    async def send_cached(
+        self,
+        scope: Scope,
+        send: Send,
+        entry: CachedFile,
+        request_headers: Dict[bytes, bytes],
+    ) -> None:
+        etag, start_message, body_message = entry.variants[None]
+        byte_range = self.requested_range(request_headers, etag, entry.last_modified)
+        if byte_range is None:
+            encoding = choose_encoding(
+                request_headers.get(b"accept-encoding"), entry.encodings
+            )
+            etag, start_message, body_message = entry.variants[encoding]
+        if self.not_modified(request_headers, etag, entry.mtime):
+            headers = validator_headers(etag, entry.last_modified)
+            if entry.encodings:
+                headers.append((b"vary", b"accept-encoding"))
+            await send_not_modified(send, headers)
+            return
+        if byte_range is not None:
+            selected = self.parse_range(byte_range, entry.size)
+            if selected is None:
+                content_range = (b"content-range", f"bytes */{entry.size}".encode())
+                await send_plain(send, 416, b"Range Not Satisfiable", [content_range])
+                return
+            if selected != (0, entry.size):
+                start, end = selected
+                headers = validator_headers(etag, entry.last_modified)
+                headers += [
+                    (
+                        b"content-range",
+                        f"bytes {start}-{end - 1}/{entry.size}".encode(),
+                    ),
+                    (b"content-type", entry.content_type.encode()),
+                    (b"content-length", str(end - start).encode()),
+                ]
+                start_message = {
+                    "type": "http.response.start",
+                    "status": 206,
+                    "headers": headers,
+                }
+                body_message = {
+                    "type": "http.response.body",
+                    "body": entry.body[start:end],
+                }
+        await send(start_message)
+        if scope.get("method") == "HEAD":
+            await send({"type": "http.response.body", "body": b""})
+            return
+        await send(body_message)
+
+    async def send_file(
+        self,
+        scope: Scope,
+        send: Send,
+        file_path: str,
+        start: int,
+        end: int,
+        whole: bool,
+    ) -> None:
+        extensions: Dict[str, Any] = scope.get("extensions") or {}
+        if whole and "http.response.pathsend" in extensions:
+            await send({"type": "http.response.pathsend", "path": file_path})
+            return
+        file = await asyncio.to_thread(open, file_path, "rb")
+        try:
+            if "http.response.zerocopysend" in extensions:
+                await send(
+                    {
+                        "type": "http.response.zerocopysend",
+                        "file": file,
+                        "offset": start,
+                        "count": end - start,
+                    }
+                )
+                return
+            if start:
+                await asyncio.to_thread(file.seek, start)
+            remaining = end - start
+            while True:
+                chunk = await asyncio.to_thread(
+                    file.read, min(self.chunk_size, remaining)
+                )
+                remaining -= len(chunk)
+                more_body = bool(chunk) and remaining > 0
+                await send(
+                    {
+                        "type": "http.response.body",
+                        "body": chunk,
+                        "more_body": more_body,
+                    }
+                )
+                if not more_body:
+                    break
+        finally:
+            file.close()
+
+    @staticmethod
+    def not_modified(headers: Dict[bytes, bytes], etag: str, mtime: float) -> bool:
+        if_none_match = headers.get(b"if-none-match")
+        if if_none_match is not None:
+            return etag_matches(if_none_match, etag)
+        if_modified_since = headers.get(b"if-modified-since")
+        if if_modified_since is not None:
+            try:
+                since = parsedate_to_datetime(if_modified_since.decode("latin-1"))
+            except (TypeError, ValueError):
+                return False
+            return int(mtime) <= since.timestamp()
+        return False
+
+    @staticmethod
+    def requested_range(
+        headers: Dict[bytes, bytes], etag: str, last_modified: str
+    ) -> Optional[str]:
+        byte_range = headers.get(b"range")
+        if byte_range is None:
+            return None
+        if_range = headers.get(b"if-range")
+        if if_range is not None and if_range.decode("latin-1") not in (
+            etag,
+            last_modified,
+        ):
+            return None
+        return byte_range.decode("latin-1")
+
+    @staticmethod
+    def parse_range(byte_range: str, size: int) -> Optional[Tuple[int, int]]:
+        """
+        Return the [start, end) span of a single ``bytes=`` range, the whole
+        file for malformed or multi-range headers (which may be ignored), or
+        None when the range cannot be satisfied.
+        """
+        unit, _, spec = byte_range.partition("=")
+        if unit.strip() != "bytes" or "," in spec:
+            return 0, size
+        first, dash, last = spec.strip().partition("-")
+        if not dash:
+            return 0, size
+        try:
+            if not first:
+                length = int(last)
+                return (max(size - length, 0), size) if length and size else None
+            start = int(first)
+            end = int(last) + 1 if last else size
+        except ValueError:
+            return 0, size
+        if start >= size or end <= start:
+            return None
+        return start, min(end, size)
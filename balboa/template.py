@@ -0,0 +1,166 @@
+"""
+Balboa templates
+
+Templates are plain files using the ``str.format`` syntax the demos already
+use (``{name}``, ``{area:.2f}``, ``{{`` and ``}}`` for literal braces),
+extended with block tags:
+
+    {% for name in names %}<li>{name}</li>{% endfor %}
+    {% if user %}...{% elif guest %}...{% else %}...{% endif %}
+    {% include "hello.html" %}
+
+Each template is compiled once into a Python code object that appends its
+fragments to a single list, which is joined once per render. Included
+templates run in the namespace of the template that includes them.
+"""
+
+import os
+import re
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+
+class TemplateError(Exception):
+    pass
+
+
+class Template:
+    token_regex = re.compile(r"\{\{|\}\}|\{%\s*(.*?)\s*%\}|\{([^{}]*)\}|[{}]")
+    field_regex = re.compile(
+        r"([^.\[!:]+)((?:\.\w+|\[[^\]]+\])*)(?:!([rsa]))?(?::(.*))?$", re.S
+    )
+
+    def __init__(self, source: str, path: str):
+        self.path = path
+        self.code = compile(self._generate(source), path, "exec")
+
+    def _generate(self, source: str) -> str:
+        lines: List[str] = []
+        blocks: List[str] = []
+        literal: List[str] = []
+
+        def emit(line: str) -> None:
+            lines.append("    " * len(blocks) + line)
+
+        def flush() -> None:
+            if literal:
+                emit(f"__balboa_append({''.join(literal)!r})")
+                literal.clear()
+
+        position = 0
+        for token in self.token_regex.finditer(source):
+            literal.append(source[position : token.start()])
+            position = token.end()
+            text = token.group(0)
+            if text in ("{{", "}}"):
+                literal.append(text[0])
+                continue
+            if token.group(1) is not None:
+                flush()
+                self._tag(token.group(1), blocks, emit)
+            elif token.group(2) is not None:
+                flush()
+                emit(f"__balboa_append({self._field(token.group(2))})")
+            else:
+                raise TemplateError(f"{self.path}: single {text!r} in template")
+        literal.append(source[position:])
+        flush()
+        if blocks:
+            raise TemplateError(f"{self.path}: missing {{% end{blocks[-1]} %}}")
+        return "\n".join(lines)
+
+    def _tag(self, tag: str, blocks: List[str], emit: Callable[[str], None]) -> None:
+        keyword, _, rest = tag.partition(" ")
+        match keyword:
+            case "for" | "if":
+                emit(f"{keyword} {rest}:")
+                blocks.append(keyword)
+                emit("pass")
+            case "elif" | "else":
+                if not blocks or blocks[-1] != "if":
+                    raise TemplateError(f"{self.path}: {{% {keyword} %}} outside if")
+                blocks.pop()
+                emit(f"elif {rest}:" if keyword == "elif" else "else:")
+                blocks.append("if")
+                emit("pass")
+            case "endfor" | "endif":
+                if not blocks or blocks[-1] != keyword[3:]:
+                    raise TemplateError(f"{self.path}: unexpected {{% {keyword} %}}")
+                blocks.pop()
+            case "include":
+                name = rest.strip().strip("\"'")
+                path = os.path.join(os.path.dirname(self.path), name)
+                emit(f"__balboa_include({path!r}, globals())")
+            case _:
+                raise TemplateError(f"{self.path}: unknown tag {{% {tag} %}}")
+
+    def _field(self, field: str) -> str:
+        parsed = self.field_regex.match(field)
+        if not parsed:
+            raise TemplateError(f"{self.path}: invalid field {{{field}}}")
+        name, accessors, conversion, spec = parsed.groups()
+        expression = name.strip()
+        for accessor in re.findall(r"\.\w+|\[[^\]]+\]", accessors):
+            key = accessor[1:-1]
+            if accessor[0] == "." or key.isdigit():
+                expression += accessor
+            else:
+                expression += f"[{key!r}]"
+        match conversion:
+            case "r":
+                expression = f"repr({expression})"
+            case "s":
+                expression = f"str({expression})"
+            case "a":
+                expression = f"ascii({expression})"
+        return f"__balboa_format({expression}, {spec or ''!r})"
+
+
+class Templates:
+    """
+    Loads and caches compiled templates. With ``auto_reload`` the template
+    file is stat'ed at most once every ``check_interval`` seconds and
+    recompiled when its mtime changes, which is meant for development.
+    """
+
+    def __init__(self, auto_reload: bool = False, check_interval: float = 1.0):
+        self.auto_reload = auto_reload
+        self.check_interval = check_interval
+        self.cache: Dict[str, Tuple[Template, float, float]] = {}
+        self.lock = threading.Lock()
+
+    def get(self, name: str) -> Template:
+        entry = self.cache.get(name)
+        if entry is not None:
+            template, mtime, checked = entry
+            if not self.auto_reload:
+                return template
+            now = time.monotonic()
+            if now - checked < self.check_interval:
+                return template
+            if os.stat(template.path).st_mtime == mtime:
+                self.cache[name] = (template, mtime, now)
+                return template
+        return self._load(name)
+
+    def _load(self, name: str) -> Template:
+        with self.lock:
+            path = os.path.abspath(name)
+            mtime = os.stat(path).st_mtime
+            with open(path) as file:
+                template = Template(file.read(), path)
+            self.cache[name] = (template, mtime, time.monotonic())
+            return template
+
+    def render(self, name: str, context: Optional[Dict[str, Any]] = None) -> str:
+        fragments: List[str] = []
+        namespace = dict(context or {})
+        namespace["__balboa_append"] = fragments.append
+        namespace["__balboa_format"] = format
+        namespace["__balboa_include"] = self._include
+        exec(self.get(name).code, namespace)
+        return "".join(fragments)
+
+    def _include(self, path: str, namespace: Dict[str, Any]) -> None:
+        exec(self.get(path).code, namespace)
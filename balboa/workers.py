@@ -0,0 +1,367 @@
+"""
+Multi-process serving for Balboa.run(workers=N).
+
+The Supervisor opens the listening socket, forks the workers that serve it
+and runs a local message bus: a Unix-domain socket every worker connects to.
+Bus messages are length-prefixed frames of a kind byte and byte-string
+fields; the supervisor relays them between workers without decoding them,
+so a WebSocket broadcast or an SSE publish made in one worker reaches the
+clients of all of them. Workers send heartbeats on the bus; a worker that
+exits or stops sending them is replaced.
+"""
+
+import asyncio
+import logging
+import os
+import selectors
+import shutil
+import signal
+import socket
+import struct
+import tempfile
+import time
+import traceback
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger("balboa.workers")
+
+# Frame kinds. WebSocket messages are relayed to the other workers, the
+# sender delivers them itself; SSE events come back to the sender too, so
+# every worker numbers a channel's events in the same order.
+HELLO = 0
+HEARTBEAT = 1
+ROUTE = 2
+ROOM = 3
+EVENT = 4
+ECHOED = frozenset({EVENT})
+
+header = struct.Struct("!I")
+frame_header = struct.Struct("!IB")
+
+
+def encode(kind: int, *fields: bytes) -> bytes:
+    parts = [frame_header.pack(1 + sum(4 + len(field) for field in fields), kind)]
+    for field in fields:
+        parts.append(header.pack(len(field)))
+        parts.append(field)
+    return b"".join(parts)
+
+
+def decode(frame: bytes) -> Tuple[int, List[bytes]]:
+    fields = []
+    offset = 1
+    while offset < len(frame):
+        (length,) = header.unpack_from(frame, offset)
+        offset += 4
+        fields.append(frame[offset : offset + length])
+        offset += length
+    return frame[0], fields
+
+
+class Bus:
+    """
+    The worker end of the bus. ``subscribe`` sets the coroutine receiving
+    the fields of each frame of a kind; ``send`` queues a frame without
+    waiting. ``reader`` ends when the supervisor goes away.
+    """
+
+    heartbeat = 1.0
+
+    def __init__(self):
+        self.handlers: Dict[int, Callable[..., Awaitable[None]]] = {}
+        self.writer: Optional[asyncio.StreamWriter] = None
+        self.reader: Optional[asyncio.Task[None]] = None
+        self.beater: Optional[asyncio.Task[None]] = None
+
+    def subscribe(self, kind: int, handler: Callable[..., Awaitable[None]]) -> None:
+        self.handlers[kind] = handler
+
+    async def connect(self, path: str) -> None:
+        reader, self.writer = await asyncio.open_unix_connection(path)
+        self.send(HELLO, str(os.getpid()).encode())
+        self.reader = asyncio.create_task(self.read(reader))
+        self.beater = asyncio.create_task(self.beat())
+
+    def send(self, kind: int, *fields: bytes) -> None:
+        if self.writer is not None and not self.writer.is_closing():
+            self.writer.write(encode(kind, *fields))
+
+    async def read(self, reader: asyncio.StreamReader) -> None:
+        while True:
+            try:
+                (length,) = header.unpack(await reader.readexactly(4))
+                kind, fields = decode(await reader.readexactly(length))
+            except (asyncio.IncompleteReadError, ConnectionError):
+                return
+            handler = self.handlers.get(kind)
+            if handler is None:
+                continue
+            try:
+                await handler(*fields)
+            except Exception:
+                logger.exception("Bus message of kind %d failed", kind)
+
+    async def beat(self) -> None:
+        # sent from the event loop, so a blocked loop stops the heartbeats
+        while True:
+            self.send(HEARTBEAT)
+            await asyncio.sleep(self.heartbeat)
+
+    def close(self) -> None:
+        for task in (self.reader, self.beater):
+            if task is not None:
+                task.cancel()
+        if self.writer is not None:
+            self.writer.close()
+
+
+class Connection:
+    """
+    A worker's bus connection, as seen by the supervisor.
+    """
+
+    def __init__(self, sock: socket.socket):
+        self.sock = sock
+        self.pid: Optional[int] = None
+        self.inbox = bytearray()
+        self.outbox = bytearray()
+        self.writing = False
+
+
+class Worker:
+    def __init__(self, pid: int):
+        self.pid = pid
+        self.started = time.monotonic()
+        self.last_seen = self.started
+        self.connection: Optional[Connection] = None
+
+
+class Supervisor:
+    """
+    Fork ``workers`` processes running ``target(listener, bus_path)`` and
+    relay bus frames between them until SIGINT or SIGTERM. A worker that
+    exits is restarted (after ``restart_delay`` when it did not live that
+    long, so a crashing app does not fork in a loop) and one silent for
+    ``health_timeout`` seconds is killed and restarted. On shutdown workers
+    get SIGTERM and ``shutdown_timeout`` seconds to finish.
+    """
+
+    def __init__(
+        self,
+        target: Callable[[socket.socket, str], None],
+        workers: int,
+        health_timeout: float = 10.0,
+        restart_delay: float = 1.0,
+        shutdown_timeout: float = 10.0,
+    ):
+        if not hasattr(os, "fork"):
+            raise RuntimeError("Multiple workers need os.fork")
+        self.target = target
+        self.count = workers
+        self.health_timeout = health_timeout
+        self.restart_delay = restart_delay
+        self.shutdown_timeout = shutdown_timeout
+        self.workers: Dict[int, Worker] = {}
+        self.connections: List[Connection] = []
+        self.restarts: List[float] = []
+        self.selector = selectors.DefaultSelector()
+        self.stopping = False
+
+    def run(self, host: str, port: int) -> None:
+        self.listener = socket.create_server((host, port), backlog=2048)
+        self.directory = tempfile.mkdtemp(prefix="balboa-")
+        self.bus_path = os.path.join(self.directory, "bus.sock")
+        self.bus = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.bus.bind(self.bus_path)
+        self.bus.listen()
+        self.bus.setblocking(False)
+        self.selector.register(self.bus, selectors.EVENT_READ)
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(signum, self.stop)
+        logger.info("Serving on %s:%d with %d workers", host, port, self.count)
+        try:
+            for _ in range(self.count):
+                self.spawn()
+            while not self.stopping:
+                for key, mask in self.selector.select(timeout=0.5):
+                    if key.fileobj is self.bus:
+                        self.accept()
+                    else:
+                        if mask & selectors.EVENT_READ:
+                            self.receive(key.data)
+                        if mask & selectors.EVENT_WRITE and key.data.sock.fileno() >= 0:
+                            self.flush(key.data)
+                self.reap()
+                self.check_health()
+                self.restart()
+        finally:
+            self.shutdown()
+
+    def stop(self, *_) -> None:
+        self.stopping = True
+
+    def spawn(self) -> None:
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            try:
+                for signum in (signal.SIGINT, signal.SIGTERM):
+                    signal.signal(signum, signal.SIG_DFL)
+                self.selector.close()
+                self.bus.close()
+                for connection in self.connections:
+                    connection.sock.close()
+                self.target(self.listener, self.bus_path)
+            except BaseException:
+                traceback.print_exc()
+                code = 1
+            finally:
+                os._exit(code)
+        self.workers[pid] = Worker(pid)
+
+    def accept(self) -> None:
+        try:
+            sock, _ = self.bus.accept()
+        except BlockingIOError:
+            return
+        sock.setblocking(False)
+        connection = Connection(sock)
+        self.connections.append(connection)
+        self.selector.register(sock, selectors.EVENT_READ, connection)
+
+    def receive(self, connection: Connection) -> None:
+        try:
+            data = connection.sock.recv(65536)
+        except BlockingIOError:
+            return
+        except OSError:
+            data = b""
+        if not data:
+            self.close(connection)
+            return
+        inbox = connection.inbox
+        inbox += data
+        worker = self.workers.get(connection.pid)
+        if worker is not None:
+            worker.last_seen = time.monotonic()
+        while len(inbox) >= 4:
+            (length,) = header.unpack_from(inbox)
+            if len(inbox) < 4 + length:
+                break
+            frame = bytes(inbox[: 4 + length])
+            del inbox[: 4 + length]
+            kind = frame[4]
+            if kind == HELLO:
+                self.hello(connection, decode(frame[4:])[1][0])
+            elif kind != HEARTBEAT:
+                self.relay(connection, kind, frame)
+
+    def hello(self, connection: Connection, pid: bytes) -> None:
+        connection.pid = int(pid)
+        worker = self.workers.get(connection.pid)
+        if worker is not None:
+            worker.connection = connection
+            worker.last_seen = time.monotonic()
+
+    def relay(self, sender: Connection, kind: int, frame: bytes) -> None:
+        echo = kind in ECHOED
+        for connection in list(self.connections):
+            if connection is not sender or echo:
+                connection.outbox += frame
+                self.flush(connection)
+
+    def flush(self, connection: Connection) -> None:
+        try:
+            sent = connection.sock.send(connection.outbox)
+        except BlockingIOError:
+            sent = 0
+        except OSError:
+            self.close(connection)
+            return
+        del connection.outbox[:sent]
+        # wait for the socket to be writable only while frames are left
+        writing = bool(connection.outbox)
+        if writing != connection.writing:
+            connection.writing = writing
+            events = selectors.EVENT_READ
+            if writing:
+                events |= selectors.EVENT_WRITE
+            self.selector.modify(connection.sock, events, connection)
+
+    def close(self, connection: Connection) -> None:
+        if connection not in self.connections:
+            return
+        self.connections.remove(connection)
+        self.selector.unregister(connection.sock)
+        connection.sock.close()
+        worker = self.workers.get(connection.pid)
+        if worker is not None and worker.connection is connection:
+            worker.connection = None
+
+    def reap(self) -> None:
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+            worker = self.workers.pop(pid, None)
+            if worker is None:
+                continue
+            if worker.connection is not None:
+                self.close(worker.connection)
+            if self.stopping:
+                continue
+            now = time.monotonic()
+            logger.warning(
+                "Worker %d exited with status %d, restarting",
+                pid,
+                os.waitstatus_to_exitcode(status),
+            )
+            delay = (
+                self.restart_delay if now - worker.started < self.restart_delay else 0
+            )
+            self.restarts.append(now + delay)
+
+    def check_health(self) -> None:
+        deadline = time.monotonic() - self.health_timeout
+        for worker in self.workers.values():
+            if worker.last_seen < deadline:
+                logger.warning("Worker %d stopped responding, killing it", worker.pid)
+                worker.last_seen = time.monotonic()
+                try:
+                    os.kill(worker.pid, signal.SIGKILL)
+                except ProcessLookupError:
+                    pass
+
+    def restart(self) -> None:
+        now = time.monotonic()
+        due = [at for at in self.restarts if at <= now]
+        self.restarts = [at for at in self.restarts if at > now]
+        for _ in due:
+            self.spawn()
+
+    def shutdown(self) -> None:
+        self.stopping = True
+        for worker in self.workers.values():
+            try:
+                os.kill(worker.pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        deadline = time.monotonic() + self.shutdown_timeout
+        while self.workers and time.monotonic() < deadline:
+            self.reap()
+            time.sleep(0.05)
+        for worker in self.workers.values():
+            try:
+                os.kill(worker.pid, signal.SIGKILL)
+                os.waitpid(worker.pid, 0)
+            except (ProcessLookupError, ChildProcessError):
+                pass
+        for connection in list(self.connections):
+            self.close(connection)
+        self.selector.close()
+        self.bus.close()
+        self.listener.close()
+        shutil.rmtree(self.directory, ignore_errors=True)
@@ -0,0 +1,4 @@
+"""
+In-process benchmarks for Balboa. They drive the ASGI callable directly with
+synthetic scope/receive/send, so no sockets or server are involved.
+"""
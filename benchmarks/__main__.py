@@ -0,0 +1,59 @@
+"""
+Run the benchmark suite:
+
+    python -m benchmarks                      # everything
+    python -m benchmarks dispatch_1000 sse    # names starting with these
+    python -m benchmarks --save baseline.json
+    python -m benchmarks --compare baseline.json
+
+With --compare the exit status is 1 when a benchmark lost more than
+--threshold of its ops/s compared with the baseline. Baselines only hold
+for the machine that saved them, none is committed. Saving and comparing
+keep the fastest of --repeat runs (3 unless given). The default threshold
+(50%) stays above the spread of an unchanged tree on a shared VM; pass a
+lower one on a quiet machine.
+"""
+
+import argparse
+import sys
+
+from .harness import compare, run, save
+from .suite import BENCHMARKS
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(prog="python -m benchmarks")
+    parser.add_argument("names", nargs="*", help="run benchmarks starting with these")
+    parser.add_argument("--iterations", type=int, default=2000)
+    parser.add_argument(
+        "--repeat",
+        type=int,
+        help="keep the fastest of this many runs (3 with --save or --compare)",
+    )
+    parser.add_argument("--save", metavar="PATH", help="write the results as JSON")
+    parser.add_argument("--compare", metavar="PATH", help="baseline to compare with")
+    parser.add_argument("--threshold", type=float, default=0.5)
+    args = parser.parse_args()
+    repeat = args.repeat
+    if repeat is None:
+        repeat = 3 if args.save or args.compare else 1
+
+    selected = {
+        name: setup
+        for name, setup in BENCHMARKS.items()
+        if not args.names or name.startswith(tuple(args.names))
+    }
+    print(f"{'benchmark':<24} {'throughput':>18} {'p50':>10} {'p99':>13} {'alloc':>13}")
+    results = run(selected, args.iterations, repeat)
+    if args.save:
+        save(results, args.save)
+    if args.compare:
+        regressions = compare(results, args.compare, args.threshold)
+        if regressions:
+            print(f"regressions beyond {args.threshold:.0%}: {', '.join(regressions)}")
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,501 @@
+"""
+Behaviour checks of the servers Balboa.run(engine=...) can use, run over a
+loopback socket by benchmarks/engines.py against every installed engine.
+
+The HTTP/1.1 checks cover keep-alive, pipelining, requests arriving a byte
+at a time, chunked framing, Expect: 100-continue, and the requests a server
+must refuse: malformed chunk sizes, Content-Length/Transfer-Encoding
+conflicts, invalid request lines and oversized heads. The WebSocket checks
+cover RFC 6455 framing: masking, fragmentation with interleaved control
+frames, the close handshake, and the 1002, 1007 and 1009 close codes.
+
+Where the RFCs leave servers a choice, like 400 or 501 for an unknown
+transfer coding, every allowed answer passes. NATIVE_CHECKS hold the limits
+only the native server enforces, like 431 for oversized heads.
+"""
+
+import asyncio
+import base64
+import hashlib
+import os
+import struct
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+TIMEOUT = 5.0
+
+WEBSOCKET_GUID = b"258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+
+Check = Callable[[int], Awaitable[None]]
+
+
+class Failed(Exception):
+    pass
+
+
+def expect(condition: bool, message: str) -> None:
+    if not condition:
+        raise Failed(message)
+
+
+class Connection:
+    """
+    A raw client connection, reading responses and frames as a client
+    would: this side does not trust the server to frame them right.
+    """
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.reader = reader
+        self.writer = writer
+
+    @classmethod
+    async def open(cls, port: int) -> "Connection":
+        return cls(*await asyncio.open_connection("127.0.0.1", port))
+
+    async def send(self, data: bytes) -> None:
+        self.writer.write(data)
+        await self.writer.drain()
+
+    async def send_slowly(self, data: bytes) -> None:
+        for index in range(len(data)):
+            await self.send(data[index : index + 1])
+            await asyncio.sleep(0.001)
+
+    async def read(self, coroutine: Awaitable[bytes]) -> bytes:
+        try:
+            return await asyncio.wait_for(coroutine, TIMEOUT)
+        except asyncio.IncompleteReadError as error:
+            raise Failed(f"connection closed after {error.partial[:80]!r}")
+        except asyncio.TimeoutError:
+            raise Failed("no answer")
+        except ConnectionError as error:
+            raise Failed(f"connection reset ({error})")
+
+    async def response(
+        self, head_only: bool = False
+    ) -> Tuple[int, Dict[bytes, bytes], bytes]:
+        head = await self.read(self.reader.readuntil(b"\r\n\r\n"))
+        lines = head[:-4].split(b"\r\n")
+        status = int(lines[0].split(b" ")[1])
+        headers = {}
+        for line in lines[1:]:
+            name, _, value = line.partition(b":")
+            headers[name.strip().lower()] = value.strip()
+        if head_only or status < 200 or status in (204, 304):
+            return status, headers, b""
+        if headers.get(b"transfer-encoding", b"").lower() == b"chunked":
+            body = b""
+            while True:
+                line = await self.read(self.reader.readuntil(b"\r\n"))
+                size = int(line[:-2].split(b";")[0], 16)
+                if not size:
+                    break
+                body += (await self.read(self.reader.readexactly(size + 2)))[:-2]
+            while await self.read(self.reader.readuntil(b"\r\n")) != b"\r\n":
+                pass
+            return status, headers, body
+        if b"content-length" in headers:
+            length = int(headers[b"content-length"])
+            return status, headers, await self.read(self.reader.readexactly(length))
+        return status, headers, await self.read(self.reader.read())
+
+    async def closed(self) -> bool:
+        try:
+            return await asyncio.wait_for(self.reader.read(), TIMEOUT) == b""
+        except (asyncio.TimeoutError, ConnectionError):
+            return False
+
+    def close(self) -> None:
+        self.writer.close()
+
+
+def get(path: bytes, *headers: bytes) -> bytes:
+    return b"GET %b HTTP/1.1\r\nhost: check\r\n%b\r\n" % (
+        path,
+        b"".join(header + b"\r\n" for header in headers),
+    )
+
+
+def post(body: bytes, *headers: bytes) -> bytes:
+    if not any(header.startswith(b"transfer-encoding") for header in headers):
+        headers += (b"content-length: %d" % len(body),)
+    return b"POST /echo HTTP/1.1\r\nhost: check\r\n%b\r\n%b" % (
+        b"".join(header + b"\r\n" for header in headers),
+        body,
+    )
+
+
+async def exchange(port: int, request: bytes) -> List[Tuple[int, bytes]]:
+    """
+    The status and body of the responses to ``request``, which may hold
+    several pipelined requests, read until the server closes.
+    """
+    connection = await Connection.open(port)
+    try:
+        await connection.send(request)
+        responses = []
+        while not connection.reader.at_eof():
+            try:
+                status, _, body = await connection.response()
+            except Failed:
+                break
+            responses.append((status, body))
+        return responses
+    finally:
+        connection.close()
+
+
+async def refused(port: int, request: bytes, statuses: Tuple[int, ...]) -> None:
+    connection = await Connection.open(port)
+    try:
+        try:
+            await connection.send(request)
+        except ConnectionError:
+            # refused before it was all sent, the answer may still be there
+            pass
+        status, _, _ = await connection.response()
+        expect(status in statuses, f"answered {status}, not {statuses}")
+        expect(await connection.closed(), "kept the connection open")
+    finally:
+        connection.close()
+
+
+async def refused_all(
+    port: int, requests: Dict[str, Tuple[bytes, Tuple[int, ...]]]
+) -> None:
+    for name, (request, statuses) in requests.items():
+        try:
+            await refused(port, request, statuses)
+        except Failed as error:
+            raise Failed(f"{name}: {error}")
+
+
+async def keep_alive(port: int) -> None:
+    connection = await Connection.open(port)
+    try:
+        for _ in range(3):
+            await connection.send(get(b"/"))
+            status, _, body = await connection.response()
+            expect((status, body) == (200, b"hello"), f"got {status} {body!r}")
+    finally:
+        connection.close()
+
+
+PIPELINED = (
+    get(b"/")
+    + post(b"hello")
+    + get(b"/users/7")
+    + get(b"/stream")
+    + b"HEAD / HTTP/1.1\r\nhost: check\r\n\r\n"
+    + get(b"/", b"connection: close")
+)
+
+PIPELINED_ANSWERS = [
+    (200, b"hello"),
+    (200, b"hello"),
+    (200, b'{"id":7}'),
+    (200, b"012"),
+    (200, b""),
+    (200, b"hello"),
+]
+
+
+async def pipelining(port: int) -> None:
+    connection = await Connection.open(port)
+    try:
+        await connection.send(PIPELINED)
+        answers = []
+        for index in range(len(PIPELINED_ANSWERS)):
+            status, _, body = await connection.response(head_only=index == 4)
+            answers.append((status, body))
+        expect(answers == PIPELINED_ANSWERS, f"answered {answers}")
+        expect(await connection.closed(), "ignored connection: close")
+    finally:
+        connection.close()
+
+
+async def byte_at_a_time(port: int) -> None:
+    request = get(b"/users/7") + post(
+        b"5\r\nhello\r\n0\r\n\r\n", b"transfer-encoding: chunked"
+    )
+    connection = await Connection.open(port)
+    try:
+        await connection.send_slowly(request)
+        answers = [(await connection.response())[::2] for _ in range(2)]
+        expect(answers == [(200, b'{"id":7}'), (200, b"hello")], f"got {answers}")
+    finally:
+        connection.close()
+
+
+async def chunked_body(port: int) -> None:
+    body = b"3;name=value\r\nhel\r\n2\r\nlo\r\n0\r\ntrailer: x\r\n\r\n"
+    answers = await exchange(
+        port, post(body, b"transfer-encoding: chunked", b"connection: close")
+    )
+    expect(answers == [(200, b"hello")], f"got {answers}")
+
+
+async def invalid_chunk_sizes(port: int) -> None:
+    for size in (b"-5", b"+5", b"0x5", b"5_0", b"zz", b""):
+        body = size + b"\r\nhello\r\n0\r\n\r\n"
+        try:
+            await refused(port, post(body, b"transfer-encoding: chunked"), (400,))
+        except Failed as error:
+            raise Failed(f"chunk size {size!r}: {error}")
+
+
+async def framing_conflicts(port: int) -> None:
+    await refused_all(
+        port,
+        {
+            "Content-Length with chunked": (
+                post(
+                    b"5\r\nhello\r\n0\r\n\r\n",
+                    b"transfer-encoding: chunked",
+                    b"content-length: 5",
+                ),
+                (400,),
+            ),
+            "two Content-Lengths": (post(b"hello", b"content-length: 4"), (400,)),
+            "negative Content-Length": (post(b"", b"content-length: -1"), (400,)),
+        },
+    )
+
+
+async def malformed_heads(port: int) -> None:
+    await refused_all(
+        port,
+        {
+            "header without colon": (get(b"/", b"no-colon"), (400,)),
+            "space before colon": (get(b"/", b"x-name : value"), (400,)),
+            "target without slash": (get(b"nope"), (400,)),
+            "unknown transfer coding": (
+                post(b"", b"transfer-encoding: gzip"),
+                (400, 501),
+            ),
+            "WebSocket version 8": (
+                get(
+                    b"/ws",
+                    b"upgrade: websocket",
+                    b"connection: Upgrade",
+                    b"sec-websocket-key: dGhlIHNhbXBsZSBub25jZQ==",
+                    b"sec-websocket-version: 8",
+                ),
+                (400, 426),
+            ),
+        },
+    )
+
+
+async def server_limits(port: int) -> None:
+    """
+    Limits that are the native server's own: uvicorn accepts heads of any
+    size, answers every request line it cannot parse with 400 and leaves
+    unknown expectations to the app.
+    """
+    await refused_all(
+        port,
+        {
+            "20 KiB head": (get(b"/", b"x-big: " + b"a" * 20000), (431,)),
+            # sent faster than it is refused, this one needs a lingering close
+            "1 MiB head": (get(b"/", b"x-big: " + b"a" * (1 << 20)), (431,)),
+            "101 headers": (get(b"/", *[b"x-a: b"] * 101), (431,)),
+            "request line without version": (b"GET /\r\n\r\n", (400,)),
+            "HTTP/2.0 request line": (b"GET / HTTP/2.0\r\n\r\n", (505,)),
+            "unknown expectation": (post(b"hello", b"expect: magic"), (417,)),
+            "bad chunk size after 1 MiB": (
+                post(
+                    b"100000\r\n" + b"a" * (1 << 20) + b"\r\n-1\r\n\r\n",
+                    b"transfer-encoding: chunked",
+                ),
+                (400,),
+            ),
+        },
+    )
+
+
+async def expect_continue(port: int) -> None:
+    connection = await Connection.open(port)
+    try:
+        await connection.send(
+            b"POST /echo HTTP/1.1\r\nhost: check\r\nexpect: 100-continue\r\n"
+            b"content-length: 5\r\n\r\n"
+        )
+        status, _, _ = await connection.response()
+        expect(status == 100, f"answered {status} before the body")
+        await connection.send(b"hello")
+        status, _, body = await connection.response()
+        expect((status, body) == (200, b"hello"), f"got {status} {body!r}")
+    finally:
+        connection.close()
+
+
+async def http_10(port: int) -> None:
+    connection = await Connection.open(port)
+    try:
+        await connection.send(b"GET / HTTP/1.0\r\n\r\n")
+        status, _, body = await connection.response()
+        expect((status, body) == (200, b"hello"), f"got {status} {body!r}")
+        expect(await connection.closed(), "kept an HTTP/1.0 connection open")
+    finally:
+        connection.close()
+
+
+def client_frame(
+    opcode: int, payload: bytes, fin: bool = True, masked: bool = True, rsv: int = 0
+) -> bytes:
+    first = (0x80 if fin else 0) | rsv | opcode
+    length = len(payload)
+    if length < 126:
+        head = bytes((first, length))
+    elif length < 65536:
+        head = struct.pack("!BBH", first, 126, length)
+    else:
+        head = struct.pack("!BBQ", first, 127, length)
+    if not masked:
+        return head + payload
+    mask = os.urandom(4)
+    data = bytes(byte ^ mask[index % 4] for index, byte in enumerate(payload))
+    return bytes((head[0], head[1] | 0x80)) + head[2:] + mask + data
+
+
+async def read_frame(connection: Connection) -> Tuple[int, bytes]:
+    first, second = await connection.read(connection.reader.readexactly(2))
+    expect(not second & 0x80, "the server masked a frame")
+    length = second & 0x7F
+    if length == 126:
+        (length,) = struct.unpack(
+            "!H", await connection.read(connection.reader.readexactly(2))
+        )
+    elif length == 127:
+        (length,) = struct.unpack(
+            "!Q", await connection.read(connection.reader.readexactly(8))
+        )
+    payload = await connection.read(connection.reader.readexactly(length))
+    return first & 0x0F, payload
+
+
+async def websocket(port: int) -> Connection:
+    key = base64.b64encode(os.urandom(16))
+    connection = await Connection.open(port)
+    await connection.send(
+        b"GET /ws HTTP/1.1\r\nhost: check\r\nupgrade: websocket\r\n"
+        b"connection: Upgrade\r\nsec-websocket-key: %b\r\n"
+        b"sec-websocket-version: 13\r\n\r\n" % key
+    )
+    status, headers, _ = await connection.response(head_only=True)
+    accept = base64.b64encode(hashlib.sha1(key + WEBSOCKET_GUID).digest())
+    expect(status == 101, f"handshake answered {status}")
+    expect(headers.get(b"sec-websocket-accept") == accept, "wrong accept key")
+    return connection
+
+
+async def closed_with(port: int, frames: bytes, code: int) -> None:
+    connection = await websocket(port)
+    try:
+        await connection.send(frames)
+        opcode, payload = await read_frame(connection)
+        expect(opcode == 0x8, f"answered opcode {opcode:#x} {payload[:40]!r}")
+        (received,) = struct.unpack("!H", payload[:2])
+        expect(received == code, f"closed with {received}, not {code}")
+    finally:
+        connection.close()
+
+
+async def websocket_echo(port: int) -> None:
+    connection = await websocket(port)
+    try:
+        messages = [
+            (0x1, "héllo".encode()),
+            (0x2, b"\x00\xff"),
+            (0x2, b"x" * 70000),
+        ]
+        for opcode, payload in messages:
+            await connection.send(client_frame(opcode, payload))
+            answer = await read_frame(connection)
+            expect(answer == (opcode, payload), f"echoed {answer[0]:#x}")
+        await connection.send(client_frame(0x8, struct.pack("!H", 1000) + b"bye"))
+        opcode, payload = await read_frame(connection)
+        expect(opcode == 0x8, f"answered a close with opcode {opcode:#x}")
+        expect(payload[:2] == struct.pack("!H", 1000), f"closed with {payload!r}")
+        expect(await connection.closed(), "kept the connection open after close")
+    finally:
+        connection.close()
+
+
+async def websocket_fragments(port: int) -> None:
+    text = "é".encode() * 3
+    connection = await websocket(port)
+    try:
+        await connection.send(
+            client_frame(0x1, text[:1], fin=False)
+            + client_frame(0x9, b"ping")
+            + client_frame(0x0, text[1:4], fin=False)
+            + client_frame(0x0, text[4:])
+        )
+        answers = sorted([await read_frame(connection), await read_frame(connection)])
+        expect(answers == [(0x1, text), (0xA, b"ping")], f"got {answers}")
+    finally:
+        connection.close()
+
+
+async def websocket_protocol_errors(port: int) -> None:
+    frames = {
+        "unmasked frame": (client_frame(0x1, b"hi", masked=False), 1002),
+        "reserved bit": (client_frame(0x1, b"hi", rsv=0x40), 1002),
+        "unknown opcode": (client_frame(0x3, b"hi"), 1002),
+        "continuation first": (client_frame(0x0, b"hi"), 1002),
+        "message inside fragments": (
+            client_frame(0x1, b"a", fin=False) + client_frame(0x1, b"b"),
+            1002,
+        ),
+        "fragmented ping": (client_frame(0x9, b"a", fin=False), 1002),
+        "ping over 125 bytes": (client_frame(0x9, b"a" * 126), 1002),
+        "invalid UTF-8": (client_frame(0x1, b"\xff\xfe"), 1007),
+        "message over 16 MiB": (
+            struct.pack("!BBQ", 0x82, 0xFF, 16 * 1024 * 1024 + 1) + os.urandom(4),
+            1009,
+        ),
+    }
+    for name, (data, code) in frames.items():
+        try:
+            await closed_with(port, data, code)
+        except Failed as error:
+            raise Failed(f"{name}: {error}")
+
+
+# Checks every engine passes
+CHECKS: List[Check] = [
+    keep_alive,
+    pipelining,
+    byte_at_a_time,
+    chunked_body,
+    invalid_chunk_sizes,
+    framing_conflicts,
+    malformed_heads,
+    expect_continue,
+    http_10,
+    websocket_echo,
+    websocket_fragments,
+    websocket_protocol_errors,
+]
+
+# Checks of the limits only the native server enforces
+NATIVE_CHECKS: List[Check] = [server_limits]
+
+
+async def check(port: int, checks: List[Check]) -> List[str]:
+    """
+    The failures of the server listening on ``port``, one line per check.
+    """
+    failures = []
+    for run in checks:
+        try:
+            await run(port)
+        except (Failed, ConnectionError) as error:
+            failures.append(f"{run.__name__}: {error}")
+    return failures
+
+
+def failure(port: int, checks: List[Check] = CHECKS) -> Optional[str]:
+    failures = asyncio.run(check(port, checks))
+    return "\n".join(failures) if failures else None
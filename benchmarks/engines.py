@@ -0,0 +1,147 @@
+"""
+Requests per second of the servers Balboa.run(engine=...) can use, over
+loopback sockets, after running the behaviour checks of
+benchmarks/conformance.py against each of them:
+
+    python -m benchmarks.engines [requests]
+
+Each engine serves the app from a thread of this process and engines that
+are not installed (uvicorn) are skipped. The load is generated here too, so
+the numbers compare the engines rather than measure their limits.
+"""
+
+import asyncio
+import socket
+import sys
+import threading
+import time
+from typing import Callable, Dict
+
+from balboa import Balboa
+from balboa.server import Server
+
+from .conformance import CHECKS, NATIVE_CHECKS, failure
+
+PORT = 9181
+
+
+def build_app() -> Balboa:
+    app = Balboa(__name__)
+    with app.get("/") as route:
+        route.send("hello")
+    with app.head("/") as route:
+        route.send("hello")
+    with app.get("/users/{user_id:int}") as route:
+        route.json(lambda req: {"id": req.path_params["user_id"]})
+    with app.post("/echo") as route:
+
+        async def echo(req):
+            return await req.body()
+
+        route.send(echo, type="text/plain")
+    with app.get("/stream") as route:
+
+        def stream(req):
+            yield from ("0", "1", "2")
+
+        route.send(stream)
+    with app.ws("/ws") as route:
+
+        async def echo_messages(ws, clients):
+            async for message in ws.iter():
+                await ws.sender(message)
+
+        route.send(echo_messages)
+    return app
+
+
+def start_native(app: Balboa) -> Callable[[], None]:
+    server = Server(app, port=PORT)
+    thread = threading.Thread(target=server.run)
+    thread.start()
+
+    def stop() -> None:
+        server.loop.call_soon_threadsafe(server.stop)
+        thread.join()
+
+    return stop
+
+
+def start_uvicorn(app: Balboa) -> Callable[[], None]:
+    import uvicorn
+
+    config = uvicorn.Config(app, port=PORT, lifespan="off", log_level="warning")
+    server = uvicorn.Server(config)
+    thread = threading.Thread(target=server.run)
+    thread.start()
+
+    def stop() -> None:
+        server.should_exit = True
+        thread.join()
+
+    return stop
+
+
+ENGINES: Dict[str, Callable[[Balboa], Callable[[], None]]] = {
+    "native": start_native,
+    "uvicorn": start_uvicorn,
+}
+
+
+def wait_listening(timeout: float = 5.0) -> None:
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            socket.create_connection(("127.0.0.1", PORT)).close()
+            return
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.05)
+
+
+async def load(requests: int, depth: int, connections: int = 8) -> float:
+    """
+    Requests per second of GET /, ``depth`` of them pipelined at a time.
+    """
+    request = b"GET / HTTP/1.1\r\nhost: bench\r\n\r\n" * depth
+
+    async def client(count: int) -> None:
+        reader, writer = await asyncio.open_connection("127.0.0.1", PORT)
+        for _ in range(count // depth):
+            writer.write(request)
+            for _ in range(depth):
+                await reader.readuntil(b"hello")
+        writer.close()
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client(requests // connections) for _ in range(connections)))
+    return requests / (time.perf_counter() - start)
+
+
+def main(requests: int = 40_000) -> None:
+    app = build_app()
+    for name, start in ENGINES.items():
+        try:
+            stop = start(app)
+        except ImportError:
+            print(f"{name:<10} not installed")
+            continue
+        try:
+            wait_listening()
+            failed = failure(
+                PORT, CHECKS + NATIVE_CHECKS if name == "native" else CHECKS
+            )
+            if failed is not None:
+                print(f"{name:<10} failed", failed, sep="\n")
+                continue
+            print(f"{name:<10} passed the conformance checks")
+            for depth in (1, 16):
+                rate = asyncio.run(load(requests, depth))
+                print(f"{name:<10} pipelined {depth:>2} {rate:>12,.0f} requests/s")
+        finally:
+            stop()
+
+
+if __name__ == "__main__":
+    main(*(int(arg) for arg in sys.argv[1:2]))
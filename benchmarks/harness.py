@@ -0,0 +1,163 @@
+"""
+Measurement and baseline comparison for the benchmark suite.
+
+A benchmark is an ``async`` operation run many times on one event loop.
+Each run is timed on its own for the percentiles; allocations are measured
+in a separate pass with tracemalloc, which would slow the timed runs down.
+"""
+
+import asyncio
+import json
+import time
+import tracemalloc
+from typing import Any, Awaitable, Callable, Coroutine, Dict, List, Optional, Set
+
+from balboa.asgi import Message, Scope
+
+Operation = Callable[[], Awaitable[None]]
+
+# Clients of the running benchmark; the loop only keeps weak references
+background: Set["asyncio.Task[None]"] = set()
+
+
+def spawn(coroutine: Coroutine[Any, Any, None]) -> None:
+    background.add(asyncio.create_task(coroutine))
+
+
+async def stop_background() -> None:
+    for task in background:
+        task.cancel()
+    await asyncio.gather(*background, return_exceptions=True)
+    background.clear()
+
+
+def http_scope(path: str, method: str = "GET", query_string: bytes = b"") -> Scope:
+    return {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": method,
+        "path": path,
+        "query_string": query_string,
+        "headers": [(b"host", b"bench")],
+    }
+
+
+async def receive_empty() -> Message:
+    return {"type": "http.request", "body": b"", "more_body": False}
+
+
+async def discard(message: Message) -> None:
+    pass
+
+
+class Result:
+    def __init__(self, name: str, timings: List[int], elapsed: float, allocated: int):
+        timings = sorted(timings)
+        self.name = name
+        self.ops = len(timings) / elapsed
+        self.p50 = timings[len(timings) // 2] / 1000
+        self.p99 = timings[min(len(timings) - 1, len(timings) * 99 // 100)] / 1000
+        self.allocated = allocated
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "ops": self.ops,
+            "p50_us": self.p50,
+            "p99_us": self.p99,
+            "alloc_bytes": self.allocated,
+        }
+
+    def __str__(self) -> str:
+        return (
+            f"{self.name:<24} {self.ops:>12,.0f} ops/s "
+            f"{self.p50:>10.1f} {self.p99:>10.1f} us {self.allocated:>10,} B/op"
+        )
+
+
+async def measure(
+    name: str, operation: Operation, iterations: int, warmup: int = 100
+) -> Result:
+    for _ in range(warmup):
+        await operation()
+    timings = []
+    clock = time.perf_counter_ns
+    start = time.perf_counter()
+    for _ in range(iterations):
+        before = clock()
+        await operation()
+        timings.append(clock() - before)
+    elapsed = time.perf_counter() - start
+    return Result(name, timings, elapsed, await allocated(operation))
+
+
+async def allocated(operation: Operation, iterations: int = 200) -> int:
+    """
+    Average peak of the memory allocated while one operation runs.
+    """
+    total = 0
+    tracemalloc.start()
+    try:
+        for _ in range(iterations):
+            current, _ = tracemalloc.get_traced_memory()
+            tracemalloc.reset_peak()
+            await operation()
+            _, peak = tracemalloc.get_traced_memory()
+            total += peak - current
+    finally:
+        tracemalloc.stop()
+    return total // iterations
+
+
+def run(
+    benchmarks: Dict[str, Callable[[], Awaitable[Operation]]],
+    iterations: int,
+    repeat: int = 1,
+) -> List[Result]:
+    """
+    Measure each benchmark ``repeat`` times, on a new app each time, and
+    keep its fastest run: other processes only ever slow a run down.
+    """
+
+    async def main() -> List[Result]:
+        results = []
+        for name, setup in benchmarks.items():
+            best: Optional[Result] = None
+            for _ in range(repeat):
+                operation = await setup()
+                try:
+                    result = await measure(name, operation, iterations)
+                finally:
+                    await stop_background()
+                if best is None or result.ops > best.ops:
+                    best = result
+            print(best, flush=True)
+            results.append(best)
+        return results
+
+    return asyncio.run(main())
+
+
+def save(results: List[Result], path: str) -> None:
+    with open(path, "w") as file:
+        json.dump({result.name: result.as_dict() for result in results}, file, indent=2)
+        file.write("\n")
+
+
+def compare(results: List[Result], path: str, threshold: float) -> List[str]:
+    """
+    The benchmarks whose ops/s dropped by more than ``threshold`` (0.1 is
+    10%) compared with the baseline saved at ``path``.
+    """
+    with open(path) as file:
+        baseline: Dict[str, Dict[str, float]] = json.load(file)
+    regressions = []
+    for result in results:
+        previous: Optional[Dict[str, float]] = baseline.get(result.name)
+        if previous is None:
+            continue
+        change = result.ops / previous["ops"] - 1
+        print(f"{result.name:<24} {change:>+8.1%} ops/s vs baseline")
+        if change < -threshold:
+            regressions.append(result.name)
+    return regressions
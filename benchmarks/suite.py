@@ -0,0 +1,219 @@
+"""
+The benchmarks of ``python -m benchmarks``. Each entry of BENCHMARKS builds
+an app and returns the operation to time: one request, or one broadcast or
+publish delivered to every client.
+"""
+
+import asyncio
+import atexit
+import os
+import tempfile
+from typing import Awaitable, Callable, Dict, Optional
+
+from balboa import Balboa, Router, StaticCache
+
+from .harness import Operation, discard, http_scope, receive_empty, spawn
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+STATIC_SIZES = {"1k": 1024, "64k": 64 * 1024, "1m": 1024 * 1024}
+
+
+def request(app: Balboa, path: str, query_string: bytes = b"") -> Operation:
+    scope = http_scope(path, query_string=query_string)
+
+    async def operation() -> None:
+        await app(dict(scope), receive_empty, discard)
+
+    return operation
+
+
+def dispatch(routes: int) -> Callable[[], Awaitable[Operation]]:
+    async def setup() -> Operation:
+        app = Balboa(__name__)
+        for index in range(routes):
+            with app.get(f"/section{index}/page") as route:
+                route.send(f"page {index}")
+        return request(app, f"/section{routes - 1}/page")
+
+    return setup
+
+
+def mounted(routers: int, routes: int = 10) -> Callable[[], Awaitable[Operation]]:
+    async def setup() -> Operation:
+        app = Balboa(__name__)
+        for index in range(routers):
+            router = Router()
+            for page in range(routes):
+                with router.get(f"/page{page}") as route:
+                    route.send(f"page {page}")
+            app.mount(f"/section{index}", router)
+        return request(app, f"/section{routers - 1}/page{routes - 1}")
+
+    return setup
+
+
+def constant(metrics: bool = False) -> Callable[[], Awaitable[Operation]]:
+    async def setup() -> Operation:
+        app = Balboa(__name__)
+        with app.get("/") as route:
+            route.send("hello")
+        if metrics:
+            app.enable_metrics()
+        return request(app, "/")
+
+    return setup
+
+
+async def path_params() -> Operation:
+    app = Balboa(__name__)
+    with app.get("/users/{user_id:int}/posts/{slug}") as route:
+
+        def post(req):
+            return f"{req.path_params['user_id']}: {req.params['slug']}"
+
+        route.send(post)
+    return request(app, "/users/42/posts/hello-world", b"page=2")
+
+
+async def template() -> Operation:
+    app = Balboa(__name__)
+    names = ["Alice", "Bob", "Charlie", "David", "Eve"]
+    with app.get("/balboa") as route:
+
+        def balboa(req):
+            name = req.params.get("name")
+            ri = req.params.get("ri")
+            greetings = [name, *names[:-1]] if name else names[:-1]
+            return route.render(os.path.join(ROOT, "balboa.html"), locals())
+
+        route.send(balboa)
+    return request(app, "/balboa", b"name=Rocky&ri=1")
+
+
+def static_directory() -> str:
+    directory = tempfile.TemporaryDirectory(prefix="balboa-bench-")
+    atexit.register(directory.cleanup)
+    for name, size in STATIC_SIZES.items():
+        with open(os.path.join(directory.name, f"{name}.txt"), "wb") as file:
+            file.write(b"balboa " * (size // 7) + b"." * (size % 7))
+    return directory.name
+
+
+def static(name: str, cache: bool = False) -> Callable[[], Awaitable[Operation]]:
+    async def setup() -> Operation:
+        app = Balboa(__name__)
+        app.mount(
+            "/assets", dir=static_directory(), cache=StaticCache() if cache else None
+        )
+        return request(app, f"/assets/{name}.txt")
+
+    return setup
+
+
+class Deliveries:
+    """
+    Counts the messages clients got, to wait until all of them have one.
+    """
+
+    def __init__(self):
+        self.remaining = 0
+        self.done: Optional[asyncio.Future[None]] = None
+
+    def expect(self, count: int) -> Awaitable[None]:
+        self.remaining = count
+        self.done = asyncio.get_running_loop().create_future()
+        return self.done
+
+    def delivered(self) -> None:
+        self.remaining -= 1
+        if self.remaining == 0:
+            self.done.set_result(None)
+
+
+async def forever() -> None:
+    await asyncio.get_running_loop().create_future()
+
+
+def websocket_broadcast(clients: int) -> Callable[[], Awaitable[Operation]]:
+    async def setup() -> Operation:
+        app = Balboa(__name__)
+        deliveries = Deliveries()
+        connections = []
+        with app.ws("/feed") as socket:
+
+            async def handler(ws, clients):
+                connections.append(ws)
+                await forever()
+
+            socket.send(handler, queue_size=16)
+
+        async def receive():
+            await forever()
+
+        async def send(message):
+            if message["type"] == "websocket.send":
+                deliveries.delivered()
+
+        scope = {"type": "websocket", "path": "/feed", "headers": []}
+        for _ in range(clients):
+            spawn(app(dict(scope), receive, send))
+        while len(connections) < clients:
+            await asyncio.sleep(0)
+        route = connections[0].route
+
+        async def operation() -> None:
+            done = deliveries.expect(clients)
+            await connections[0].broadcast(route.clients, "x" * 64)
+            await done
+
+        return operation
+
+    return setup
+
+
+def sse_fanout(clients: int) -> Callable[[], Awaitable[Operation]]:
+    async def setup() -> Operation:
+        app = Balboa(__name__)
+        deliveries = Deliveries()
+        with app.sse("/events") as sse:
+            sse.channel("ticks")
+        channel = app.events.channel("ticks", history=16)
+
+        async def receive():
+            await forever()
+
+        async def send(message):
+            if message.get("more_body") and message.get("body"):
+                deliveries.delivered()
+
+        for _ in range(clients):
+            spawn(app(http_scope("/events"), receive, send))
+        while len(channel.subscribers) < clients:
+            await asyncio.sleep(0)
+
+        async def operation() -> None:
+            done = deliveries.expect(clients)
+            channel.publish('{"price": 231.4}', "tick")
+            await done
+
+        return operation
+
+    return setup
+
+
+BENCHMARKS: Dict[str, Callable[[], Awaitable[Operation]]] = {
+    "dispatch_10": dispatch(10),
+    "dispatch_100": dispatch(100),
+    "dispatch_1000": dispatch(1000),
+    "mounted_100x10": mounted(100),
+    "constant": constant(),
+    "constant_metrics": constant(metrics=True),
+    "path_params": path_params,
+    "template": template,
+    **{f"static_{name}": static(name) for name in STATIC_SIZES},
+    "static_64k_cached": static("64k", cache=True),
+    "websocket_broadcast_100": websocket_broadcast(100),
+    "websocket_broadcast_1000": websocket_broadcast(1000),
+    "sse_fanout_100": sse_fanout(100),
+    "sse_fanout_1000": sse_fanout(1000),
+}
@@ -0,0 +1,63 @@
+"""
+Messages per second a single WebSocket connection can receive through
+ws.iter() and ws.batches(). Before the receive loop rework every message
+paid a hard-coded 0.1s sleep, capping a connection at 10 messages/second.
+
+    python -m benchmarks.websocket_receive [messages]
+"""
+
+import asyncio
+import sys
+import time
+
+from balboa import Balboa
+
+
+def build_app() -> Balboa:
+    app = Balboa(__name__)
+
+    with app.ws("/iter") as socket:
+
+        async def iterate(ws, clients):
+            async for _ in ws.iter():
+                pass
+
+        socket.send(iterate)
+
+    with app.ws("/batches") as socket:
+
+        async def batches(ws, clients):
+            async for _ in ws.batches():
+                pass
+
+        socket.send(batches)
+
+    return app
+
+
+async def receive_rate(app: Balboa, path: str, messages: int) -> float:
+    frames = [{"type": "websocket.receive", "text": "x" * 32}] * messages
+    frames.append({"type": "websocket.disconnect", "code": 1000})
+    events = iter(frames)
+
+    async def receive():
+        return next(events)
+
+    async def send(message):
+        pass
+
+    scope = {"type": "websocket", "path": path, "headers": [], "query_string": b""}
+    start = time.perf_counter()
+    await app(scope, receive, send)
+    return messages / (time.perf_counter() - start)
+
+
+def main(messages: int = 200_000) -> None:
+    app = build_app()
+    for path in ("/iter", "/batches"):
+        rate = asyncio.run(receive_rate(app, path, messages))
+        print(f"{path:<10} {rate:>14,.0f} messages/s per connection")
+
+
+if __name__ == "__main__":
+    main(*(int(arg) for arg in sys.argv[1:2]))
@@ -3,7 +3,7 @@
 # from db import db
 # from balboa import Balboa, Request
 
-from balboa import Balboa
+from balboa import Balboa, HTTPError, Router, StaticCache
 import math
 
 app = Balboa(__name__)
@@ -17,7 +17,8 @@ with app.get('/search') as res:
         return f'Hello, {name}!' if name else 'Hello, World!'
     res.send(hello, 'text/plain')
 
-app.mount('/framework', dir='balboa')
+# keep the framework assets in memory, revalidated once per second
+app.mount('/framework', dir='balboa', cache=StaticCache())
 
 names = ['Alice', 'Bob', 'Charlie', 'David', 'Eve']
 
@@ -25,37 +26,43 @@ with app.get('/balboa') as res:
     def balboa(req):
         name = req.params.get('name')
         ri = req.params.get('ri')
-        hello = ''
-        for n in names:
-            hello += res.render('hello.html', locals()) if name else ''
-            name = n
-        image = res.render('image.html', locals()) if ri == '1' else ''
+        # greet the visitor (if any), then everyone but the last name
+        greetings = [name, *names[:-1]] if name else names[:-1]
         return res.render('balboa.html', locals())
     res.send(balboa)
 
-with app.get('/') as about:
-    about.send('Hello!')
+# the /about pages, mounted below as a unit
+about = Router()
 
-with app.get('/{name}/hello') as about_hello:
+with about.get('/') as res:
+    res.send('Hello!')
+
+with about.get('/{name}/hello') as about_hello:
     about_hello.send('Hello, {name}!')
 
-with app.get('/{name}') as about_name:
+with about.get('/{name}') as about_name:
+    about_name.query(age=(int, 10))
     def handler(req):
         name = req.params.get('name')
-        age = req.params.get('age') or 10
-        detail = f' and you are {age} years old' if age else ''
-        return f'Your name is {name}{detail}.'
+        age = req.params.get('age')
+        return f'Your name is {name} and you are {age} years old.'
     about_name.send(handler, 'text/plain')
 
+def either(req, name, alias):
+    value = req.params[name]
+    if value is None:
+        value = req.params[alias]
+    if value is None:
+        raise HTTPError(400, f'Missing query parameter {name!r}')
+    return value
+
 # Sphere surface area endpoint
 with app.get('/sphere') as res:
+    # radius (or its short alias r) is converted to float before the handler
+    # runs, invalid or missing values are answered with 400 Bad Request
+    res.query(radius=(float, None), r=(float, None))
     def sphere(req):
-        # read radius from query parameter 'radius' or 'r'
-        radius = req.params.get('radius') or req.params.get('r')
-        try:
-            radius = float(radius)
-        except (TypeError, ValueError):
-            return '<p>Invalid radius provided.</p>'
+        radius = either(req, 'radius', 'r')
         # compute surface area of a sphere
         area = 4 * math.pi * radius * radius
         # render HTML template with computed values
@@ -64,15 +71,11 @@ with app.get('/sphere') as res:
 
 # Cylinder surface area endpoint
 with app.get('/cylinder') as res:
+    res.query(radius=(float, None), r=(float, None),
+              height=(float, None), h=(float, None))
     def cylinder(req):
-        # read radius and height from query parameters
-        radius = req.params.get('radius') or req.params.get('r')
-        height = req.params.get('height') or req.params.get('h')
-        try:
-            radius = float(radius)
-            height = float(height)
-        except (TypeError, ValueError):
-            return '<p>Invalid radius or height provided.</p>'
+        radius = either(req, 'radius', 'r')
+        height = either(req, 'height', 'h')
         # compute total surface area of cylinder: 2πr(r + h)
         area = 2 * math.pi * radius * (radius + height)
         # render HTML template with computed values
@@ -82,8 +85,6 @@ with app.get('/cylinder') as res:
 # with app.get('/.*') as any:
 #     any.send('Hello anything!')
 
-app.mount('/about', about_name)
-app.mount('/about', about_hello)
 app.mount('/about', about)
 
 if __name__ == '__main__':